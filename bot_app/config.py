@@ -33,6 +33,25 @@ RABBITMQ_PASS = os.getenv("RABBITMQ_PASS", "guest")
 # вот эти имена очередей должны совпадать везде:
 TASK_QUEUE   = os.getenv("RABBITMQ_TASK_QUEUE",   "task_queue")
 RESULT_QUEUE = os.getenv("RABBITMQ_RESULT_QUEUE", "result_queue")
+# отдельная очередь для интерактивных задач (чат), чтобы генерация не задерживала ответы
+INTERACTIVE_TASK_QUEUE = os.getenv("RABBITMQ_INTERACTIVE_TASK_QUEUE", "task_queue_interactive")
+# Справедливый планировщик (queue_server): при SCHEDULER_ENABLED=1 задачи идут ему, а не воркерам напрямую.
+# Включать после запуска планировщика и после воркеров (см. queue_server/main.py)
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "0") == "1"
+SCHEDULER_QUEUE   = os.getenv("RABBITMQ_SCHEDULER_QUEUE", "task_inbox")
+
+
+def task_queue(interactive: bool = False) -> str:
+    """Очередь, в которую бот публикует задачу."""
+    if SCHEDULER_ENABLED:
+        return SCHEDULER_QUEUE
+    return INTERACTIVE_TASK_QUEUE if interactive else TASK_QUEUE
+
+# публикация задач: число каналов с подтверждениями, размер пачки, буфер и время повторов
+PUBLISHER_CHANNELS      = int(os.getenv("PUBLISHER_CHANNELS", "2"))
+PUBLISHER_BATCH_SIZE    = int(os.getenv("PUBLISHER_BATCH_SIZE", "50"))
+PUBLISHER_BUFFER_SIZE   = int(os.getenv("PUBLISHER_BUFFER_SIZE", "1000"))
+PUBLISHER_RETRY_TIMEOUT = float(os.getenv("PUBLISHER_RETRY_TIMEOUT", "30"))   # секунд
 # ——————————————
 # Redis (FSM и кэш)
 # ——————————————
@@ -64,3 +83,47 @@ if _openai_keys:
     OPENAI_API_KEYS = [k.strip() for k in _openai_keys.split(",") if k.strip()]
 else:
     OPENAI_API_KEYS = []
+
+# ——————————————
+# Streaming результатов (редактирование сообщения по мере генерации)
+# ——————————————
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.5"))   # секунд между правками одного сообщения
+
+# ——————————————
+# Claim-check хранилище PDF (должно совпадать с настройками воркера)
+# ——————————————
+BLOB_DIR = os.getenv("BLOB_DIR", "/var/lib/riverai/blobs")
+BLOB_TTL = int(os.getenv("BLOB_TTL", str(24 * 3600)))
+
+# ——————————————
+# Доставка результатов в Telegram
+# ——————————————
+RESULT_PREFETCH = int(os.getenv("RESULT_PREFETCH", "32"))      # неподтверждённых результатов в работе
+RESULT_PER_CHAT = int(os.getenv("RESULT_PER_CHAT", "2"))       # из них у одного чата (остальные — обратно в очередь)
+RESULT_REQUEUE_DELAY = float(os.getenv("RESULT_REQUEUE_DELAY", "0.5"))  # секунд перед возвратом в очередь
+TG_GLOBAL_RATE  = float(os.getenv("TG_GLOBAL_RATE", "25"))     # сообщений/с на весь бот (лимит Telegram — 30)
+TG_GLOBAL_BURST = float(os.getenv("TG_GLOBAL_BURST", "5"))
+TG_CHAT_RATE    = float(os.getenv("TG_CHAT_RATE", "1"))        # сообщений/с в один чат
+TG_CHAT_BURST   = float(os.getenv("TG_CHAT_BURST", "3"))
+TG_MAX_RETRIES  = int(os.getenv("TG_MAX_RETRIES", "3"))        # повторов после 429
+
+# ——————————————
+# Кэш пользователей (память процесса → Redis → PostgreSQL)
+# ——————————————
+USER_CACHE_SIZE      = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_LOCAL_TTL = float(os.getenv("USER_CACHE_LOCAL_TTL", "30"))   # секунд; другие экземпляры бота его не сбрасывают
+USER_CACHE_REDIS_TTL = int(os.getenv("USER_CACHE_REDIS_TTL", "3600"))
+# Расшифрованные профили учеников (только память процесса)
+STUDENT_CACHE_SIZE = int(os.getenv("STUDENT_CACHE_SIZE", "20000"))
+STUDENT_CACHE_TTL  = float(os.getenv("STUDENT_CACHE_TTL", "600"))   # секунд
+
+# ——————————————
+# Идемпотентность задач
+# ——————————————
+# Повторная отправка того же действия (пользователь, ученик, тип задачи) в пределах окна отбрасывается
+DEDUP_WINDOW     = int(os.getenv("DEDUP_WINDOW", "15"))   # секунд
+DEDUP_TASK_TYPES = {t.strip() for t in os.getenv(
+    "DEDUP_TASK_TYPES", "generate_plan,generate_tasks,generate_tasks_batch,check_homework"
+).split(",") if t.strip()}
+# Сколько помнить доставленные task_id (повтор результата воркером не отправляется второй раз)
+DELIVERED_TTL    = int(os.getenv("DELIVERED_TTL", str(24 * 3600)))
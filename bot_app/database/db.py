@@ -1,5 +1,10 @@
+import logging
+
 import asyncpg
+from bot_app import redis_cache
 from bot_app.utils import encryption
+from bot_app.database import student_cache, user_cache
+from common import usage_meter
 
 # Connection pool (initialized in startup)
 _pool: asyncpg.Pool = None
@@ -17,15 +22,37 @@ def _get_pool():
 
 # ---------- User-related operations ----------
 
-async def get_user_by_tg_id(telegram_id: int):
-    """Fetch a user by Telegram ID. Returns a record or None."""
+# Без password_hash: профиль кэшируется, а хеш читается только при проверке пароля
+_USER_COLUMNS = "telegram_id, name_enc, plan, usage_count, usage_limit, language, notifications, ydisk_token_enc"
+
+async def get_user_by_tg_id(telegram_id: int, fresh: bool = False):
+    """
+    Fetch a user by Telegram ID. Returns a dict or None.
+    Served from the user cache (process, then Redis); fresh=True reads Postgres
+    and refreshes the cache (e.g. for usage counters updated by the worker).
+    """
+    if not fresh:
+        user = await user_cache.get(telegram_id)
+        if user is not None:
+            return user
     pool = _get_pool()
     async with pool.acquire() as conn:
-        row = await conn.fetchrow("SELECT telegram_id, name_enc, plan, usage_count, usage_limit, language, notifications, password_hash, ydisk_token_enc FROM users WHERE telegram_id=$1", telegram_id)
-        return row
-
-async def create_user(telegram_id: int, name: str):
-    """Create a new user with given telegram_id and name. Returns the new record."""
+        row = await conn.fetchrow(f"SELECT {_USER_COLUMNS} FROM users WHERE telegram_id=$1", telegram_id)
+    if row is None:
+        return None
+    user = dict(row)
+    await user_cache.put(user)
+    return user
+
+async def get_or_create_user(telegram_id: int, name: str):
+    """
+    Return the user, creating it with defaults if needed. A cache miss costs
+    one round trip without writing to an existing row: the CTE returns the inserted
+    row, or the existing one when the insert hits the conflict.
+    """
+    user = await user_cache.get(telegram_id)
+    if user is not None:
+        return user
     pool = _get_pool()
     # Encrypt the name for storage
     name_enc = encryption.encrypt_str(name) if name else ""
@@ -38,110 +65,139 @@ async def create_user(telegram_id: int, name: str):
     password_hash = ""  # no password set initially
     ydisk_token_enc = ""
     async with pool.acquire() as conn:
-        await conn.execute("""
-            INSERT INTO users (telegram_id, name_enc, plan, usage_count, usage_limit, language, notifications, password_hash, ydisk_token_enc)
-            VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
-            ON CONFLICT (telegram_id) DO NOTHING
+        row = await conn.fetchrow(f"""
+            WITH ins AS (
+                INSERT INTO users (telegram_id, name_enc, plan, usage_count, usage_limit, language, notifications, password_hash, ydisk_token_enc)
+                VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
+                ON CONFLICT (telegram_id) DO NOTHING
+                RETURNING {_USER_COLUMNS}
+            )
+            SELECT {_USER_COLUMNS} FROM ins
+            UNION ALL
+            SELECT {_USER_COLUMNS} FROM users WHERE telegram_id = $1
+            LIMIT 1
         """, telegram_id, name_enc, plan, usage_count, usage_limit, language, notifications, password_hash, ydisk_token_enc)
-        # Return the user (fetch it)
-        row = await conn.fetchrow("SELECT telegram_id, name_enc, plan, usage_count, usage_limit, language, notifications, password_hash, ydisk_token_enc FROM users WHERE telegram_id=$1", telegram_id)
-        return row
+        if row is None:
+            # Строку вставил параллельный запрос уже после снимка нашего SELECT
+            row = await conn.fetchrow(f"SELECT {_USER_COLUMNS} FROM users WHERE telegram_id=$1", telegram_id)
+    user = dict(row)
+    await user_cache.put(user)
+    return user
+
+async def create_user(telegram_id: int, name: str):
+    """Create a new user with given telegram_id and name (no-op if it exists). Returns the user."""
+    return await get_or_create_user(telegram_id, name)
+
+async def get_user_password_hash(telegram_id: int) -> str:
+    """Password hash straight from Postgres (never cached); "" if no password is set."""
+    pool = _get_pool()
+    async with pool.acquire() as conn:
+        password_hash = await conn.fetchval("SELECT password_hash FROM users WHERE telegram_id=$1", telegram_id)
+    return password_hash or ""
 
 async def update_user_name(user_id: int, new_name: str):
     pool = _get_pool()
     name_enc = encryption.encrypt_str(new_name)
     async with pool.acquire() as conn:
         await conn.execute("UPDATE users SET name_enc=$1 WHERE telegram_id=$2", name_enc, user_id)
+    await user_cache.invalidate(user_id)
 
 async def update_user_password(user_id: int, new_password_hash: str):
     pool = _get_pool()
     async with pool.acquire() as conn:
         await conn.execute("UPDATE users SET password_hash=$1 WHERE telegram_id=$2", new_password_hash, user_id)
+    await user_cache.invalidate(user_id)
 
 async def update_user_language(user_id: int, new_lang: str):
     pool = _get_pool()
     async with pool.acquire() as conn:
         await conn.execute("UPDATE users SET language=$1 WHERE telegram_id=$2", new_lang, user_id)
+    await user_cache.invalidate(user_id)
 
 async def update_user_notifications(user_id: int, enabled: bool):
     pool = _get_pool()
     async with pool.acquire() as conn:
         await conn.execute("UPDATE users SET notifications=$1 WHERE telegram_id=$2", enabled, user_id)
+    await user_cache.invalidate(user_id)
 
 async def update_user_ydisk_token(user_id: int, token: str):
     pool = _get_pool()
     token_enc = encryption.encrypt_str(token)
     async with pool.acquire() as conn:
         await conn.execute("UPDATE users SET ydisk_token_enc=$1 WHERE telegram_id=$2", token_enc, user_id)
+    await user_cache.invalidate(user_id)
 
 # ---------- Student-related operations ----------
 
+_STUDENT_COLUMNS = "id, user_id, profile_enc, name_enc, subject_enc, level_enc, notes_enc"
+
+def _decrypt_student(row) -> dict:
+    return {"id": row["id"], "user_id": row["user_id"], **encryption.decrypt_profile(row)}
+
 async def get_students_by_user(user_id: int):
-    """Retrieve all students for a given user (decrypt fields for use)."""
+    """Retrieve all students for a given user (decrypted; served from the in-process cache)."""
+    students = student_cache.get_roster(user_id)
+    if students is not None:
+        return students
     pool = _get_pool()
     async with pool.acquire() as conn:
-        rows = await conn.fetch("SELECT id, name_enc, subject_enc, level_enc, notes_enc FROM students WHERE user_id=$1 ORDER BY id", user_id)
-        students = []
-        for row in rows:
-            name = encryption.decrypt_str(row["name_enc"]) if row["name_enc"] else ""
-            subject = encryption.decrypt_str(row["subject_enc"]) if row["subject_enc"] else ""
-            level = encryption.decrypt_str(row["level_enc"]) if row["level_enc"] else ""
-            notes = encryption.decrypt_str(row["notes_enc"]) if row["notes_enc"] else ""
-            students.append({
-                "id": row["id"],
-                "name": name,
-                "subject": subject,
-                "level": level,
-                "notes": notes
-            })
-        return students
+        rows = await conn.fetch(f"SELECT {_STUDENT_COLUMNS} FROM students WHERE user_id=$1 ORDER BY id", user_id)
+    students = [_decrypt_student(row) for row in rows]
+    student_cache.put_roster(user_id, students)
+    return students
 
 async def get_student(student_id: int):
     """Get a single student record (with decrypted fields)."""
+    student = student_cache.get_student(student_id)
+    if student is not None:
+        return student
     pool = _get_pool()
     async with pool.acquire() as conn:
-        row = await conn.fetchrow("SELECT id, user_id, name_enc, subject_enc, level_enc, notes_enc FROM students WHERE id=$1", student_id)
-        if row:
-            return {
-                "id": row["id"],
-                "user_id": row["user_id"],
-                "name": encryption.decrypt_str(row["name_enc"]) if row["name_enc"] else "",
-                "subject": encryption.decrypt_str(row["subject_enc"]) if row["subject_enc"] else "",
-                "level": encryption.decrypt_str(row["level_enc"]) if row["level_enc"] else "",
-                "notes": encryption.decrypt_str(row["notes_enc"]) if row["notes_enc"] else ""
-            }
+        row = await conn.fetchrow(f"SELECT {_STUDENT_COLUMNS} FROM students WHERE id=$1", student_id)
+    if row is None:
         return None
+    student = _decrypt_student(row)
+    student_cache.put_student(student)
+    return student
 
 async def add_student(user_id: int, name: str, subject: str, level: str, notes: str):
-    """Add a new student for the user (store encrypted values)."""
+    """Add a new student for the user (one encrypted envelope, cache the plaintext)."""
     pool = _get_pool()
-    name_enc = encryption.encrypt_str(name)
-    subject_enc = encryption.encrypt_str(subject)
-    level_enc = encryption.encrypt_str(level)
-    notes_enc = encryption.encrypt_str(notes) if notes else ""
+    profile_enc = encryption.encrypt_profile({"name": name, "subject": subject, "level": level, "notes": notes})
     async with pool.acquire() as conn:
         row = await conn.fetchrow("""
-            INSERT INTO students (user_id, name_enc, subject_enc, level_enc, notes_enc)
-            VALUES ($1, $2, $3, $4, $5) RETURNING id
-        """, user_id, name_enc, subject_enc, level_enc, notes_enc)
-        return row["id"] if row else None
+            INSERT INTO students (user_id, profile_enc) VALUES ($1, $2) RETURNING id
+        """, user_id, profile_enc)
+    if not row:
+        return None
+    student_cache.put_student({
+        "id": row["id"], "user_id": user_id,
+        "name": name, "subject": subject, "level": level, "notes": notes or "",
+    })
+    return row["id"]
 
 async def update_student(student_id: int, name: str, subject: str, level: str, notes: str):
     pool = _get_pool()
-    name_enc = encryption.encrypt_str(name)
-    subject_enc = encryption.encrypt_str(subject)
-    level_enc = encryption.encrypt_str(level)
-    notes_enc = encryption.encrypt_str(notes) if notes else ""
+    profile_enc = encryption.encrypt_profile({"name": name, "subject": subject, "level": level, "notes": notes})
     async with pool.acquire() as conn:
-        await conn.execute("""
-            UPDATE students SET name_enc=$1, subject_enc=$2, level_enc=$3, notes_enc=$4
-            WHERE id=$5
-        """, name_enc, subject_enc, level_enc, notes_enc, student_id)
+        # Запись в новом формате; старые поколоночные значения очищаются
+        row = await conn.fetchrow("""
+            UPDATE students SET profile_enc=$1, name_enc=NULL, subject_enc=NULL, level_enc=NULL, notes_enc=NULL
+            WHERE id=$2 RETURNING user_id
+        """, profile_enc, student_id)
+    if row is None:
+        student_cache.remove_student(student_id, None)
+        return
+    student_cache.put_student({
+        "id": student_id, "user_id": row["user_id"],
+        "name": name, "subject": subject, "level": level, "notes": notes or "",
+    })
 
 async def delete_student(student_id: int):
     pool = _get_pool()
     async with pool.acquire() as conn:
-        await conn.execute("DELETE FROM students WHERE id=$1", student_id)
+        row = await conn.fetchrow("DELETE FROM students WHERE id=$1 RETURNING user_id", student_id)
+    student_cache.remove_student(student_id, row["user_id"] if row else None)
 
 # ---------- Subscription and usage ----------
 
@@ -150,6 +206,19 @@ async def increment_usage(user_id: int):
     pool = _get_pool()
     async with pool.acquire() as conn:
         await conn.execute("UPDATE users SET usage_count = usage_count + 1 WHERE telegram_id=$1", user_id)
+    await user_cache.invalidate(user_id)
+
+async def get_usage_count(user: dict) -> int:
+    """
+    usage_count from the row plus requests the worker has counted in Redis
+    but not yet flushed to Postgres (see worker/services/usage_meter.py).
+    """
+    try:
+        pending = await usage_meter.pending_delta(redis_cache._get_client(), user["telegram_id"])
+    except Exception as e:
+        logging.warning(f"usage meter: Redis unavailable, showing DB value only: {e}")
+        pending = 0
+    return user["usage_count"] + pending
 
 async def set_plan(user_id: int, plan: str, new_limit: int = None):
     """Update user's subscription plan (and optionally usage limit)."""
@@ -159,4 +228,5 @@ async def set_plan(user_id: int, plan: str, new_limit: int = None):
             await conn.execute("UPDATE users SET plan=$1, usage_limit=$2 WHERE telegram_id=$3", plan, new_limit, user_id)
         else:
             await conn.execute("UPDATE users SET plan=$1 WHERE telegram_id=$2", plan, user_id)
+    await user_cache.invalidate(user_id)
 
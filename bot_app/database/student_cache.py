@@ -0,0 +1,52 @@
+from bot_app import config
+from common.cache import TTLCache
+
+# Расшифрованные профили учеников живут только в памяти процесса (в Redis не попадают)
+# student_id -> {"id", "user_id", "name", "subject", "level", "notes"}
+_students = TTLCache(config.STUDENT_CACHE_SIZE, config.STUDENT_CACHE_TTL)
+# user_id -> [student_id, ...] в порядке id
+_rosters = TTLCache(config.STUDENT_CACHE_SIZE, config.STUDENT_CACHE_TTL)
+
+
+def get_student(student_id: int) -> dict | None:
+    student = _students.get(student_id)
+    return dict(student) if student is not None else None
+
+
+def get_roster(user_id: int) -> list[dict] | None:
+    """Cached student list of a user, or None if it is not cached completely."""
+    ids = _rosters.get(user_id)
+    if ids is None:
+        return None
+    students = []
+    for sid in ids:
+        student = _students.get(sid)
+        if student is None:
+            # Профиль вытеснен из LRU — список неполный, перечитываем из БД
+            _rosters.pop(user_id)
+            return None
+        students.append(dict(student))
+    return students
+
+
+def put_student(student: dict) -> None:
+    """Store (or replace) a profile; adds it to its owner's cached roster."""
+    _students.set(student["id"], dict(student))
+    ids = _rosters.get(student["user_id"])
+    if ids is not None and student["id"] not in ids:
+        ids.append(student["id"])
+        ids.sort()
+
+
+def put_roster(user_id: int, students: list[dict]) -> None:
+    for student in students:
+        _students.set(student["id"], dict(student, user_id=user_id))
+    _rosters.set(user_id, [s["id"] for s in students])
+
+
+def remove_student(student_id: int, user_id: int | None) -> None:
+    _students.pop(student_id)
+    if user_id is not None:
+        ids = _rosters.get(user_id)
+        if ids is not None and student_id in ids:
+            ids.remove(student_id)
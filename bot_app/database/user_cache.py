@@ -0,0 +1,48 @@
+import json
+import logging
+
+from bot_app import config, redis_cache
+from common.cache import TTLCache
+
+KEY_PREFIX = "user:"
+
+# Первый уровень — память процесса (короткий TTL: другие экземпляры бота его не сбрасывают)
+_local = TTLCache(config.USER_CACHE_SIZE, config.USER_CACHE_LOCAL_TTL)
+
+
+async def get(telegram_id: int) -> dict | None:
+    """User from the in-process tier, then from Redis; None on a miss."""
+    user = _local.get(telegram_id)
+    if user is not None:
+        return user
+    try:
+        raw = await redis_cache._get_client().get(KEY_PREFIX + str(telegram_id))
+    except Exception as e:
+        logging.warning(f"user cache: Redis unavailable: {e}")
+        return None
+    if raw is None:
+        return None
+    user = json.loads(raw)
+    _local.set(telegram_id, user)
+    return user
+
+
+async def put(user: dict) -> None:
+    # Хеш пароля не кэшируем: проверка пароля читает его из БД (db.get_user_password_hash)
+    user = {k: v for k, v in user.items() if k != "password_hash"}
+    _local.set(user["telegram_id"], user)
+    try:
+        await redis_cache._get_client().set(
+            KEY_PREFIX + str(user["telegram_id"]), json.dumps(user), ex=config.USER_CACHE_REDIS_TTL
+        )
+    except Exception as e:
+        logging.warning(f"user cache: Redis unavailable: {e}")
+
+
+async def invalidate(telegram_id: int) -> None:
+    """Drop the user from both tiers (called after every write to users)."""
+    _local.pop(telegram_id)
+    try:
+        await redis_cache._get_client().delete(KEY_PREFIX + str(telegram_id))
+    except Exception as e:
+        logging.warning(f"user cache: Redis unavailable: {e}")
@@ -1,6 +1,4 @@
 import logging
-import json
-import aio_pika
 
 from aiogram import Router, F
 from aiogram.types import CallbackQuery, Message
@@ -8,6 +6,8 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
 
 from bot_app import config
+from bot_app.publisher import publisher
+from bot_app.utils import idempotency
 from bot_app.keyboards.chat_menu import chat_menu_kb
 
 router = Router()
@@ -25,7 +25,7 @@ async def cb_chat_gpt(callback: CallbackQuery, state: FSMContext):
     )
 
 @router.message(ChatGPTDialog.active)
-async def handle_gpt_dialog_message(message: Message, state: FSMContext):
+async def handle_gpt_dialog_message(message: Message, state: FSMContext, user=None):
     data = await state.get_data()
     student_id = data.get("student_id")
     user_id    = message.from_user.id
@@ -36,21 +36,17 @@ async def handle_gpt_dialog_message(message: Message, state: FSMContext):
         task = {"type":"end_chat", "user_id":user_id, "student_id":student_id}
     else:
         task = {"type":"chat_gpt", "user_id":user_id, "student_id":student_id, "message":text}
+    if user:
+        task["plan"] = user["plan"]
+
+    # task_id — ключ идемпотентности (воркер не выполняет задачу с тем же task_id повторно)
+    if await idempotency.claim(task):
+        await message.answer("⏳ Это сообщение уже отправлено ИИ, ожидайте ответ...")
+        return
 
     try:
-        # Подключаемся к RabbitMQ и публикуем задачу в очередь task
-        connection = await aio_pika.connect_robust(
-            host=config.RABBITMQ_HOST,
-            port=config.RABBITMQ_PORT,
-            login=config.RABBITMQ_USER,
-            password=config.RABBITMQ_PASS,
-        )
-        channel = await connection.channel()
-        await channel.default_exchange.publish(
-            aio_pika.Message(body=json.dumps(task).encode()),
-            routing_key=config.TASK_QUEUE,   # <— теперь единообразно
-        )
-        await connection.close()
+        # Публикуем задачу в интерактивную очередь (или планировщику) через общий publisher
+        await publisher.publish(task, config.task_queue(interactive=True))
 
         # Сообщаем пользователю
         if task["type"] == "end_chat":
@@ -67,4 +63,5 @@ async def handle_gpt_dialog_message(message: Message, state: FSMContext):
 
     except Exception:
         logging.exception("Ошибка публикации задачи в очередь")
+        await idempotency.release(task)
         await message.answer("⚠️ Не удалось отправить задачу в очередь. Попробуйте позже.")
@@ -6,6 +6,8 @@ from aiogram.fsm.state import StatesGroup, State
 from bot_app.keyboards import chat_menu as chat_kb
 from bot_app import database
 from bot_app import config
+from bot_app.publisher import publisher
+from bot_app.utils import idempotency
 
 router = Router()
 
@@ -16,6 +18,9 @@ class GeneratePlanFSM(StatesGroup):
 class GenerateTasksFSM(StatesGroup):
     waiting_for_description = State()
 
+class GenerateTasksBatchFSM(StatesGroup):
+    waiting_for_description = State()
+
 class HomeworkCheckFSM(StatesGroup):
     waiting_for_file = State()
 
@@ -24,6 +29,28 @@ class RefineFSM(StatesGroup):
     waiting_for_tasks_feedback = State()
     waiting_for_check_feedback = State()
 
+async def _publish_task(task: dict, user=None) -> bool:
+    """
+    Publish a task to the worker queue (or the scheduler inbox) through the shared bot publisher.
+    The user's plan is attached so the scheduler can weight the task by tier.
+    Returns False (nothing is published) if the same action for this student
+    was already sent within DEDUP_WINDOW — a double tap or a repeated message.
+    """
+    if user:
+        task["plan"] = user["plan"]
+    if await idempotency.claim(task):
+        return False
+    try:
+        await publisher.publish(task, config.task_queue())
+    except Exception:
+        await idempotency.release(task)
+        raise
+    return True
+
+async def _reply_duplicate(message: Message, state: FSMContext):
+    await state.clear()
+    await message.answer("⏳ Этот запрос уже выполняется, результат придёт в чат.")
+
 # Handle "Generate Study Plan" button
 @router.callback_query(F.data.startswith("gen_plan:"))
 async def cb_generate_plan(callback: CallbackQuery, state: FSMContext):
@@ -36,7 +63,7 @@ async def cb_generate_plan(callback: CallbackQuery, state: FSMContext):
 
 # Receive plan description and send task to worker
 @router.message(GeneratePlanFSM.waiting_for_description)
-async def process_plan_description(message: Message, state: FSMContext):
+async def process_plan_description(message: Message, state: FSMContext, user=None):
     description = message.text.strip()
     data = await state.get_data()
     student_id = data.get("student_id")
@@ -49,13 +76,9 @@ async def process_plan_description(message: Message, state: FSMContext):
         "student_id": student_id,
         "description": description
     }
-    # Use aio_pika channel stored in config (set up in main)
-    from bot_app import rabbit_channel  # use global channel from main
-    import json
-    await rabbit_channel.default_exchange.publish(
-        aio_pika.Message(body=json.dumps(task).encode('utf-8')),
-        routing_key=config.RABBITMQ_TASK_QUEUE
-    )
+    if not await _publish_task(task, user):
+        await _reply_duplicate(message, state)
+        return
     await message.answer("🕔 Генерируется учебный план, пожалуйста подождите...")
     # Clear state (result will be handled by result consumer)
     await state.clear()
@@ -70,7 +93,7 @@ async def cb_generate_tasks(callback: CallbackQuery, state: FSMContext):
                                      reply_markup=chat_kb.back_button("← Отмена", "back:chat"))
 
 @router.message(GenerateTasksFSM.waiting_for_description)
-async def process_tasks_description(message: Message, state: FSMContext):
+async def process_tasks_description(message: Message, state: FSMContext, user=None):
     description = message.text.strip()
     data = await state.get_data()
     student_id = data.get("student_id")
@@ -81,15 +104,40 @@ async def process_tasks_description(message: Message, state: FSMContext):
         "student_id": student_id,
         "description": description
     }
-    from bot_app import rabbit_channel
-    import json, aio_pika
-    await rabbit_channel.default_exchange.publish(
-        aio_pika.Message(body=json.dumps(task).encode('utf-8')),
-        routing_key=config.RABBITMQ_TASK_QUEUE
-    )
+    if not await _publish_task(task, user):
+        await _reply_duplicate(message, state)
+        return
     await message.answer("🕔 Генерируются задания, пожалуйста подождите...")
     await state.clear()
 
+# Handle "Tasks for everyone" button in the students list
+@router.callback_query(F.data == "gen_tasks_all")
+async def cb_generate_tasks_batch(callback: CallbackQuery, state: FSMContext):
+    await state.set_state(GenerateTasksBatchFSM.waiting_for_description)
+    await callback.message.edit_text("Введите запрос для генерации заданий для всех учеников:",
+                                     reply_markup=chat_kb.back_button("← Отмена", "back:students"))
+
+@router.message(GenerateTasksBatchFSM.waiting_for_description)
+async def process_tasks_batch_description(message: Message, state: FSMContext, user=None):
+    description = message.text.strip()
+    user_id = message.from_user.id
+    students = await database.db.get_students_by_user(user_id)
+    await state.clear()
+    if not students:
+        await message.answer("Список учеников пуст.")
+        return
+    # One batch task for the whole roster instead of one message per student
+    task = {
+        "type": "generate_tasks_batch",
+        "user_id": user_id,
+        "student_ids": [s["id"] for s in students],
+        "description": description
+    }
+    if not await _publish_task(task, user):
+        await _reply_duplicate(message, state)
+        return
+    await message.answer(f"🕔 Генерируются задания для {len(students)} учеников, результаты будут приходить по мере готовности...")
+
 # Handle "Check Homework" button
 @router.callback_query(F.data.startswith("check_hw:"))
 async def cb_check_homework(callback: CallbackQuery, state: FSMContext):
@@ -100,7 +148,7 @@ async def cb_check_homework(callback: CallbackQuery, state: FSMContext):
                                      reply_markup=chat_kb.back_button("← Отмена", "back:chat"))
 
 @router.message(HomeworkCheckFSM.waiting_for_file, F.document)
-async def process_homework_file(message: Message, state: FSMContext):
+async def process_homework_file(message: Message, state: FSMContext, user=None):
     # User sent a document for homework
     data = await state.get_data()
     student_id = data.get("student_id")
@@ -122,12 +170,9 @@ async def process_homework_file(message: Message, state: FSMContext):
         "filename": message.document.file_name or "",
         "solution_text": solution_text
     }
-    from bot_app import rabbit_channel
-    import json, aio_pika
-    await rabbit_channel.default_exchange.publish(
-        aio_pika.Message(body=json.dumps(task).encode('utf-8')),
-        routing_key=config.RABBITMQ_TASK_QUEUE
-    )
+    if not await _publish_task(task, user):
+        await _reply_duplicate(message, state)
+        return
     await message.reply("🕔 Выполняется проверка домашнего задания, пожалуйста подождите...")
     await state.clear()
 
@@ -140,7 +185,7 @@ async def cb_refine_plan(callback: CallbackQuery, state: FSMContext):
     await callback.message.reply("Введите уточнения или пожелания для корректировки плана:")
 
 @router.message(RefineFSM.waiting_for_plan_feedback)
-async def process_plan_refinement(message: Message, state: FSMContext):
+async def process_plan_refinement(message: Message, state: FSMContext, user=None):
     feedback = message.text.strip()
     data = await state.get_data()
     student_id = data.get("student_id")
@@ -150,14 +195,12 @@ async def process_plan_refinement(message: Message, state: FSMContext):
         "type": "generate_plan",
         "user_id": user_id,
         "student_id": student_id,
-        "description": feedback
+        "description": feedback,
+        "refine": True  # worker skips the GPT response cache for refinements
     }
-    from bot_app import rabbit_channel
-    import json, aio_pika
-    await rabbit_channel.default_exchange.publish(
-        aio_pika.Message(body=json.dumps(task).encode('utf-8')),
-        routing_key=config.RABBITMQ_TASK_QUEUE
-    )
+    if not await _publish_task(task, user):
+        await _reply_duplicate(message, state)
+        return
     await message.answer("🔄 Повторная генерация плана, подождите...")
     await state.clear()
 
@@ -169,7 +212,7 @@ async def cb_refine_tasks(callback: CallbackQuery, state: FSMContext):
     await callback.message.reply("Введите уточнения для корректировки заданий:")
 
 @router.message(RefineFSM.waiting_for_tasks_feedback)
-async def process_tasks_refinement(message: Message, state: FSMContext):
+async def process_tasks_refinement(message: Message, state: FSMContext, user=None):
     feedback = message.text.strip()
     data = await state.get_data()
     student_id = data.get("student_id")
@@ -178,14 +221,12 @@ async def process_tasks_refinement(message: Message, state: FSMContext):
         "type": "generate_tasks",
         "user_id": user_id,
         "student_id": student_id,
-        "description": feedback
+        "description": feedback,
+        "refine": True  # worker skips the GPT response cache for refinements
     }
-    from bot_app import rabbit_channel
-    import json, aio_pika
-    await rabbit_channel.default_exchange.publish(
-        aio_pika.Message(body=json.dumps(task).encode('utf-8')),
-        routing_key=config.RABBITMQ_TASK_QUEUE
-    )
+    if not await _publish_task(task, user):
+        await _reply_duplicate(message, state)
+        return
     await message.answer("🔄 Повторная генерация заданий, подождите...")
     await state.clear()
 
@@ -197,7 +238,7 @@ async def cb_refine_check(callback: CallbackQuery, state: FSMContext):
     await callback.message.reply("Введите замечания или дополнительные указания для повторной проверки:")
 
 @router.message(RefineFSM.waiting_for_check_feedback)
-async def process_check_refinement(message: Message, state: FSMContext):
+async def process_check_refinement(message: Message, state: FSMContext, user=None):
     feedback = message.text.strip()
     data = await state.get_data()
     student_id = data.get("student_id")
@@ -207,13 +248,11 @@ async def process_check_refinement(message: Message, state: FSMContext):
         "user_id": user_id,
         "student_id": student_id,
         "filename": "",  # no new file, just text feedback
-        "solution_text": feedback
+        "solution_text": feedback,
+        "refine": True
     }
-    from bot_app import rabbit_channel
-    import json, aio_pika
-    await rabbit_channel.default_exchange.publish(
-        aio_pika.Message(body=json.dumps(task).encode('utf-8')),
-        routing_key=config.RABBITMQ_TASK_QUEUE
-    )
+    if not await _publish_task(task, user):
+        await _reply_duplicate(message, state)
+        return
     await message.answer("🔄 Повторная проверка выполняется, подождите...")
     await state.clear()
@@ -23,9 +23,7 @@ class YandexTokenFSM(StatesGroup):
     waiting_for_token = State()
 
 @router.callback_query(F.data == "settings")
-async def cb_settings(callback: CallbackQuery):
-    user_id = callback.from_user.id
-    user = await database.db.get_user_by_tg_id(user_id)
+async def cb_settings(callback: CallbackQuery, user: dict | None = None):
     lang = user["language"] if user else "RU"
     text = "Настройки профиля:" if lang == "RU" else "Profile Settings:"
     await callback.message.edit_text(text, reply_markup=settings_kb.settings_menu_kb(lang))
@@ -36,7 +34,7 @@ async def cb_change_name(callback: CallbackQuery, state: FSMContext):
     await callback.message.edit_text("Введите новое имя:")
 
 @router.message(ChangeNameFSM.waiting_for_name)
-async def process_change_name(message: Message, state: FSMContext):
+async def process_change_name(message: Message, state: FSMContext, user: dict | None = None):
     new_name = message.text.strip()
     if not new_name:
         await message.reply("Имя не может быть пустым. Введите новое имя:")
@@ -44,16 +42,14 @@ async def process_change_name(message: Message, state: FSMContext):
     await database.db.update_user_name(message.from_user.id, new_name)
     await message.answer("Имя обновлено ✅")
     await state.clear()
-    # Return to settings menu
-    user = await database.db.get_user_by_tg_id(message.from_user.id)
+    # Return to settings menu (language is unchanged, so the middleware's user is enough)
     text = "Настройки профиля:"
     await message.answer(text, reply_markup=settings_kb.settings_menu_kb(user["language"] if user else "RU"))
 
 @router.callback_query(F.data == "change_password")
-async def cb_change_password(callback: CallbackQuery, state: FSMContext):
-    user = await database.db.get_user_by_tg_id(callback.from_user.id)
+async def cb_change_password(callback: CallbackQuery, state: FSMContext, user: dict | None = None):
     # If no password set yet (empty hash), skip old password
-    if user and (not user["password_hash"] or user["password_hash"] == ""):
+    if not await database.db.get_user_password_hash(callback.from_user.id):
         # No existing password, go directly to new password
         await state.set_state(ChangePasswordFSM.waiting_for_new)
         await callback.message.edit_text("Установите новый пароль:")
@@ -62,17 +58,17 @@ async def cb_change_password(callback: CallbackQuery, state: FSMContext):
         await callback.message.edit_text("Введите текущий пароль:")
 
 @router.message(ChangePasswordFSM.waiting_for_old)
-async def process_old_password(message: Message, state: FSMContext):
+async def process_old_password(message: Message, state: FSMContext, user: dict | None = None):
     old_pass = message.text.strip()
-    # Check old password
-    user = await database.db.get_user_by_tg_id(message.from_user.id)
-    if not user or not user["password_hash"]:
+    # Check old password (the hash is read from the DB, it is not kept in the user cache)
+    password_hash = await database.db.get_user_password_hash(message.from_user.id)
+    if not password_hash:
         await message.answer("Пароль не установлен.")
         await state.clear()
         return
     # Verify old password hash
     try:
-        if not bcrypt.checkpw(old_pass.encode('utf-8'), user["password_hash"].encode('utf-8')):
+        if not bcrypt.checkpw(old_pass.encode('utf-8'), password_hash.encode('utf-8')):
             await message.reply("Неверный текущий пароль. Попробуйте снова:")
             return
     except Exception:
@@ -94,7 +90,7 @@ async def process_new_password(message: Message, state: FSMContext):
     await message.answer("Повторите новый пароль:")
 
 @router.message(ChangePasswordFSM.waiting_for_confirm)
-async def process_confirm_password(message: Message, state: FSMContext):
+async def process_confirm_password(message: Message, state: FSMContext, user: dict | None = None):
     confirm_pass = message.text.strip()
     data = await state.get_data()
     new_pass = data.get("new_password")
@@ -107,14 +103,12 @@ async def process_confirm_password(message: Message, state: FSMContext):
     await database.db.update_user_password(message.from_user.id, hashed)
     await message.answer("Пароль обновлён ✅")
     await state.clear()
-    # Return to settings
-    user = await database.db.get_user_by_tg_id(message.from_user.id)
+    # Return to settings (language is unchanged, so the middleware's user is enough)
     text = "Настройки профиля:"
     await message.answer(text, reply_markup=settings_kb.settings_menu_kb(user["language"] if user else "RU"))
 
 @router.callback_query(F.data == "toggle_notifications")
-async def cb_toggle_notifications(callback: CallbackQuery):
-    user = await database.db.get_user_by_tg_id(callback.from_user.id)
+async def cb_toggle_notifications(callback: CallbackQuery, user: dict | None = None):
     if not user:
         return
     current = user["notifications"]
@@ -137,8 +131,7 @@ async def cb_set_language(callback: CallbackQuery):
     await callback.message.edit_text(msg, reply_markup=settings_kb.back_button("← Back" if lang=="EN" else "← Назад", "back:main"))
 
 @router.callback_query(F.data == "yandex_disk")
-async def cb_yandex_disk(callback: CallbackQuery, state: FSMContext):
-    user = await database.db.get_user_by_tg_id(callback.from_user.id)
+async def cb_yandex_disk(callback: CallbackQuery, state: FSMContext, user: dict | None = None):
     if user and user["ydisk_token_enc"]:
         # Already has token
         await state.set_state(YandexTokenFSM.waiting_for_token)
@@ -148,7 +141,7 @@ async def cb_yandex_disk(callback: CallbackQuery, state: FSMContext):
         await callback.message.edit_text("Отправьте OAuth-токен Яндекс.Диска для интеграции:")
 
 @router.message(YandexTokenFSM.waiting_for_token)
-async def process_yandex_token(message: Message, state: FSMContext):
+async def process_yandex_token(message: Message, state: FSMContext, user: dict | None = None):
     token = message.text.strip()
     if not token:
         await message.reply("Токен не должен быть пустым.")
@@ -157,7 +150,6 @@ async def process_yandex_token(message: Message, state: FSMContext):
     await database.db.update_user_ydisk_token(message.from_user.id, token)
     await message.answer("Интеграция с Яндекс.Диском выполнена ✅")
     await state.clear()
-    # Return to settings menu
-    user = await database.db.get_user_by_tg_id(message.from_user.id)
+    # Return to settings menu (language is unchanged, so the middleware's user is enough)
     text = "Настройки профиля:"
     await message.answer(text, reply_markup=settings_kb.settings_menu_kb(user["language"] if user else "RU"))
@@ -9,12 +9,13 @@ router = Router()
 @router.callback_query(F.data == "subscription")
 async def cb_subscription(callback: CallbackQuery):
     user_id = callback.from_user.id
-    user = await database.db.get_user_by_tg_id(user_id)
+    # usage_count меняет воркер — читаем из БД, а не из кэша, плюс ещё не сброшенное из Redis
+    user = await database.db.get_user_by_tg_id(user_id, fresh=True)
     if not user:
         await callback.answer("Ошибка: пользователь не найден", show_alert=True)
         return
     plan = user["plan"].capitalize() if user["plan"] else "Basic"
-    usage = user["usage_count"]
+    usage = await database.db.get_usage_count(user)
     limit = user["usage_limit"]
     text = f"📦 Ваш тариф: {plan}\n"
     text += f"Доступно запросов: {usage}/{limit} в месяц"
@@ -44,9 +45,9 @@ async def cb_upgrade_plan(callback: CallbackQuery):
         await database.db.set_plan(user_id, "premium", new_limit=1000)  # Premium limit example
         await callback.answer("Тариф обновлен до Премиум!", show_alert=True)
         # Refresh subscription info
-        user = await database.db.get_user_by_tg_id(user_id)
+        user = await database.db.get_user_by_tg_id(user_id, fresh=True)
         plan = user["plan"].capitalize()
-        usage = user["usage_count"]
+        usage = await database.db.get_usage_count(user)
         limit = user["usage_limit"]
         text = f"📦 Ваш тариф: {plan}\nДоступно запросов: {usage}/{limit} в месяц"
         # Keep the same keyboard
@@ -70,3 +70,9 @@ def chat_gpt_back_kb(lang: str = "RU"):
     kb = InlineKeyboardBuilder()
     kb.button(text=text, callback_data="back:chat")
     return kb.as_markup()
+
+def back_button(text: str = "← Назад", cb_data: str = "back:chat"):
+    """Single-button keyboard used to cancel an input step."""
+    kb = InlineKeyboardBuilder()
+    kb.button(text=text, callback_data=cb_data)
+    return kb.as_markup()
@@ -4,12 +4,16 @@ def students_list_kb(students: list, lang: str = "RU"):
     """
     Build an inline keyboard listing all students.
     Each student's name is a button that opens that student's action menu.
-    Includes 'Add new' and 'Back'.
+    Includes 'Tasks for everyone' (if the list is not empty), 'Add new' and 'Back'.
     """
     kb = InlineKeyboardBuilder()
     for s in students:
         name = s["name"] or ("Без имени" if lang.upper() == "RU" else "No Name")
         kb.button(text=name, callback_data=f"student:{s['id']}")
+    # Batch generation for the whole roster
+    if students:
+        batch_text = "📝 Задания для всех" if lang.upper() == "RU" else "📝 Tasks for everyone"
+        kb.button(text=batch_text, callback_data="gen_tasks_all")
     # "Add new" button
     add_text = "➕ Добавить нового" if lang.upper() == "RU" else "➕ Add new"
     kb.button(text=add_text, callback_data="add_student")
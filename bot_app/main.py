@@ -1,19 +1,23 @@
 import asyncio
 import logging
-import json
+import time
+from collections import OrderedDict
 
 import aio_pika
 from aiogram import Bot, Dispatcher
 from aiogram.client.bot import DefaultBotProperties
 from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.fsm.storage.redis import RedisStorage
 from aiogram.types import BotCommand
 
-rabbit_channel: aio_pika.Channel | None = None
-
-from bot_app import config
+from bot_app import config, redis_cache
 from bot_app.database import db
 from bot_app.middlewares.auth import AuthMiddleware
+from bot_app.publisher import publisher
+from bot_app.result_dispatcher import ResultDispatcher
+from bot_app.middlewares.throttling import TelegramRateLimiter
+from bot_app.utils import blobs, idempotency, render
 from bot_app.handlers import start, students, generation, chatgpt, subscription, settings
 from bot_app.keyboards.chat_menu import (
     chat_gpt_back_kb,
@@ -23,41 +27,173 @@ from bot_app.keyboards.chat_menu import (
 )
 
 
-async def process_result(message: aio_pika.IncomingMessage) -> None:
-    """Обрабатываем каждое сообщение из очереди результатов и шлём его в Telegram."""
-    async with message.process():
+# Потоковые ответы: stream_id -> {"message": Task[Message], "seq": int, "edited_at": float}
+_streams: dict[str, dict] = {}
+# Недавно завершённые потоки — опоздавшие partial-события для них игнорируются
+_finished_streams: "OrderedDict[str, None]" = OrderedDict()
+_FINISHED_STREAMS_MAX = 1000
+
+
+def _finish_stream(stream_id: str) -> dict | None:
+    _finished_streams[stream_id] = None
+    while len(_finished_streams) > _FINISHED_STREAMS_MAX:
+        _finished_streams.popitem(last=False)
+    return _streams.pop(stream_id, None)
+
+
+async def process_partial(bot: Bot, data: dict) -> None:
+    """
+    Промежуточный результат потоковой генерации: первое событие создаёт сообщение,
+    последующие редактируют его не чаще STREAM_EDIT_INTERVAL.
+    """
+    stream_id = data.get("stream_id")
+    seq = data.get("seq") or 0
+    text = (data.get("text") or "")[:render.TELEGRAM_TEXT_LIMIT - 2] + " ✍️"
+    if not stream_id or stream_id in _finished_streams:
+        return
+
+    state = _streams.get(stream_id)
+    if state is None:
+        # Сообщение создаётся один раз; задача сохраняется сразу, чтобы параллельные события её дождались
+        _streams[stream_id] = {
+            "message": asyncio.create_task(bot.send_message(data["user_id"], text, parse_mode=None)),
+            "seq": seq,
+            "edited_at": time.monotonic(),
+        }
+        return
+
+    now = time.monotonic()
+    # reset — поток начат заново (повтор на другом ключе): показываем это сразу, без ожидания интервала
+    if seq <= state["seq"] or (not data.get("reset") and now - state["edited_at"] < config.STREAM_EDIT_INTERVAL):
+        return
+    state["seq"] = seq
+    state["edited_at"] = now
+    try:
+        sent = await state["message"]
+        await bot.edit_message_text(text, chat_id=sent.chat.id, message_id=sent.message_id, parse_mode=None)
+    except TelegramBadRequest as e:
+        # Например, "message is not modified" — не критично
+        logging.debug(f"process_partial: edit skipped: {e}")
+    except Exception as e:
+        logging.warning(f"process_partial: не удалось обновить сообщение: {e}")
+
+
+async def deliver_text(
+    bot: Bot,
+    user_id: int,
+    text: str,
+    header: str = "",
+    reply_markup=None,
+    stream_id: str | None = None,
+) -> None:
+    """
+    Отправляет финальный текст частями по TELEGRAM_TEXT_LIMIT (см. render.split_text).
+    Для потокового ответа первая часть заменяет уже созданное сообщение.
+    """
+    chunks = render.split_text(text, header=header) or ["…"]
+    state = _finish_stream(stream_id) if stream_id else None
+    if state is not None:
         try:
-            data = json.loads(message.body)
+            sent = await state["message"]
+            markup = reply_markup if len(chunks) == 1 else None
+            await bot.edit_message_text(chunks[0], chat_id=sent.chat.id, message_id=sent.message_id, reply_markup=markup)
+            chunks = chunks[1:]
         except Exception as e:
-            logging.error(f"❌ process_result — неверный JSON: {e}")
-            return
+            logging.warning(f"deliver_text: не удалось отредактировать потоковое сообщение: {e}")
+    await render.send_chunks(bot, user_id, chunks, reply_markup=reply_markup)
+
 
-        user_id = data.get("user_id")
-        t       = data.get("type")
-        answer  = data.get("answer") or ""
+def _with_model_note(data: dict, header: str = "") -> str:
+    """Добавляет к заголовку пометку, если воркер ответил запасной моделью."""
+    if not data.get("fallback_from"):
+        return header
+    note = (f"ℹ️ <i>{render.escape(data['fallback_from'])} сейчас перегружена, "
+            f"ответ подготовлен моделью {render.escape(data.get('model') or '')}.</i>")
+    return f"{header}\n{note}" if header else note
+
+
+async def process_result(bot: Bot, data: dict) -> None:
+    """
+    Доставляет один результат воркера в Telegram. Исключения пробрасываются —
+    подтверждением сообщения в очереди занимается ResultDispatcher.
+    """
+    user_id = data.get("user_id")
+    t       = data.get("type")
+    answer  = data.get("answer") or ""
+    if t != "partial":
         logging.info(f"▶ process_result: type={t} user={user_id}")
 
-        if t == "chat":
-            # вот здесь точно отправляем сообщение в чат
-            await process_result.bot.send_message(
-                user_id,
-                answer,
-                reply_markup=chat_gpt_back_kb()
-            )
-        elif t == "plan":
-            text = f"📄 План:\n{data.get('plan_text','(пусто)')}"
-            await process_result.bot.send_message(user_id, text, reply_markup=result_plan_kb(data.get("student_id")))
-        elif t == "tasks":
-            text = f"📝 Задания:\n{data.get('tasks_text','(нет данных)')}"
-            await process_result.bot.send_message(user_id, text, reply_markup=result_tasks_kb(data.get("student_id")))
-        elif t == "check":
-            text = f"✔️ Результаты проверки:\n{data.get('report_text','(нет отчёта)')}"
-            await process_result.bot.send_message(user_id, text, reply_markup=result_check_kb(data.get("student_id")))
-        elif t == "error":
-            await process_result.bot.send_message(user_id, f"⚠️ {data.get('message','Ошибка')}")
+    # Воркер повторяет сохранённый результат, если задача пришла к нему повторно
+    task_id = data.get("task_id") if t != "partial" else None
+    if task_id and await idempotency.already_delivered(task_id):
+        logging.info(f"↩️ process_result: result of task {task_id} was already delivered, skipped")
+        return
+
+    if t == "partial":
+        await process_partial(bot, data)
+    elif t == "chat":
+        # вот здесь точно отправляем сообщение в чат
+        await deliver_text(
+            bot,
+            user_id,
+            answer,
+            header=_with_model_note(data),
+            reply_markup=chat_gpt_back_kb(),
+            stream_id=data.get("stream_id"),
+        )
+    elif t == "plan":
+        # PDF загружается, пока отправляется текст
+        pdf = blobs.prefetch_pdf(data, "plan.pdf")
+        await deliver_text(
+            bot,
+            user_id,
+            data.get("plan_text") or "(пусто)",
+            header=_with_model_note(data, "📄 <b>План:</b>"),
+            reply_markup=result_plan_kb(data.get("student_id")),
+            stream_id=data.get("stream_id"),
+        )
+        await blobs.send_pdf(bot, user_id, data, pdf)
+    elif t == "tasks":
+        pdf = blobs.prefetch_pdf(data, "tasks.pdf")
+        # В пакетной генерации подписываем, для какого ученика задания
+        if data.get("student_name"):
+            header = f"📝 <b>Задания ({render.escape(data['student_name'])}):</b>"
         else:
-            logging.warning(f"❓ process_result: неизвестный type={t}")
+            header = "📝 <b>Задания:</b>"
+        await deliver_text(
+            bot,
+            user_id,
+            data.get("tasks_text") or "(нет данных)",
+            header=_with_model_note(data, header),
+            reply_markup=result_tasks_kb(data.get("student_id")),
+        )
+        await blobs.send_pdf(bot, user_id, data, pdf)
+    elif t == "check":
+        pdf = blobs.prefetch_pdf(data, "report.pdf")
+        await deliver_text(
+            bot,
+            user_id,
+            data.get("report_text") or "(нет отчёта)",
+            header=_with_model_note(data, "✔️ <b>Результаты проверки:</b>"),
+            reply_markup=result_check_kb(data.get("student_id")),
+        )
+        await blobs.send_pdf(bot, user_id, data, pdf)
+    elif t == "batch_summary":
+        text = f"✅ Пакетная генерация завершена: {data.get('succeeded', 0)}/{data.get('total', 0)}"
+        if data.get("failed"):
+            text += f"\n⚠️ Не удалось для {len(data['failed'])} учеников"
+        if data.get("missing"):
+            text += f"\n❓ Не найдено учеников: {len(data['missing'])}"
+        await bot.send_message(user_id, text)
+    elif t == "error":
+        await bot.send_message(user_id, f"⚠️ {render.escape(data.get('message') or 'Ошибка')}")
+    else:
+        logging.warning(f"❓ process_result: неизвестный type={t}")
 
+    if task_id:
+        await idempotency.mark_delivered(task_id)
+        # Результат доставлен — такой же запрос можно отправить снова, не дожидаясь DEDUP_WINDOW
+        await idempotency.release_task(task_id)
 
 
 async def on_startup(bot: Bot, dp: Dispatcher) -> None:
@@ -81,27 +217,29 @@ async def on_startup(bot: Bot, dp: Dispatcher) -> None:
     channel = await connection.channel()
     logging.info("✔️ Connected to RabbitMQ")
 
-    # Сохраняем канал в пакете bot_app, чтобы имели доступ обработчики
-    import bot_app
-    bot_app.rabbit_channel = channel
-    global rabbit_channel
-    rabbit_channel = channel
-
-    # 3) Декларируем очередь результатов и подписываемся на неё
-    result_q = await channel.declare_queue(config.RESULT_QUEUE, durable=True)
-    
-    # передаём бота через атрибут функции, чтобы не возникала ошибка аргументов
-    from bot_app.main import process_result
-    process_result.bot = bot
-    await result_q.consume(
-        lambda msg: asyncio.create_task(process_result(msg)),
-        no_ack=False,
+    # Публикация задач — через общий publisher на отдельном соединении
+    # (он же объявляет очереди задач: основную и интерактивную)
+    await publisher.start()
+
+    # Хранилища PDF (claim-check): воркер присылает только ссылки на файлы
+    blobs.init()
+    asyncio.create_task(blobs.sweep_loop())
+
+    # 3) Подписываемся на очередь результатов: ограниченный prefetch,
+    #    по порядку в каждом чате, подтверждение только после доставки
+    result_dispatcher = ResultDispatcher(
+        lambda data: process_result(bot, data),
+        prefetch=config.RESULT_PREFETCH,
+        per_chat=config.RESULT_PER_CHAT,
+        requeue_delay=config.RESULT_REQUEUE_DELAY,
     )
-    logging.info(f"🔔 Subscribed to result queue '{config.RESULT_QUEUE}'")
+    await result_dispatcher.start(channel, config.RESULT_QUEUE)
+    logging.info(f"🔔 Subscribed to result queue '{config.RESULT_QUEUE}' (prefetch={config.RESULT_PREFETCH})")
 
 
 async def on_shutdown(bot: Bot, dp: Dispatcher) -> None:
-    logging.info("🔌 on_shutdown: закрываем пул БД")
+    logging.info("🔌 on_shutdown: закрываем publisher и пул БД")
+    await publisher.close()
     if db._pool:
         await db._pool.close()
 
@@ -117,11 +255,16 @@ async def main() -> None:
     await db.init_db_pool(dsn)
     logging.info("✔️ Database pool initialized")
 
+    # Redis (кэш пользователей и хранилище PDF)
+    await redis_cache.init_redis()
+
     # 1) создаём бота
     bot = Bot(
         token=config.BOT_TOKEN,
         default=DefaultBotProperties(parse_mode=ParseMode.HTML)
     )
+    # Лимиты Telegram (общий и на чат) и повтор запросов после 429
+    bot.session.middleware(TelegramRateLimiter())
 
     # 2) диспетчер с FSM на Redis
     dp = Dispatcher(
@@ -6,8 +6,8 @@ from bot_app.database import db
 class AuthMiddleware(BaseMiddleware):
     """
     При любом сообщении или callback:
-      1) Проверяем, есть ли запись в users по telegram_id.
-      2) Если нет — создаём её.
+      1) Берём пользователя из кэша (память процесса, затем Redis).
+      2) При промахе получаем или создаём запись в users одним запросом.
       3) Кладём запись в data['user'] для дальнейшего использования.
     """
     async def __call__(
@@ -22,13 +22,9 @@ class AuthMiddleware(BaseMiddleware):
 
         user = None
         if telegram_id is not None:
-            # 1) Пытаемся получить
-            user = await db.get_user_by_tg_id(telegram_id)
-            # 2) Если нет — создаём
-            if user is None:
-                name = getattr(event.from_user, "first_name", "") or ""
-                await db.create_user(telegram_id, name)
-                user = await db.get_user_by_tg_id(telegram_id)
+            # 1-2) Кэш пользователя, при промахе — один INSERT ... ON CONFLICT ... RETURNING
+            name = getattr(event.from_user, "first_name", "") or ""
+            user = await db.get_or_create_user(telegram_id, name)
 
         # 3) Сохраняем в context
         data["user"] = user
@@ -0,0 +1,63 @@
+import logging
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import Response, TelegramType
+
+from bot_app import config
+from common.rate_limit import TokenBucket
+
+
+class TelegramRateLimiter(BaseRequestMiddleware):
+    """
+    Middleware сессии бота: ограничивает исходящие запросы к чатам.
+
+      1) Общий token bucket (TG_GLOBAL_RATE сообщений/с на весь бот).
+      2) Token bucket на каждый чат (TG_CHAT_RATE сообщений/с).
+      3) На 429 приостанавливаем bucket чата на retry_after и повторяем запрос.
+
+    Запросы без chat_id (getUpdates, setMyCommands, answerCallbackQuery) не ограничиваются.
+    """
+
+    # Неиспользуемые bucket'ы чатов удаляются, когда их становится больше этого числа
+    MAX_CHAT_BUCKETS = 10000
+
+    def __init__(self):
+        self._global = TokenBucket(config.TG_GLOBAL_RATE, config.TG_GLOBAL_BURST)
+        self._chats: dict[int | str, TokenBucket] = {}
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.MAX_CHAT_BUCKETS:
+                # Полные bucket'ы ничего не помнят — их можно выбросить
+                self._chats = {k: b for k, b in self._chats.items() if b.tokens < b.capacity}
+            bucket = self._chats[chat_id] = TokenBucket(config.TG_CHAT_RATE, config.TG_CHAT_BURST)
+        return bucket
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            return await make_request(bot, method)
+
+        chat_bucket = self._chat_bucket(chat_id)
+        for attempt in range(config.TG_MAX_RETRIES + 1):
+            # Сначала очередь чата, потом общий лимит — медленный чат не держит общие токены
+            await chat_bucket.acquire()
+            await self._global.acquire()
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt >= config.TG_MAX_RETRIES:
+                    raise
+                logging.warning(f"⚠️ Telegram 429 for chat {chat_id}: retry after {e.retry_after}s")
+                # Опустошаем bucket чата: все его запросы (и этот повтор) ждут retry_after,
+                # а не ретраят пачкой
+                chat_bucket.pause(e.retry_after)
@@ -0,0 +1,146 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+from collections import deque
+
+import aio_pika
+from aio_pika import DeliveryMode
+
+from bot_app import config
+
+
+class PublishError(Exception):
+    """Задачу не удалось опубликовать (буфер переполнен или брокер недоступен дольше таймаута)."""
+
+
+class _Pending:
+    __slots__ = ("message", "routing_key", "future", "deadline")
+
+    def __init__(self, message: aio_pika.Message, routing_key: str, future: asyncio.Future, deadline: float):
+        self.message = message
+        self.routing_key = routing_key
+        self.future = future
+        self.deadline = deadline
+
+
+class TaskPublisher:
+    """
+    Long-lived task publisher owned by the bot process.
+
+    Keeps a small pool of channels with publisher confirms on one robust
+    connection. publish() puts the message into a bounded buffer and waits
+    for the broker's confirm; a single sender loop takes everything buffered
+    so far and publishes it as a batch across the channels, waiting for all
+    confirms of the batch together. Messages that fail (connection lost,
+    nack) go back to the head of the buffer and are retried after a backoff
+    until their deadline passes.
+    """
+
+    def __init__(
+        self,
+        channels: int = config.PUBLISHER_CHANNELS,
+        batch_size: int = config.PUBLISHER_BATCH_SIZE,
+        buffer_size: int = config.PUBLISHER_BUFFER_SIZE,
+        retry_timeout: float = config.PUBLISHER_RETRY_TIMEOUT,
+    ):
+        self._channel_count = max(1, channels)
+        self._batch_size = max(1, batch_size)
+        self._buffer_size = buffer_size
+        self._retry_timeout = retry_timeout
+        self._connection: aio_pika.abc.AbstractRobustConnection | None = None
+        self._channels: list[aio_pika.abc.AbstractChannel] = []
+        self._buffer: deque[_Pending] = deque()
+        self._has_items = asyncio.Event()
+        self._sender: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        """Открывает соединение и пул каналов с подтверждениями, объявляет очереди задач."""
+        self._connection = await aio_pika.connect_robust(
+            host=config.RABBITMQ_HOST,
+            port=config.RABBITMQ_PORT,
+            login=config.RABBITMQ_USER,
+            password=config.RABBITMQ_PASS,
+        )
+        self._channels = [
+            await self._connection.channel(publisher_confirms=True)
+            for _ in range(self._channel_count)
+        ]
+        for queue_name in {config.task_queue(), config.task_queue(interactive=True)}:
+            await self._channels[0].declare_queue(queue_name, durable=True)
+        self._sender = asyncio.create_task(self._sender_loop())
+        logging.info(f"✔️ Task publisher started ({self._channel_count} channel(s))")
+
+    async def close(self, timeout: float = 10) -> None:
+        """Дожидается отправки буфера и закрывает соединение."""
+        deadline = time.monotonic() + timeout
+        while self._buffer and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        if self._sender:
+            self._sender.cancel()
+        for item in self._buffer:
+            if not item.future.done():
+                item.future.set_exception(PublishError("publisher closed"))
+        self._buffer.clear()
+        if self._connection:
+            await self._connection.close()
+
+    async def publish(self, task: dict, routing_key: str) -> str:
+        """
+        Публикует задачу (persistent, с task_id) и ждёт подтверждения брокера.
+        Возвращает task_id; при неудаче бросает PublishError.
+        """
+        if len(self._buffer) >= self._buffer_size:
+            raise PublishError("publish buffer is full")
+        task_id = task.setdefault("task_id", uuid.uuid4().hex)
+        message = aio_pika.Message(
+            body=json.dumps(task).encode("utf-8"),
+            content_type="application/json",
+            delivery_mode=DeliveryMode.PERSISTENT,
+            message_id=task_id,
+        )
+        future = asyncio.get_running_loop().create_future()
+        self._buffer.append(_Pending(message, routing_key, future, time.monotonic() + self._retry_timeout))
+        self._has_items.set()
+        await future
+        return task_id
+
+    async def _sender_loop(self) -> None:
+        backoff = 0.5
+        while True:
+            if not self._buffer:
+                self._has_items.clear()
+                await self._has_items.wait()
+            batch = [self._buffer.popleft() for _ in range(min(self._batch_size, len(self._buffer)))]
+            outcomes = await asyncio.gather(
+                *(self._publish_one(i, item) for i, item in enumerate(batch)),
+                return_exceptions=True,
+            )
+            failed = []
+            now = time.monotonic()
+            for item, outcome in zip(batch, outcomes):
+                if item.future.done():
+                    continue  # вызывающий уже отменён
+                if not isinstance(outcome, Exception):
+                    item.future.set_result(None)
+                elif now >= item.deadline:
+                    item.future.set_exception(PublishError(f"broker unavailable: {outcome}"))
+                else:
+                    failed.append(item)
+            if failed:
+                # Возвращаем в начало буфера в исходном порядке и ждём переподключения
+                logging.warning(f"⚠️ {len(failed)} task(s) not confirmed, retrying in {backoff:.1f}s")
+                self._buffer.extendleft(reversed(failed))
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 5.0)
+            else:
+                backoff = 0.5
+
+    async def _publish_one(self, index: int, item: _Pending) -> None:
+        channel = self._channels[index % len(self._channels)]
+        # С publisher_confirms publish() завершается по ack брокера (nack — исключение)
+        await channel.default_exchange.publish(item.message, routing_key=item.routing_key, timeout=10)
+
+
+publisher = TaskPublisher()
@@ -0,0 +1,32 @@
+import redis.asyncio as redis
+
+from bot_app import config
+
+_client: redis.Redis | None = None
+
+async def init_redis():
+    """
+    Initialize the bot's Redis client (cache database, not the FSM one).
+    """
+    global _client
+    _client = redis.Redis(
+        host=config.REDIS_HOST,
+        port=config.REDIS_PORT,
+        db=config.REDIS_DB_CACHE,
+    )
+
+def _get_client() -> redis.Redis:
+    if _client is None:
+        raise RuntimeError("Redis client is not initialized")
+    return _client
+
+# Удаляет ключ, только если в нём всё ещё наше значение
+_COMPARE_AND_DELETE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+async def compare_and_delete(key: str, value: str) -> bool:
+    return bool(await _get_client().eval(_COMPARE_AND_DELETE_SCRIPT, 1, key, value))
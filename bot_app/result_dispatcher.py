@@ -0,0 +1,99 @@
+import asyncio
+import hashlib
+import json
+import logging
+from typing import Awaitable, Callable
+
+import aio_pika
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+
+
+class ResultDispatcher:
+    """
+    Bounded consumer of the result queue.
+
+    The channel prefetch (qos) caps how many results are being delivered at
+    once, so a backlog no longer turns into thousands of concurrent sends.
+    Results of one chat are delivered strictly in order (per-chat lock);
+    different chats run concurrently. Rate limits themselves are enforced by
+    TelegramRateLimiter on the bot session.
+
+    One chat holds at most `per_chat` of the prefetched messages: a result for
+    a chat that already has that many in delivery or waiting for its lock goes
+    back to the queue (after `requeue_delay`), so a long backlog of one chat
+    (a batch with many PDFs) does not hold up the results of other chats.
+
+    A message is acked only after delivery. A failed delivery is requeued
+    once; a second failure, or an error that retrying cannot fix (the user
+    blocked the bot, bad request), drops the message.
+    """
+
+    def __init__(self, handler: Callable[[dict], Awaitable[None]], prefetch: int,
+                 per_chat: int = 2, requeue_delay: float = 0.5):
+        self._handler = handler
+        self._prefetch = prefetch
+        self._per_chat = max(1, per_chat)
+        self._requeue_delay = requeue_delay
+        # chat_id -> [lock, число ожидающих] — удаляется, когда очередь чата пуста
+        self._chat_locks: dict[object, list] = {}
+        self._running: set[asyncio.Task] = set()
+        # Результаты, доставка которых уже падала один раз (sha1 тела). redelivered не подходит:
+        # его ставит и возврат в очередь из-за лимита на чат
+        self._failed_once: set[str] = set()
+
+    async def start(self, channel: aio_pika.abc.AbstractChannel, queue_name: str) -> None:
+        await channel.set_qos(prefetch_count=self._prefetch)
+        queue = await channel.declare_queue(queue_name, durable=True)
+        await queue.consume(self._on_message, no_ack=False)
+
+    async def _on_message(self, message: aio_pika.abc.AbstractIncomingMessage) -> None:
+        # Задачи создаются в порядке доставки, поэтому и lock'и чатов берутся в этом порядке
+        task = asyncio.create_task(self._deliver(message))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _deliver(self, message: aio_pika.abc.AbstractIncomingMessage) -> None:
+        try:
+            data = json.loads(message.body)
+        except Exception as e:
+            logging.error(f"❌ ResultDispatcher — неверный JSON: {e}")
+            await message.reject()
+            return
+
+        chat_id = data.get("user_id")
+        entry = self._chat_locks.setdefault(chat_id, [asyncio.Lock(), 0])
+        if entry[1] >= self._per_chat:
+            # Чат и так занят: не тратим окно prefetch на ожидание его lock'а.
+            # Пауза — чтобы сообщение не крутилось между очередью и ботом вхолостую
+            await asyncio.sleep(self._requeue_delay)
+            await message.nack(requeue=True)
+            return
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await self._handle(message, data)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                self._chat_locks.pop(chat_id, None)
+
+    async def _handle(self, message: aio_pika.abc.AbstractIncomingMessage, data: dict) -> None:
+        try:
+            await self._handler(data)
+        except (TelegramForbiddenError, TelegramBadRequest) as e:
+            # Повтор не поможет (бот заблокирован, чат не найден, неверный текст)
+            logging.warning(f"⚠️ Result for {data.get('user_id')} dropped: {e}")
+            await message.ack()
+        except Exception:
+            digest = hashlib.sha1(message.body).hexdigest()
+            requeue = digest not in self._failed_once
+            if requeue:
+                self._failed_once.add(digest)
+            else:
+                self._failed_once.discard(digest)
+            logging.exception(f"🔴 Result delivery failed (requeue={requeue}):")
+            await message.nack(requeue=requeue)
+        else:
+            if self._failed_once:
+                self._failed_once.discard(hashlib.sha1(message.body).hexdigest())
+            await message.ack()
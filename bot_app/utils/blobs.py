@@ -0,0 +1,99 @@
+import asyncio
+import base64
+import logging
+import os
+
+from aiogram import Bot
+from aiogram.types import BufferedInputFile, FSInputFile
+
+from bot_app import config, redis_cache
+from common.blob_store import BlobStore, LocalBlobStore, RedisBlobStore
+
+# Хранилища по имени backend из ссылки (ссылку присылает воркер)
+_stores: dict[str, BlobStore] = {}
+
+
+def init() -> None:
+    """Создаёт хранилища PDF (вызывается в on_startup, после redis_cache.init_redis)."""
+    _stores["redis"] = RedisBlobStore(redis_cache._get_client(), ttl=config.BLOB_TTL)
+    if os.path.isdir(config.BLOB_DIR):
+        _stores["local"] = LocalBlobStore(config.BLOB_DIR, ttl=config.BLOB_TTL)
+
+
+async def sweep_loop(interval: float = 3600) -> None:
+    """Удаляет из локального хранилища файлы, которые так и не были доставлены."""
+    while True:
+        await asyncio.sleep(interval)
+        store = _stores.get("local")
+        if store is None:
+            continue
+        try:
+            removed = await store.sweep()
+            if removed:
+                logging.info(f"🧹 Removed {removed} expired blob(s)")
+        except Exception as e:
+            logging.warning(f"blob sweep failed: {e}")
+
+
+async def _input_file(ref: dict, filename: str):
+    store = _stores.get(ref.get("backend"))
+    if store is None:
+        logging.error(f"❌ Unknown blob backend: {ref.get('backend')}")
+        return None
+    if isinstance(store, LocalBlobStore):
+        # Файл с общего тома отправляется потоком, без чтения в память
+        path = store.path(ref)
+        if not os.path.exists(path) or os.path.getsize(path) != ref.get("size"):
+            logging.error(f"❌ Blob {ref.get('key')} is missing or truncated")
+            return None
+        return FSInputFile(path, filename=filename)
+    data = await store.get(ref)
+    if data is None or not BlobStore.verify(ref, data):
+        logging.error(f"❌ Blob {ref.get('key')} is missing or corrupted")
+        return None
+    return BufferedInputFile(data, filename=filename)
+
+
+def prefetch_pdf(data: dict, filename: str) -> asyncio.Task | None:
+    """
+    Начинает загрузку PDF результата (из хранилища или base64, в памяти), пока
+    отправляется текст. None — в результате нет файла.
+    """
+    if not data.get("blob") and not data.get("file"):
+        return None
+    return asyncio.create_task(_load_pdf(data, filename))
+
+
+async def _load_pdf(data: dict, filename: str):
+    try:
+        ref = data.get("blob")
+        if ref:
+            return await _input_file(ref, filename)
+        return BufferedInputFile(base64.b64decode(data["file"]), filename=filename)
+    except Exception as e:
+        logging.error(f"❌ Failed to load PDF: {e}")
+        return None
+
+
+async def send_pdf(bot: Bot, user_id: int, data: dict, document_task: asyncio.Task | None) -> bool:
+    """
+    Отправляет PDF, загруженный prefetch_pdf(). Файл из хранилища (data["blob"])
+    удаляется после доставки, если результат не сохранён воркером для повтора
+    (есть task_id): повторённый результат ссылается на тот же файл, и он живёт
+    до BLOB_TTL (дольше TASK_DONE_TTL воркера).
+    """
+    if document_task is None:
+        return False
+    document = await document_task
+    if document is None:
+        await bot.send_message(user_id, "⚠️ PDF-файл недоступен, попробуйте сгенерировать ещё раз.")
+        return False
+    await bot.send_document(user_id, document)
+    ref = data.get("blob")
+    if ref and not data.get("task_id"):
+        try:
+            await _stores[ref["backend"]].delete(ref)
+        except Exception as e:
+            # Не страшно: файл удалится по TTL
+            logging.warning(f"blob delete failed: {e}")
+    return True
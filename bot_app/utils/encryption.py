@@ -1,6 +1,7 @@
 from Crypto.Cipher import AES
 import base64
 from bot_app import config
+from common import envelope
 
 # Use AES in EAX mode for encryption/authentication
 KEY = config.ENCRYPTION_KEY
@@ -38,3 +39,22 @@ def decrypt_str(encrypted_base64: str) -> str:
         return plaintext_bytes.decode('utf-8')
     except Exception:
         return ""  # if decryption fails (e.g. data tampered), return empty or handle error
+
+def encrypt_profile(profile: dict) -> bytes:
+    """Encrypt a student profile (name, subject, level, notes) into one envelope."""
+    return envelope.seal_profile(KEY, profile)
+
+def decrypt_profile(row) -> dict:
+    """
+    Decrypt a student row in either format: the profile_enc envelope, or the
+    legacy per-column *_enc fields of rows that are not migrated yet.
+    """
+    if row["profile_enc"]:
+        try:
+            return envelope.open_profile(KEY, row["profile_enc"])
+        except envelope.EnvelopeError:
+            return {field: "" for field in envelope.PROFILE_FIELDS}
+    return {
+        field: decrypt_str(row[f"{field}_enc"]) if row[f"{field}_enc"] else ""
+        for field in envelope.PROFILE_FIELDS
+    }
@@ -0,0 +1,86 @@
+import hashlib
+import json
+import logging
+import uuid
+
+from bot_app import config, redis_cache
+
+# dedup:{user}:{student}:{type}:{payload hash} -> task_id задачи, отправленной в пределах окна
+DEDUP_PREFIX = "dedup:"
+# dedup:task:{task_id} -> ключ dedup:…, занятый задачей (чтобы снять его по результату)
+DEDUP_TASK_PREFIX = "dedup:task:"
+# Поля задачи, которые отличают одно действие от другого
+_PAYLOAD_FIELDS = ("description", "message", "solution_text", "refine")
+# delivered:{task_id} — результат уже доставлен в Telegram
+DELIVERED_PREFIX = "delivered:"
+
+
+def _payload_hash(task: dict) -> str:
+    # Регистр и пробелы не делают запрос другим (двойная отправка того же текста)
+    payload = {
+        field: " ".join(value.split()).casefold() if isinstance(value, str) else value
+        for field in _PAYLOAD_FIELDS
+        if (value := task.get(field)) is not None
+    }
+    raw = json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(raw).hexdigest()[:16]
+
+
+def _dedup_key(task: dict) -> str:
+    student = task.get("student_id") or "all"
+    return f"{DEDUP_PREFIX}{task['user_id']}:{student}:{task['type']}:{_payload_hash(task)}"
+
+
+async def claim(task: dict) -> str | None:
+    """
+    Give the task an idempotency key (task_id) and reserve its action for DEDUP_WINDOW.
+    Returns the task_id of an earlier submission of the same action if there is one
+    (the task should not be sent then), otherwise None.
+    """
+    task_id = task.setdefault("task_id", uuid.uuid4().hex)
+    if task["type"] not in config.DEDUP_TASK_TYPES:
+        return None
+    key = _dedup_key(task)
+    client = redis_cache._get_client()
+    try:
+        # SET NX GET: одна операция и резервирует действие, и возвращает уже занявший его task_id
+        previous = await client.set(key, task_id, nx=True, get=True, ex=config.DEDUP_WINDOW)
+        if not previous:
+            await client.set(DEDUP_TASK_PREFIX + task_id, key, ex=config.DEDUP_WINDOW)
+    except Exception as e:
+        logging.warning(f"dedup: Redis unavailable, sending without the check: {e}")
+        return None
+    return previous.decode() if previous else None
+
+
+async def release(task: dict) -> None:
+    """Free the action reserved by claim() (the task could not be sent)."""
+    if task["type"] not in config.DEDUP_TASK_TYPES:
+        return
+    await release_task(task["task_id"])
+
+
+async def release_task(task_id: str) -> None:
+    """Free the action reserved for task_id, if it still holds it (its result was delivered)."""
+    client = redis_cache._get_client()
+    try:
+        key = await client.getdel(DEDUP_TASK_PREFIX + task_id)
+        if key is not None:
+            await redis_cache.compare_and_delete(key.decode() if isinstance(key, bytes) else key, task_id)
+    except Exception as e:
+        logging.warning(f"dedup: Redis unavailable: {e}")
+
+
+async def already_delivered(task_id: str) -> bool:
+    try:
+        return bool(await redis_cache._get_client().exists(DELIVERED_PREFIX + task_id))
+    except Exception as e:
+        logging.warning(f"dedup: Redis unavailable: {e}")
+        return False
+
+
+async def mark_delivered(task_id: str) -> None:
+    try:
+        await redis_cache._get_client().set(DELIVERED_PREFIX + task_id, 1, ex=config.DELIVERED_TTL)
+    except Exception as e:
+        logging.warning(f"dedup: Redis unavailable: {e}")
@@ -0,0 +1,67 @@
+import html
+
+from aiogram import Bot
+
+TELEGRAM_TEXT_LIMIT = 4096
+
+# Границы, по которым режем длинный текст — от самой «мягкой» к самой жёсткой
+_SEPARATORS = ("\n\n", "\n", " ")
+# Самая длинная HTML-сущность после html.escape(quote=False) — "&amp;"
+_MAX_ENTITY = 5
+
+
+def escape(text: str) -> str:
+    """Экранирует текст модели для parse_mode=HTML."""
+    return html.escape(text, quote=False)
+
+
+def _split_escaped(text: str, limit: int, first_limit: int | None = None) -> list[str]:
+    """Режет уже экранированный текст; first_limit — лимит первой части (с местом под заголовок)."""
+    chunks = []
+    current = limit if first_limit is None else first_limit
+    while len(text) > current:
+        cut = -1
+        for sep in _SEPARATORS:
+            cut = text.rfind(sep, 0, current)
+            if cut > 0:
+                break
+        if cut <= 0:
+            # Одно «слово» длиннее лимита — режем жёстко, но не посреди &amp;
+            cut = current
+            amp = text.rfind("&", cut - _MAX_ENTITY, cut)
+            if amp != -1 and text.find(";", amp, cut) == -1:
+                cut = amp
+        chunks.append(text[:cut].rstrip())
+        text = text[cut:].lstrip()
+        current = limit
+    if text:
+        chunks.append(text)
+    return chunks
+
+
+def split_text(text: str, header: str = "", limit: int = TELEGRAM_TEXT_LIMIT) -> list[str]:
+    """
+    Готовит текст к отправке: экранирует его и режет на части не длиннее limit,
+    по абзацам, затем по строкам и словам. header — уже готовый HTML (например,
+    "📄 <b>План:</b>"), он идёт в начало первой части и никогда не режется и не
+    отправляется отдельной частью. Каждая часть — валидный HTML.
+    """
+    body = escape(text or "")
+    if not header:
+        return [chunk for chunk in _split_escaped(body, limit) if chunk]
+    # Первая часть короче на заголовок и перевод строки после него
+    chunks = [chunk for chunk in _split_escaped(body, limit, first_limit=max(1, limit - len(header) - 1)) if chunk]
+    if not chunks:
+        return [header]
+    chunks[0] = f"{header}\n{chunks[0]}"
+    return chunks
+
+
+async def send_chunks(bot: Bot, chat_id: int, chunks: list[str], reply_markup=None) -> None:
+    """
+    Отправляет части по порядку; клавиатура — у последней части.
+    Каждая отправка ждёт предыдущую: Telegram не гарантирует порядок параллельных запросов.
+    """
+    for i, chunk in enumerate(chunks):
+        markup = reply_markup if i == len(chunks) - 1 else None
+        await bot.send_message(chat_id, chunk, reply_markup=markup)
@@ -4,6 +4,7 @@ import os
 class RabbitBroker:
     def __init__(self):
         self.task_queue_name = os.getenv("TASK_QUEUE", "task_queue")
+        self.interactive_queue_name = os.getenv("INTERACTIVE_TASK_QUEUE", "task_queue_interactive")
         self.result_queue_name = os.getenv("RESULT_QUEUE", "result_queue")
         self.host = os.getenv("RABBITMQ_HOST", "rabbitmq")
         self.user = os.getenv("RABBITMQ_USER", "guest")
@@ -22,17 +23,20 @@ class RabbitBroker:
         self.channel = await self.conn.channel()
         # Создаём очереди
         await self.channel.declare_queue(self.task_queue_name, durable=True)
+        await self.channel.declare_queue(self.interactive_queue_name, durable=True)
         await self.channel.declare_queue(self.result_queue_name, durable=True)
 
-    async def publish_task(self, body: bytes):
+    async def publish_task(self, body: bytes, interactive: bool = False):
+        # Интерактивные задачи (чат) идут в отдельную очередь
         await self.channel.default_exchange.publish(
             aio_pika.Message(body=body),
-            routing_key=self.task_queue_name
+            routing_key=self.interactive_queue_name if interactive else self.task_queue_name
         )
 
     async def consume_tasks(self, callback):
-        queue = await self.channel.declare_queue(self.task_queue_name, durable=True)
-        await queue.consume(callback)
+        for name in (self.interactive_queue_name, self.task_queue_name):
+            queue = await self.channel.declare_queue(name, durable=True)
+            await queue.consume(callback)
 
     async def publish_result(self, body: bytes):
         await self.channel.default_exchange.publish(
@@ -0,0 +1,129 @@
+# common/blob_store.py
+
+import asyncio
+import hashlib
+import os
+import time
+import uuid
+
+
+class BlobStore:
+    """
+    Claim-check storage for large payloads (PDFs) shared by worker and bot.
+
+    The producer writes the bytes once with put() and sends only the returned
+    reference ({"backend", "key", "size", "sha256"}) through RabbitMQ; the
+    consumer reads the blob by reference and deletes it after delivery.
+    Blobs that are never delivered expire after `ttl` seconds.
+    """
+
+    backend = ""
+
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+
+    def _new_ref(self, data: bytes) -> dict:
+        return {
+            "backend": self.backend,
+            "key": uuid.uuid4().hex,
+            "size": len(data),
+            "sha256": hashlib.sha256(data).hexdigest(),
+        }
+
+    async def put(self, data: bytes) -> dict:
+        raise NotImplementedError
+
+    async def get(self, ref: dict) -> bytes | None:
+        raise NotImplementedError
+
+    async def delete(self, ref: dict) -> None:
+        raise NotImplementedError
+
+    @staticmethod
+    def verify(ref: dict, data: bytes) -> bool:
+        """Check that data matches the size and hash recorded in the reference."""
+        return len(data) == ref.get("size") and hashlib.sha256(data).hexdigest() == ref.get("sha256")
+
+
+class LocalBlobStore(BlobStore):
+    """Blobs as files in a directory shared by the containers (volume)."""
+
+    backend = "local"
+
+    def __init__(self, directory: str, ttl: int):
+        super().__init__(ttl)
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, ref: dict) -> str:
+        # Ключ генерируется нами (hex), но не доверяем содержимому сообщения
+        return os.path.join(self.directory, os.path.basename(ref["key"]))
+
+    def _write(self, ref: dict, data: bytes) -> None:
+        path = self.path(ref)
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def _read(self, ref: dict) -> bytes | None:
+        try:
+            with open(self.path(ref), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _remove(self, ref: dict) -> None:
+        try:
+            os.remove(self.path(ref))
+        except FileNotFoundError:
+            pass
+
+    def _sweep(self) -> int:
+        deadline = time.time() - self.ttl
+        removed = 0
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.is_file() and entry.stat().st_mtime < deadline:
+                    os.remove(entry.path)
+                    removed += 1
+            except FileNotFoundError:
+                continue
+        return removed
+
+    async def put(self, data: bytes) -> dict:
+        ref = self._new_ref(data)
+        await asyncio.to_thread(self._write, ref, data)
+        return ref
+
+    async def get(self, ref: dict) -> bytes | None:
+        return await asyncio.to_thread(self._read, ref)
+
+    async def delete(self, ref: dict) -> None:
+        await asyncio.to_thread(self._remove, ref)
+
+    async def sweep(self) -> int:
+        """Remove blobs older than ttl (undelivered results); returns how many were removed."""
+        return await asyncio.to_thread(self._sweep)
+
+
+class RedisBlobStore(BlobStore):
+    """Blobs as Redis strings with a TTL; needs no shared filesystem."""
+
+    backend = "redis"
+
+    def __init__(self, client, ttl: int, prefix: str = "blob:"):
+        super().__init__(ttl)
+        self.client = client
+        self.prefix = prefix
+
+    async def put(self, data: bytes) -> dict:
+        ref = self._new_ref(data)
+        await self.client.set(self.prefix + ref["key"], data, ex=self.ttl)
+        return ref
+
+    async def get(self, ref: dict) -> bytes | None:
+        return await self.client.get(self.prefix + ref["key"])
+
+    async def delete(self, ref: dict) -> None:
+        await self.client.delete(self.prefix + ref["key"])
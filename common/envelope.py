@@ -0,0 +1,70 @@
+# common/envelope.py
+
+import os
+import struct
+
+from Crypto.Cipher import AES
+
+# Формат записи ученика (students.profile_enc):
+#   version (1 байт) | nonce (16) | tag (16) | AES-EAX(payload)
+# payload — поля PROFILE_FIELDS по порядку, каждое как uint32 big-endian длина + UTF-8.
+# Байт версии аутентифицируется как associated data.
+PROFILE_VERSION = 1
+PROFILE_FIELDS = ("name", "subject", "level", "notes")
+
+_NONCE_SIZE = 16
+_TAG_SIZE = 16
+_LEN = struct.Struct(">I")
+
+
+class EnvelopeError(ValueError):
+    """Envelope is malformed, of an unknown version, or failed authentication."""
+
+
+def seal_profile(key: bytes, profile: dict) -> bytes:
+    """Encrypt all profile fields into one authenticated envelope."""
+    payload = bytearray()
+    for field in PROFILE_FIELDS:
+        data = (profile.get(field) or "").encode("utf-8")
+        payload += _LEN.pack(len(data)) + data
+    header = bytes([PROFILE_VERSION])
+    nonce = os.urandom(_NONCE_SIZE)
+    cipher = AES.new(key, AES.MODE_EAX, nonce=nonce)
+    cipher.update(header)
+    ciphertext, tag = cipher.encrypt_and_digest(bytes(payload))
+    return header + nonce + tag + ciphertext
+
+
+def open_profile(key: bytes, envelope: bytes) -> dict:
+    """Decrypt an envelope produced by seal_profile(); raises EnvelopeError."""
+    envelope = bytes(envelope)
+    if len(envelope) < 1 + _NONCE_SIZE + _TAG_SIZE:
+        raise EnvelopeError("envelope is too short")
+    version = envelope[0]
+    if version != PROFILE_VERSION:
+        raise EnvelopeError(f"unknown envelope version {version}")
+    nonce = envelope[1:1 + _NONCE_SIZE]
+    tag = envelope[1 + _NONCE_SIZE:1 + _NONCE_SIZE + _TAG_SIZE]
+    ciphertext = envelope[1 + _NONCE_SIZE + _TAG_SIZE:]
+    cipher = AES.new(key, AES.MODE_EAX, nonce=nonce)
+    cipher.update(envelope[:1])
+    try:
+        payload = cipher.decrypt_and_verify(ciphertext, tag)
+    except ValueError as e:
+        raise EnvelopeError("envelope authentication failed") from e
+
+    profile = {}
+    offset = 0
+    for field in PROFILE_FIELDS:
+        if offset + _LEN.size > len(payload):
+            raise EnvelopeError("truncated payload")
+        (length,) = _LEN.unpack_from(payload, offset)
+        offset += _LEN.size
+        if offset + length > len(payload):
+            raise EnvelopeError(f"truncated field {field}")
+        try:
+            profile[field] = payload[offset:offset + length].decode("utf-8")
+        except UnicodeDecodeError as e:
+            raise EnvelopeError(f"field {field} is not valid UTF-8") from e
+        offset += length
+    return profile
@@ -0,0 +1,63 @@
+# common/rate_limit.py
+
+import asyncio
+import time
+
+
+class TokenBucket:
+    """
+    Classic token bucket: holds up to `capacity` tokens and refills at `rate`
+    tokens per second. Not thread-safe; meant for a single asyncio loop.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    @property
+    def tokens(self) -> float:
+        self._refill()
+        return self._tokens
+
+    def delay_for(self, amount: float = 1) -> float:
+        """Seconds until `amount` tokens are available (0 if already available)."""
+        self._refill()
+        missing = min(amount, self.capacity) - self._tokens
+        if missing <= 0:
+            return 0.0
+        return missing / self.rate if self.rate > 0 else float("inf")
+
+    def try_acquire(self, amount: float = 1) -> bool:
+        """Take tokens if available right now."""
+        self._refill()
+        if self._tokens >= min(amount, self.capacity):
+            self._tokens -= amount
+            return True
+        return False
+
+    def consume(self, amount: float) -> None:
+        """Take (or, with a negative amount, return) tokens unconditionally; may go below zero."""
+        self._refill()
+        self._tokens = min(self.capacity, self._tokens - amount)
+
+    def limit(self, remaining: float) -> None:
+        """Clamp the bucket to a remaining budget reported by the server."""
+        self._refill()
+        self._tokens = min(self._tokens, remaining)
+
+    def pause(self, seconds: float) -> None:
+        """Empty the bucket so that it only refills after `seconds`."""
+        self._refill()
+        self._tokens = min(self._tokens, -seconds * self.rate)
+
+    async def acquire(self, amount: float = 1) -> None:
+        """Wait until tokens are available and take them."""
+        while not self.try_acquire(amount):
+            await asyncio.sleep(self.delay_for(amount))
@@ -0,0 +1,22 @@
+# common/usage_meter.py
+
+# Счётчики запросов пользователей в Redis (write-behind, переносятся в Postgres воркером).
+#   usage:pending          HASH user_id -> сколько запросов ещё не записано в БД (HINCRBY)
+#   usage:batch:<id>       HASH, снятый с usage:pending при сбросе (RENAME), пока не записан в БД
+#   usage:batches          ZSET имён таких пачек, score — время снятия (для восстановления)
+# Пачка удаляется из Redis только после коммита в БД; повторная запись той же пачки
+# отсекается таблицей usage_flush_log.
+PENDING_KEY = "usage:pending"
+BATCH_PREFIX = "usage:batch:"
+BATCHES_KEY = "usage:batches"
+
+
+async def pending_delta(client, user_id: int) -> int:
+    """Requests counted in Redis but not yet written to users.usage_count."""
+    batches = await client.zrange(BATCHES_KEY, 0, -1)
+    async with client.pipeline(transaction=False) as pipe:
+        pipe.hget(PENDING_KEY, user_id)
+        for key in batches:
+            pipe.hget(key, user_id)
+        values = await pipe.execute()
+    return sum(int(v) for v in values if v)
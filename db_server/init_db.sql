@@ -20,12 +20,22 @@ CREATE TABLE IF NOT EXISTS students (
     user_id      BIGINT       NOT NULL
         REFERENCES users(telegram_id)
         ON DELETE CASCADE,
-    name_enc     TEXT         NOT NULL,
-    subject_enc  TEXT         NOT NULL,
-    level_enc    TEXT         NOT NULL,
+    -- Профиль одним зашифрованным конвертом (common/envelope.py)
+    profile_enc  BYTEA,
+    -- Старый формат: каждое поле зашифровано отдельно (NULL после миграции)
+    name_enc     TEXT,
+    subject_enc  TEXT,
+    level_enc    TEXT,
     notes_enc    TEXT
 );
 
 -- Индекс для быстрого поиска учеников по пользователю
 CREATE INDEX IF NOT EXISTS idx_students_user_id
     ON students(user_id);
+
+-- Журнал пачек usage_count, перенесённых из Redis (worker/services/usage_meter.py):
+-- пачка, записанная до падения воркера, при повторе не прибавляется второй раз
+CREATE TABLE IF NOT EXISTS usage_flush_log (
+    batch_id    TEXT         PRIMARY KEY,
+    flushed_at  TIMESTAMPTZ  NOT NULL DEFAULT now()
+);
@@ -0,0 +1,14 @@
+-- db_server/migrations/001_student_profile_envelope.sql
+-- Профиль ученика одним зашифрованным конвертом вместо четырёх *_enc колонок.
+-- После применения существующие строки перешифровывает воркер
+-- (фоном при PROFILE_MIGRATION_ENABLED=1 или вручную: python -m worker.migrate_profiles).
+
+ALTER TABLE students ADD COLUMN IF NOT EXISTS profile_enc BYTEA;
+
+ALTER TABLE students ALTER COLUMN name_enc    DROP NOT NULL;
+ALTER TABLE students ALTER COLUMN subject_enc DROP NOT NULL;
+ALTER TABLE students ALTER COLUMN level_enc   DROP NOT NULL;
+
+-- Быстрый поиск ещё не перенесённых строк
+CREATE INDEX IF NOT EXISTS idx_students_profile_pending
+    ON students(id) WHERE profile_enc IS NULL;
@@ -0,0 +1,8 @@
+-- db_server/migrations/002_usage_flush_log.sql
+-- usage_count теперь копится в Redis и переносится в users пачками
+-- (worker/services/usage_meter.py). Журнал делает перенос пачки идемпотентным.
+
+CREATE TABLE IF NOT EXISTS usage_flush_log (
+    batch_id    TEXT         PRIMARY KEY,
+    flushed_at  TIMESTAMPTZ  NOT NULL DEFAULT now()
+);
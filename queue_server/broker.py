@@ -11,9 +11,15 @@ logger = logging.getLogger(__name__)
 class RabbitBroker:
     """
     Обёртка для подключения к RabbitMQ и работы с очередями задач и результатов.
+    Поток сообщений:
+      бот → SCHEDULER_QUEUE → планировщик → TASK_QUEUE / INTERACTIVE_TASK_QUEUE → воркеры
+      воркеры → WORKER_RESULT_QUEUE → планировщик → RESULT_QUEUE → бот
+      (только итоговые результаты; промежуточные воркеры шлют боту в RESULT_QUEUE напрямую)
+    Работает, когда у бота и воркеров включён SCHEDULER_ENABLED=1.
     Все настройки берутся из переменных окружения:
-      - RABBITMQ_HOST, RABBITMQ_PORT, RABBITMQ_USER, RABBITMQ_PASS
-      - TASK_QUEUE, RESULT_QUEUE
+      - RABBITMQ_HOST, RABBITMQ_PORT, RABBITMQ_USER, RABBITMQ_PASS, SCHEDULER_PREFETCH
+      - RABBITMQ_SCHEDULER_QUEUE, RABBITMQ_TASK_QUEUE, RABBITMQ_INTERACTIVE_TASK_QUEUE,
+        RABBITMQ_WORKER_RESULT_QUEUE, RABBITMQ_RESULT_QUEUE
     """
 
     def __init__(self):
@@ -22,13 +28,19 @@ class RabbitBroker:
         self.port = int(os.getenv("RABBITMQ_PORT", "5672"))
         self.user = os.getenv("RABBITMQ_USER", "guest")
         self.password = os.getenv("RABBITMQ_PASS", "guest")
-        self.task_queue_name = os.getenv("TASK_QUEUE", "task_queue")
-        self.result_queue_name = os.getenv("RESULT_QUEUE", "result_queue")
+        # Имена очередей — те же переменные, что у бота и воркера
+        self.inbox_queue_name = os.getenv("RABBITMQ_SCHEDULER_QUEUE", "task_inbox")
+        self.task_queue_name = os.getenv("RABBITMQ_TASK_QUEUE", "task_queue")
+        self.interactive_queue_name = os.getenv("RABBITMQ_INTERACTIVE_TASK_QUEUE", "task_queue_interactive")
+        self.worker_result_queue_name = os.getenv("RABBITMQ_WORKER_RESULT_QUEUE", "worker_result_queue")
+        self.result_queue_name = os.getenv("RABBITMQ_RESULT_QUEUE", "result_queue")
+        # Задачи из входящей очереди подтверждаются сразу после записи в Redis (queue_server/storage.py)
+        self.prefetch = int(os.getenv("SCHEDULER_PREFETCH", "100"))
 
         self._connection: aio_pika.RobustConnection | None = None
         self._channel: aio_pika.abc.AbstractChannel | None = None
-        self._task_queue: aio_pika.abc.AbstractQueue | None = None
-        self._result_queue: aio_pika.abc.AbstractQueue | None = None
+        self._inbox_queue: aio_pika.abc.AbstractQueue | None = None
+        self._worker_result_queue: aio_pika.abc.AbstractQueue | None = None
 
     async def connect(self):
         """Устанавливает соединение и инициализирует очередь задач и результатов."""
@@ -40,16 +52,17 @@ class RabbitBroker:
             password=self.password
         )
         self._channel = await self._connection.channel()
-        # Опционально: ограничить число одновременно доставляемых сообщений
-        await self._channel.set_qos(prefetch_count=1)
+        await self._channel.set_qos(prefetch_count=self.prefetch)
 
         # Объявляем (или получаем) очереди
-        self._task_queue = await self._channel.declare_queue(
-            self.task_queue_name, durable=True
+        self._inbox_queue = await self._channel.declare_queue(
+            self.inbox_queue_name, durable=True
         )
-        self._result_queue = await self._channel.declare_queue(
-            self.result_queue_name, durable=True
+        self._worker_result_queue = await self._channel.declare_queue(
+            self.worker_result_queue_name, durable=True
         )
+        for name in (self.task_queue_name, self.interactive_queue_name, self.result_queue_name):
+            await self._channel.declare_queue(name, durable=True)
         logger.info("RabbitMQ connection established, queues declared.")
 
     async def consume_tasks(
@@ -57,13 +70,13 @@ class RabbitBroker:
         callback: Callable[[IncomingMessage], Awaitable[None]]
     ):
         """
-        Подписка на входящую очередь задач.
+        Подписка на входящую очередь задач от бота.
         callback — async-функция, принимающая IncomingMessage.
         """
-        if not self._task_queue:
-            raise RuntimeError("Task queue is not initialized. Call connect() first.")
-        logger.info(f"Starting to consume tasks from '{self.task_queue_name}'...")
-        await self._task_queue.consume(callback, no_ack=False)
+        if not self._inbox_queue:
+            raise RuntimeError("Inbox queue is not initialized. Call connect() first.")
+        logger.info(f"Starting to consume tasks from '{self.inbox_queue_name}'...")
+        await self._inbox_queue.consume(callback, no_ack=False)
 
     async def consume_results(
         self,
@@ -72,14 +85,16 @@ class RabbitBroker:
         """
         Подписка на очередь результатов от воркеров.
         """
-        if not self._result_queue:
+        if not self._worker_result_queue:
             raise RuntimeError("Result queue is not initialized. Call connect() first.")
-        logger.info(f"Starting to consume results from '{self.result_queue_name}'...")
-        await self._result_queue.consume(callback, no_ack=False)
+        logger.info(f"Starting to consume results from '{self.worker_result_queue_name}'...")
+        await self._worker_result_queue.consume(callback, no_ack=False)
 
-    async def publish_task(self, body: bytes):
+    async def publish_task(self, body: bytes, interactive: bool = False):
         """
         Публикует задачу в очередь воркеров.
+        interactive=True — в интерактивную очередь (чат), которую воркеры обслуживают
+        с зарезервированной конкурентностью.
         """
         if not self._channel:
             raise RuntimeError("Channel is not initialized. Call connect() first.")
@@ -87,11 +102,12 @@ class RabbitBroker:
             body,
             delivery_mode=DeliveryMode.PERSISTENT
         )
+        routing_key = self.interactive_queue_name if interactive else self.task_queue_name
         await self._channel.default_exchange.publish(
             message,
-            routing_key=self.task_queue_name
+            routing_key=routing_key
         )
-        logger.debug(f"Published task to '{self.task_queue_name}'")
+        logger.debug(f"Published task to '{routing_key}'")
 
     async def publish_result(self, body: bytes):
         """
@@ -1,67 +1,261 @@
 import asyncio
 import json
 import logging
+import os
+import time
+import uuid
+from collections import deque
+
 import aio_pika
 
 logger = logging.getLogger(__name__)
 
 
+def _parse_mapping(value: str, cast=float) -> dict:
+    """Parse "basic:1,premium:3" into {"basic": 1.0, "premium": 3.0}."""
+    result = {}
+    for item in value.split(","):
+        if ":" in item:
+            name, raw = item.split(":", 1)
+            result[name.strip()] = cast(raw.strip())
+    return result
+
+
 class Scheduler:
     """
-    Scheduler: принимает задачи от бота, кладёт их во внутреннюю очередь,
+    Scheduler: принимает задачи от бота, раскладывает их по очередям пользователей,
     распределяет их воркерам и перенаправляет обратно результаты.
+
+    Диспетчеризация — deficit round robin по пользователям: за круг пользователь
+    получает квант, равный весу его тарифа (PLAN_WEIGHTS), а задача «стоит»
+    TASK_COSTS[type]. Число задач пользователя в работе ограничено PLAN_MAX_IN_FLIGHT;
+    слот освобождается по результату с тем же task_id или по истечении INFLIGHT_TIMEOUT.
     """
 
-    def __init__(self, broker):
+    # Задачи, на которые воркер не присылает результата — их не учитываем в in-flight
+    NO_RESULT_TYPES = {"end_chat"}
+    # Задачи, которые уходят воркерам через интерактивную очередь
+    INTERACTIVE_TYPES = {"chat_gpt", "end_chat"}
+
+    def __init__(self, broker, store):
         self.broker = broker
-        self.pending_tasks: asyncio.Queue = asyncio.Queue()
+        # Ждущие задачи хранятся в Redis (queue_server/storage.py), входящая очередь подтверждается сразу
+        self.store = store
+        self.plan_weights = _parse_mapping(os.getenv("PLAN_WEIGHTS", "basic:1,premium:3"))
+        self.plan_max_in_flight = _parse_mapping(os.getenv("PLAN_MAX_IN_FLIGHT", "basic:2,premium:5"), int)
+        self.task_costs = _parse_mapping(
+            os.getenv("TASK_COSTS", "chat_gpt:1,generate_plan:2,generate_tasks:2,check_homework:3,generate_tasks_batch:10")
+        )
+        self.inflight_timeout = float(os.getenv("INFLIGHT_TIMEOUT", "300"))
+
+        # user_id -> очередь задач пользователя
+        self._queues: dict[object, deque] = {}
+        # пользователи с непустыми очередями в порядке обхода
+        self._active: deque = deque()
+        self._deficit: dict[object, float] = {}
+        # user_id -> {task_id: время отправки воркерам}
+        self._in_flight: dict[object, dict[str, float]] = {}
+        # task_id -> user_id, для освобождения слота по результату
+        self._task_owner: dict[str, object] = {}
+        # task_id -> (user_id, JSON задачи в store) для ждущих отправки задач
+        self._stored: dict[str, tuple[object, str]] = {}
+        self._wakeup = asyncio.Event()
 
     async def run(self):
         """
-        Запускает приём задач, их рассылку воркерам и пересылку результатов боту.
+        Восстанавливает ждущие задачи из Redis, затем запускает приём задач,
+        их рассылку воркерам и пересылку результатов боту.
         """
+        for raw in await self.store.load():
+            try:
+                task = json.loads(raw)
+            except ValueError:
+                logger.error(f"[Scheduler] Dropping unreadable stored task: {raw[:100]!r}")
+                continue
+            self._stored[task["task_id"]] = (task.get("user_id"), raw)
+            self.enqueue(task)
         await asyncio.gather(
             self._consume_tasks_loop(),
             self._dispatch_loop(),
             self._process_results_loop(),
         )
 
+    @property
+    def pending_count(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    def enqueue(self, task: dict) -> None:
+        """Put a task into its user's subqueue (interactive tasks ahead of batch ones)."""
+        task.setdefault("task_id", uuid.uuid4().hex)
+        user = task.get("user_id")
+        queue = self._queues.get(user)
+        if queue is None:
+            queue = self._queues[user] = deque()
+        if not queue:
+            self._active.append(user)
+            self._deficit.setdefault(user, 0.0)
+        if task.get("type") in self.INTERACTIVE_TYPES:
+            # Чат обгоняет генерацию того же пользователя, сохраняя порядок сообщений
+            pos = 0
+            while pos < len(queue) and queue[pos].get("type") in self.INTERACTIVE_TYPES:
+                pos += 1
+            queue.insert(pos, task)
+        else:
+            queue.append(task)
+        self._wakeup.set()
+
+    def _plan(self, user) -> str:
+        queue = self._queues.get(user)
+        if queue:
+            return queue[0].get("plan") or "basic"
+        return "basic"
+
+    def _weight(self, user) -> float:
+        return self.plan_weights.get(self._plan(user), 1.0)
+
+    def _cap(self, user) -> int:
+        return int(self.plan_max_in_flight.get(self._plan(user), 1))
+
+    def _cost(self, task: dict) -> float:
+        return self.task_costs.get(task.get("type"), 1.0)
+
+    def _expire_in_flight(self) -> None:
+        deadline = time.monotonic() - self.inflight_timeout
+        for user, tasks in list(self._in_flight.items()):
+            for task_id, started in list(tasks.items()):
+                if started < deadline:
+                    logger.warning(f"[Scheduler] Task id={task_id} of user {user} timed out in flight")
+                    self._release(task_id)
+
+    def _release(self, task_id: str) -> None:
+        user = self._task_owner.pop(task_id, None)
+        if user is None:
+            return
+        tasks = self._in_flight.get(user)
+        if tasks is not None:
+            tasks.pop(task_id, None)
+            if not tasks:
+                del self._in_flight[user]
+        self._wakeup.set()
+
+    def _next_batch(self) -> tuple[list[dict], bool]:
+        """
+        One DRR round: every active user that is under its in-flight cap gets
+        its quantum added and sends tasks while the deficit covers their cost.
+        Returns the tasks to dispatch and whether any user could still send
+        (False when everyone is idle or at the in-flight cap).
+        """
+        batch = []
+        runnable = False
+        for _ in range(len(self._active)):
+            user = self._active.popleft()
+            queue = self._queues[user]
+            in_flight = self._in_flight.setdefault(user, {})
+            if len(in_flight) >= self._cap(user):
+                # Пользователь упёрся в лимит — пропускаем, дефицит не накапливаем
+                self._active.append(user)
+                if not in_flight:
+                    del self._in_flight[user]
+                continue
+            runnable = True
+            self._deficit[user] += self._weight(user)
+            while queue and self._deficit[user] >= self._cost(queue[0]) and len(in_flight) < self._cap(user):
+                task = queue.popleft()
+                self._deficit[user] -= self._cost(task)
+                if task.get("type") not in self.NO_RESULT_TYPES:
+                    in_flight[task["task_id"]] = time.monotonic()
+                    self._task_owner[task["task_id"]] = user
+                batch.append(task)
+            if not in_flight:
+                del self._in_flight[user]
+            if queue:
+                self._active.append(user)
+            else:
+                # Очередь опустела — дефицит не переносится на будущее
+                del self._queues[user]
+                self._deficit.pop(user, None)
+        return batch, runnable
+
     async def _consume_tasks_loop(self):
         """
-        Слушает очередь задач от бота и кладёт каждую задачу во внутреннюю очередь.
+        Слушает очередь задач от бота и кладёт каждую задачу в очередь её пользователя.
         """
         async def on_task(message: aio_pika.IncomingMessage):
-            async with message.process():
-                try:
-                    payload = message.body.decode()
-                    task = json.loads(payload)
-                    task_id = task.get("task_id", "<no-id>")
-                    logger.info(f"[Scheduler] Received task id={task_id} type={task.get('type')}")
-                    await self.pending_tasks.put(task)
-                except Exception as e:
-                    logger.error(f"[Scheduler] Error parsing incoming task: {e}")
+            try:
+                task = json.loads(message.body.decode())
+                task.setdefault("task_id", uuid.uuid4().hex)
+            except Exception as e:
+                logger.error(f"[Scheduler] Error parsing incoming task: {e}")
+                await message.reject(requeue=False)
+                return
+            if task["task_id"] in self._stored:
+                # Повторная доставка задачи, которая уже ждёт в очереди пользователя
+                await message.ack()
+                return
+            raw = json.dumps(task)
+            try:
+                await self.store.add(task.get("user_id"), raw)
+            except Exception as e:
+                logger.error(f"[Scheduler] Failed to store task {task['task_id']}, returning it to the inbox: {e}")
+                await asyncio.sleep(1)
+                await message.nack(requeue=True)
+                return
+            # Задача сохранена — подтверждаем сразу: prefetch не расходуется на ждущие задачи,
+            # и поток задач одного пользователя не задерживает задачи остальных во входящей очереди
+            await message.ack()
+            self._stored[task["task_id"]] = (task.get("user_id"), raw)
+            self.enqueue(task)
+            logger.info(
+                f"[Scheduler] Received task id={task['task_id']} type={task.get('type')} "
+                f"user={task.get('user_id')} plan={task.get('plan', 'basic')}"
+            )
 
         # broker.consume_tasks настраивает подписку на RabbitMQ-очередь задач
         await self.broker.consume_tasks(on_task)
 
     async def _dispatch_loop(self):
         """
-        Берёт задачу из внутренней очереди и отправляет её воркерам.
+        Раздаёт задачи воркерам по кругам DRR; если все пользователи упёрлись в лимит
+        или задач нет, ждёт новую задачу или результат.
         """
         while True:
-            task = await self.pending_tasks.get()
-            try:
-                body = json.dumps(task).encode()
-                await self.broker.publish_task(body)
-                logger.info(f"[Scheduler] Dispatched task id={task.get('task_id')} type={task.get('type')}")
-            except Exception as e:
-                logger.error(f"[Scheduler] Failed to dispatch task {task.get('task_id')}: {e}")
-            finally:
-                self.pending_tasks.task_done()
+            self._expire_in_flight()
+            batch, runnable = self._next_batch()
+            if not batch:
+                if runnable:
+                    # Дефицит ещё не покрыл стоимость задачи — следующий круг
+                    await asyncio.sleep(0)
+                    continue
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.inflight_timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            for task in batch:
+                try:
+                    body = json.dumps(task).encode()
+                    await self.broker.publish_task(body, interactive=task.get("type") in self.INTERACTIVE_TYPES)
+                    logger.info(f"[Scheduler] Dispatched task id={task.get('task_id')} type={task.get('type')}")
+                except Exception as e:
+                    logger.error(f"[Scheduler] Failed to dispatch task {task.get('task_id')}: {e}")
+                    self._release(task["task_id"])
+                    # Задача остаётся в store — ставим её обратно в очередь пользователя
+                    self.enqueue(task)
+                    await asyncio.sleep(1)
+                    continue
+                stored = self._stored.pop(task["task_id"], None)
+                if stored is not None:
+                    try:
+                        await self.store.remove(*stored)
+                    except Exception as e:
+                        # Не страшно: после перезапуска задача уйдёт ещё раз, воркер узнает её по task_id
+                        logger.warning(f"[Scheduler] Failed to drop dispatched task {task['task_id']} from store: {e}")
 
     async def _process_results_loop(self):
         """
-        Слушает очередь результатов от воркеров и пересылает их боту.
+        Слушает очередь результатов от воркеров (WORKER_RESULT_QUEUE) и пересылает их
+        боту (RESULT_QUEUE).
         """
         async def on_result(message: aio_pika.IncomingMessage):
             async with message.process():
@@ -69,10 +263,12 @@ class Scheduler:
                     payload = message.body  # уже байты JSON
                     result = json.loads(payload.decode())
                     task_id = result.get("task_id", "<no-id>")
-                    logger.info(f"[Scheduler] Received result for task id={task_id}")
+                    if result.get("type") != "partial":
+                        logger.info(f"[Scheduler] Received result for task id={task_id}")
+                        # Задача завершена — освобождаем слот пользователя
+                        self._release(task_id)
                     # Пересылаем результат в очередь бота
                     await self.broker.publish_result(payload)
-                    logger.info(f"[Scheduler] Forwarded result id={task_id} to bot")
                 except Exception as e:
                     logger.error(f"[Scheduler] Error processing result: {e}")
 
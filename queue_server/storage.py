@@ -0,0 +1,52 @@
+import logging
+import os
+
+import redis.asyncio as redis
+
+logger = logging.getLogger(__name__)
+
+
+class TaskStore:
+    """
+    Очереди пользователей планировщика в Redis: задача из входящей очереди подтверждается
+    сразу после записи сюда, поэтому RabbitMQ не держит ждущие задачи неподтверждёнными
+    и поток одного пользователя не занимает prefetch остальных.
+      sched:tasks:<user_id>   LIST задач пользователя (JSON) в порядке поступления
+      sched:users             SET пользователей, у которых могут быть задачи
+    Задача удаляется из списка после отправки воркерам.
+    """
+
+    TASKS_PREFIX = "sched:tasks:"
+    USERS_KEY = "sched:users"
+
+    def __init__(self):
+        self._client = redis.Redis(
+            host=os.getenv("REDIS_HOST", "redis"),
+            port=int(os.getenv("REDIS_PORT", "6379")),
+            db=int(os.getenv("REDIS_DB_SCHEDULER", "2")),
+        )
+
+    async def add(self, user, raw: str) -> None:
+        async with self._client.pipeline(transaction=True) as pipe:
+            pipe.rpush(f"{self.TASKS_PREFIX}{user}", raw)
+            pipe.sadd(self.USERS_KEY, str(user))
+            await pipe.execute()
+
+    async def remove(self, user, raw: str) -> None:
+        await self._client.lrem(f"{self.TASKS_PREFIX}{user}", 1, raw)
+
+    async def load(self) -> list[str]:
+        """All stored tasks (raw JSON), each user's in arrival order."""
+        tasks = []
+        for user in await self._client.smembers(self.USERS_KEY):
+            user = user.decode() if isinstance(user, bytes) else user
+            items = await self._client.lrange(f"{self.TASKS_PREFIX}{user}", 0, -1)
+            if not items:
+                await self._client.srem(self.USERS_KEY, user)
+                continue
+            tasks.extend(item.decode() if isinstance(item, bytes) else item for item in items)
+        logger.info(f"Restored {len(tasks)} waiting task(s) from Redis")
+        return tasks
+
+    async def close(self) -> None:
+        await self._client.close()
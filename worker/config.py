@@ -2,6 +2,7 @@
 
 import os
 import string
+import tempfile
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -20,6 +21,30 @@ RABBITMQ_USER = os.getenv("RABBITMQ_USER", "guest")
 RABBITMQ_PASS = os.getenv("RABBITMQ_PASS", "guest")
 TASK_QUEUE    = os.getenv("RABBITMQ_TASK_QUEUE", "task_queue")
 RESULT_QUEUE  = os.getenv("RABBITMQ_RESULT_QUEUE", "result_queue")
+# При SCHEDULER_ENABLED=1 итоговые результаты уходят планировщику (queue_server): он освобождает
+# слот пользователя и пересылает их боту. Промежуточные (partial) всегда идут боту напрямую
+SCHEDULER_ENABLED   = os.getenv("SCHEDULER_ENABLED", "0") == "1"
+WORKER_RESULT_QUEUE = os.getenv("RABBITMQ_WORKER_RESULT_QUEUE", "worker_result_queue")
+# Интерактивная очередь (чат) обрабатывается отдельно от тяжёлой генерации
+INTERACTIVE_TASK_QUEUE = os.getenv("RABBITMQ_INTERACTIVE_TASK_QUEUE", "task_queue_interactive")
+
+# Concurrency
+# Сколько задач воркер выполняет одновременно и сколько сообщений держит неподтверждёнными
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "16"))
+WORKER_PREFETCH    = int(os.getenv("WORKER_PREFETCH", str(WORKER_CONCURRENCY * 2)))
+# Слоты, которые задачи из основной очереди не занимают — они остаются за чатом
+INTERACTIVE_RESERVED = int(os.getenv("INTERACTIVE_RESERVED", "4"))
+INTERACTIVE_PREFETCH = int(os.getenv("INTERACTIVE_PREFETCH", str(INTERACTIVE_RESERVED * 2)))
+# Отдельные лимиты по типам задач (0 — только общий лимит)
+TASK_CONCURRENCY_LIMITS = {
+    "chat_gpt":       int(os.getenv("CONCURRENCY_CHAT_GPT", "16")),
+    "generate_plan":  int(os.getenv("CONCURRENCY_GENERATE_PLAN", "4")),
+    "generate_tasks": int(os.getenv("CONCURRENCY_GENERATE_TASKS", "4")),
+    "check_homework": int(os.getenv("CONCURRENCY_CHECK_HOMEWORK", "4")),
+    "generate_tasks_batch": int(os.getenv("CONCURRENCY_GENERATE_TASKS_BATCH", "1")),
+}
+# Сколько учеников пакетной задачи обрабатываются параллельно (GPT + PDF)
+BATCH_PARALLELISM = int(os.getenv("BATCH_PARALLELISM", "5"))
 
 # Redis
 REDIS_HOST     = os.getenv("REDIS_HOST", "redis")
@@ -44,3 +69,110 @@ else:
 # OpenAI
 _openai_keys = os.getenv("OPENAI_API_KEYS", "")
 OPENAI_API_KEYS = [k.strip() for k in _openai_keys.split(",") if k.strip()]
+# Лимиты на один ключ и время вывода ключа из ротации после ошибок
+OPENAI_KEY_RPM      = int(os.getenv("OPENAI_KEY_RPM", "500"))      # запросов в минуту
+OPENAI_KEY_TPM      = int(os.getenv("OPENAI_KEY_TPM", "90000"))    # токенов в минуту
+OPENAI_KEY_COOLDOWN = float(os.getenv("OPENAI_KEY_COOLDOWN", "30"))  # секунд
+OPENAI_REQUEST_TIMEOUT = float(os.getenv("OPENAI_REQUEST_TIMEOUT", "90"))  # секунд на запрос к API
+
+# LaTeX rendering
+# Число одновременных процессов pdflatex (по умолчанию — по числу ядер)
+RENDER_CONCURRENCY = int(os.getenv("RENDER_CONCURRENCY", str(os.cpu_count() or 2)))
+RENDER_TIMEOUT     = float(os.getenv("RENDER_TIMEOUT", "60"))   # секунд на один документ
+# Шаблоны templates/*.tex и каталог для предкомпилированных форматов (.fmt)
+LATEX_TEMPLATES_DIR = os.getenv(
+    "LATEX_TEMPLATES_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "templates"),
+)
+LATEX_FORMAT_DIR = os.getenv("LATEX_FORMAT_DIR", os.path.join(tempfile.gettempdir(), "riverai_fmt"))
+
+# Metrics (периодический вывод в лог; 0 — выключено)
+METRICS_LOG_INTERVAL = float(os.getenv("METRICS_LOG_INTERVAL", "60"))
+
+# PDF render cache (ключ — хэш шаблона и экранированного текста)
+PDF_CACHE_ENABLED    = os.getenv("PDF_CACHE_ENABLED", "1") == "1"
+PDF_CACHE_DIR        = os.getenv("PDF_CACHE_DIR", os.path.join(tempfile.gettempdir(), "riverai_pdf_cache"))
+PDF_CACHE_MAX_BYTES  = int(os.getenv("PDF_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+# Общий уровень кэша между воркерами: "" (нет), "redis" или "dir"
+PDF_CACHE_SHARED     = os.getenv("PDF_CACHE_SHARED", "").lower()
+PDF_CACHE_SHARED_DIR = os.getenv("PDF_CACHE_SHARED_DIR", "")
+PDF_CACHE_SHARED_TTL = int(os.getenv("PDF_CACHE_SHARED_TTL", str(7 * 24 * 3600)))
+
+# GPT response cache (opt-in: список типов задач через запятую, напр. "generate_plan,generate_tasks")
+GPT_CACHE_TASK_TYPES = {t.strip() for t in os.getenv("GPT_CACHE_TASK_TYPES", "").split(",") if t.strip()}
+GPT_CACHE_TTL        = int(os.getenv("GPT_CACHE_TTL", str(24 * 3600)))
+
+# Streaming GPT responses (промежуточные события в очередь результатов)
+GPT_STREAM_TASK_TYPES   = {t.strip() for t in os.getenv("GPT_STREAM_TASK_TYPES", "chat_gpt,generate_plan").split(",") if t.strip()}
+STREAM_PUBLISH_INTERVAL = float(os.getenv("STREAM_PUBLISH_INTERVAL", "1.0"))   # секунд между событиями
+
+# Single-flight: объединение одинаковых одновременных запросов к GPT (в процессе и между воркерами)
+SINGLEFLIGHT_ENABLED       = os.getenv("SINGLEFLIGHT_ENABLED", "1") == "1"
+SINGLEFLIGHT_LOCK_TTL      = int(os.getenv("SINGLEFLIGHT_LOCK_TTL", "120"))       # секунд
+SINGLEFLIGHT_RESULT_TTL    = int(os.getenv("SINGLEFLIGHT_RESULT_TTL", "30"))      # секунд
+SINGLEFLIGHT_POLL_INTERVAL = float(os.getenv("SINGLEFLIGHT_POLL_INTERVAL", "0.5"))
+
+# Claim-check для PDF: файл кладётся в хранилище, в сообщении — только ссылка
+# "redis", "local" (общий каталог BLOB_DIR) или "" — по-старому, base64 внутри сообщения
+BLOB_BACKEND = os.getenv("BLOB_BACKEND", "redis").lower()
+BLOB_DIR     = os.getenv("BLOB_DIR", "/var/lib/riverai/blobs")
+BLOB_TTL     = int(os.getenv("BLOB_TTL", str(24 * 3600)))   # недоставленные файлы удаляются через сутки
+
+# Перенос учеников в формат одного конверта (profile_enc), см. worker/migrate_profiles.py
+PROFILE_MIGRATION_ENABLED = os.getenv("PROFILE_MIGRATION_ENABLED", "0") == "1"
+PROFILE_MIGRATION_BATCH   = int(os.getenv("PROFILE_MIGRATION_BATCH", "500"))
+PROFILE_MIGRATION_PAUSE   = float(os.getenv("PROFILE_MIGRATION_PAUSE", "0.5"))   # секунд между пачками
+
+# Кэш контекста задачи (пользователь + ученик) на (user_id, student_id)
+TASK_CONTEXT_TTL        = float(os.getenv("TASK_CONTEXT_TTL", "30"))   # секунд
+TASK_CONTEXT_CACHE_SIZE = int(os.getenv("TASK_CONTEXT_CACHE_SIZE", "5000"))
+
+# Учёт запросов (usage_count): счётчики в Redis, перенос в Postgres пачками
+USAGE_METER_ENABLED            = os.getenv("USAGE_METER_ENABLED", "1") == "1"   # 0 — UPDATE на каждую задачу
+USAGE_FLUSH_INTERVAL           = float(os.getenv("USAGE_FLUSH_INTERVAL", "10"))     # секунд
+USAGE_BATCH_STALE_AFTER        = float(os.getenv("USAGE_BATCH_STALE_AFTER", "120")) # пачка «брошена» упавшим воркером
+USAGE_FLUSH_LOG_RETENTION_DAYS = int(os.getenv("USAGE_FLUSH_LOG_RETENTION_DAYS", "30"))
+
+# История чата в Redis (worker/redis_cache.py)
+CHAT_HISTORY_TTL        = int(os.getenv("CHAT_HISTORY_TTL", str(14 * 24 * 3600)))   # с последней реплики
+CHAT_COMPRESS_MIN_BYTES = int(os.getenv("CHAT_COMPRESS_MIN_BYTES", "1024"))        # 0 — не сжимать
+
+# Контекст чата с GPT (worker/services/context_builder.py): бюджет токенов промпта по моделям.
+# Что не помещается — сворачивается в краткое содержание, которое обновляется фоном.
+CHAT_MODEL            = os.getenv("CHAT_MODEL", "gpt-3.5-turbo")
+CHAT_CONTEXT_BUDGET   = int(os.getenv("CHAT_CONTEXT_BUDGET", "2500"))   # по умолчанию для неизвестных моделей
+CHAT_CONTEXT_BUDGETS  = {
+    "gpt-3.5-turbo": int(os.getenv("CHAT_CONTEXT_BUDGET_GPT35", "2500")),
+    "gpt-4":         int(os.getenv("CHAT_CONTEXT_BUDGET_GPT4", "4000")),
+}
+CHAT_SUMMARY_MODEL      = os.getenv("CHAT_SUMMARY_MODEL", "gpt-3.5-turbo")
+CHAT_SUMMARY_MAX_TOKENS = int(os.getenv("CHAT_SUMMARY_MAX_TOKENS", "300"))
+
+# Идемпотентность: результат задачи хранится по task_id, повторная доставка того же
+# сообщения (падение воркера, redelivery) получает сохранённый результат без пересчёта
+TASK_DONE_TTL = int(os.getenv("TASK_DONE_TTL", str(6 * 3600)))   # секунд; не больше BLOB_TTL — повтор ссылается на тот же PDF
+
+# Повторы упавших задач: отложенные очереди <очередь>.retry.<n> (TTL + dead-letter обратно),
+# после TASK_MAX_RETRIES попыток — <очередь>.dlq (просмотр и повтор: python -m worker.dlq)
+TASK_MAX_RETRIES     = int(os.getenv("TASK_MAX_RETRIES", "5"))
+TASK_RETRY_BASE      = float(os.getenv("TASK_RETRY_BASE", "5"))       # секунд до первой попытки
+TASK_RETRY_MAX_DELAY = float(os.getenv("TASK_RETRY_MAX_DELAY", "600"))
+
+# Автоматический выбор модели (worker/services/model_router.py): если модель отвечает с ошибками
+# или медленнее SLO, её circuit открывается и запросы идут на запасную модель
+# MODEL_FALLBACKS="gpt-4:gpt-3.5-turbo,..." — модель:запасная
+MODEL_FALLBACKS = dict(
+    pair.strip().split(":", 1)
+    for pair in os.getenv("MODEL_FALLBACKS", "gpt-4:gpt-3.5-turbo").split(",")
+    if ":" in pair
+)
+MODEL_LATENCY_SLOS = {
+    "gpt-4":         float(os.getenv("MODEL_LATENCY_SLO_GPT4", "60")),
+    "gpt-3.5-turbo": float(os.getenv("MODEL_LATENCY_SLO_GPT35", "30")),
+}
+MODEL_LATENCY_SLO      = float(os.getenv("MODEL_LATENCY_SLO", "45"))       # секунд, для остальных моделей
+CIRCUIT_WINDOW         = float(os.getenv("CIRCUIT_WINDOW", "120"))         # секунд истории исходов
+CIRCUIT_MIN_REQUESTS   = int(os.getenv("CIRCUIT_MIN_REQUESTS", "5"))
+CIRCUIT_ERROR_RATE     = float(os.getenv("CIRCUIT_ERROR_RATE", "0.5"))     # доля ошибок для открытия
+CIRCUIT_SLOW_RATE      = float(os.getenv("CIRCUIT_SLOW_RATE", "0.5"))      # доля ответов медленнее SLO
+CIRCUIT_OPEN_SECONDS   = float(os.getenv("CIRCUIT_OPEN_SECONDS", "60"))    # до пробного запроса
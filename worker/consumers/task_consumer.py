@@ -1,5 +1,5 @@
 # worker/consumers/task_consumer.py
-from worker.tasks import generate_plan, generate_tasks, check_homework, chat_gpt
+from worker.tasks import generate_plan, generate_tasks, generate_tasks_batch, check_homework, chat_gpt
 
 async def process_task_message(task: dict):
     task_type = task.get("type")
@@ -7,6 +7,8 @@ async def process_task_message(task: dict):
         return await generate_plan.handle_generate_plan(task)
     elif task_type == "generate_tasks":
         return await generate_tasks.handle_generate_tasks(task)
+    elif task_type == "generate_tasks_batch":
+        return await generate_tasks_batch.handle_generate_tasks_batch(task)
     elif task_type == "check_homework":
         return await check_homework.handle_check_homework(task)
     elif task_type == "chat_gpt":
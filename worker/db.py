@@ -1,6 +1,9 @@
 # /opt/RiverAI/worker/db.py
 
+from dataclasses import dataclass, replace
+
 import asyncpg
+from common.cache import TTLCache
 from worker import config
 from worker.utils import encryption  # или откуда у вас берётся encryption
 
@@ -25,18 +28,106 @@ def _get_pool():
     return _pool
 
 
-async def get_user(user_id: int):
+_STUDENT_COLUMNS = "id, user_id, profile_enc, name_enc, subject_enc, level_enc, notes_enc"
+
+def _decrypt_student(row) -> dict:
+    return {"id": row["id"], "user_id": row["user_id"], **encryption.decrypt_profile(row)}
+
+async def get_students(user_id: int, student_ids: list[int]):
+    """Fetch several students of one user in a single query (decrypted, in id order)."""
+    pool = _get_pool()
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(
+            f"SELECT {_STUDENT_COLUMNS} FROM students "
+            "WHERE user_id=$1 AND id = ANY($2::int[]) ORDER BY id",
+            user_id, student_ids,
+        )
+    return [_decrypt_student(row) for row in rows]
+
+@dataclass(frozen=True)
+class TaskContext:
+    """Everything a handler needs about the requester: plan, Yandex.Disk token and the student profile."""
+    user_id: int
+    plan: str = "basic"
+    ydisk_token: str = ""
+    student: dict | None = None
+
+    @property
+    def subject(self) -> str:
+        return self.student["subject"] if self.student else ""
+
+    @property
+    def level(self) -> str:
+        return self.student["level"] if self.student else ""
+
+    def with_student(self, student: dict | None) -> "TaskContext":
+        return replace(self, student=student)
+
+# (user_id, student_id) -> TaskContext; короткий TTL, чтобы смена тарифа и правки ученика подхватывались быстро
+_contexts = TTLCache(config.TASK_CONTEXT_CACHE_SIZE, config.TASK_CONTEXT_TTL)
+
+async def get_task_context(user_id: int, student_id: int | None = None) -> TaskContext:
+    """
+    Load the user and (optionally) their student in one joined query, decrypting
+    both once. The student is only returned if it belongs to the user.
+    """
+    key = (user_id, student_id)
+    ctx = _contexts.get(key)
+    if ctx is not None:
+        return ctx
     pool = _get_pool()
     async with pool.acquire() as conn:
-        return await conn.fetchrow("SELECT telegram_id, plan, ydisk_token_enc FROM users WHERE telegram_id=$1", user_id)
+        row = await conn.fetchrow(
+            "SELECT u.plan, u.ydisk_token_enc, "
+            "s.id, s.user_id, s.profile_enc, s.name_enc, s.subject_enc, s.level_enc, s.notes_enc "
+            "FROM users u LEFT JOIN students s ON s.id = $2 AND s.user_id = u.telegram_id "
+            "WHERE u.telegram_id = $1",
+            user_id, student_id,
+        )
+    if row is None:
+        ctx = TaskContext(user_id=user_id)
+    else:
+        ctx = TaskContext(
+            user_id=user_id,
+            plan=row["plan"] or "basic",
+            ydisk_token=encryption.decrypt_str(row["ydisk_token_enc"]) if row["ydisk_token_enc"] else "",
+            student=_decrypt_student(row) if row["id"] is not None else None,
+        )
+    _contexts.set(key, ctx)
+    return ctx
 
-async def get_student(student_id: int):
+async def increment_usage(user_id: int, amount: int = 1):
     pool = _get_pool()
     async with pool.acquire() as conn:
-        row = await conn.fetchrow("SELECT id, user_id, name_enc, subject_enc, level_enc, notes_enc FROM students WHERE id=$1", student_id)
-        return row
+        await conn.execute("UPDATE users SET usage_count = usage_count + $2 WHERE telegram_id=$1", user_id, amount)
 
-async def increment_usage(user_id: int):
+async def apply_usage_batch(batch_id: str, deltas: dict[int, int]) -> bool:
+    """
+    Add a batch of usage deltas (telegram_id -> count) in one UPDATE.
+    Returns False if this batch_id was already applied (usage_flush_log).
+    """
+    ids = sorted(deltas)
     pool = _get_pool()
     async with pool.acquire() as conn:
-        await conn.execute("UPDATE users SET usage_count = usage_count + 1 WHERE telegram_id=$1", user_id)
+        async with conn.transaction():
+            # Запись в журнале и UPDATE коммитятся вместе — пачка применяется ровно один раз
+            logged = await conn.fetchval(
+                "INSERT INTO usage_flush_log (batch_id) VALUES ($1) ON CONFLICT DO NOTHING RETURNING batch_id",
+                batch_id,
+            )
+            if logged is None:
+                return False
+            await conn.execute(
+                "UPDATE users SET usage_count = users.usage_count + v.delta "
+                "FROM (SELECT * FROM unnest($1::bigint[], $2::int[])) AS v(id, delta) "
+                "WHERE users.telegram_id = v.id",
+                ids, [deltas[i] for i in ids],
+            )
+    return True
+
+async def prune_usage_flush_log(days: int):
+    pool = _get_pool()
+    async with pool.acquire() as conn:
+        await conn.execute(
+            "DELETE FROM usage_flush_log WHERE flushed_at < now() - make_interval(days => $1)", days
+        )
@@ -0,0 +1,129 @@
+# /opt/RiverAI/worker/dlq.py
+#
+# Просмотр и повтор задач из очередей недоставленных (<очередь>.dlq):
+#     python -m worker.dlq list   [--queue task_queue] [--limit 20]
+#     python -m worker.dlq replay [--queue task_queue] [--limit N] [--task-id ID]
+#     python -m worker.dlq purge  [--queue task_queue]
+# replay возвращает задачу в исходную очередь со сброшенным счётчиком попыток.
+
+import argparse
+import asyncio
+import json
+import logging
+
+import aio_pika
+from aio_pika import DeliveryMode, Message
+
+from worker import config, retry
+
+
+async def _connect() -> aio_pika.abc.AbstractRobustConnection:
+    return await aio_pika.connect_robust(
+        host=config.RABBITMQ_HOST,
+        port=config.RABBITMQ_PORT,
+        login=config.RABBITMQ_USER,
+        password=config.RABBITMQ_PASS,
+    )
+
+
+async def _fetch(queue: aio_pika.abc.AbstractQueue, limit: int) -> list:
+    """Take up to limit messages without acking them (they stay reserved until ack/nack)."""
+    messages = []
+    while limit <= 0 or len(messages) < limit:
+        message = await queue.get(no_ack=False, fail=False)
+        if message is None:
+            break
+        messages.append(message)
+    return messages
+
+
+def _task(message) -> dict:
+    try:
+        task = json.loads(message.body)
+    except ValueError:
+        return {}
+    return task if isinstance(task, dict) else {}
+
+
+def _task_id(message) -> str | None:
+    return _task(message).get("task_id")
+
+
+def _describe(message) -> str:
+    task = _task(message)
+    headers = message.headers or {}
+    return (
+        f"{task.get('task_id') or message.message_id or '-':<34} {task.get('type', '?'):<22} "
+        f"user={task.get('user_id', '?'):<12} retries={headers.get(retry.RETRY_COUNT_HEADER, 0)} "
+        f"error={headers.get(retry.ERROR_HEADER, '')}"
+    )
+
+
+async def list_tasks(channel, queue_name: str, limit: int) -> None:
+    queue = await channel.declare_queue(retry.dead_letter_queue(queue_name), durable=True)
+    messages = await _fetch(queue, limit)
+    for message in messages:
+        print(_describe(message))
+    # Только просмотр — возвращаем всё обратно
+    for message in messages:
+        await message.nack(requeue=True)
+    print(f"{len(messages)} message(s) shown, {queue.declaration_result.message_count} in {queue.name}")
+
+
+async def replay(channel, queue_name: str, limit: int, task_id: str | None) -> None:
+    queue = await channel.declare_queue(retry.dead_letter_queue(queue_name), durable=True)
+    replayed = 0
+    skipped = []
+    for message in await _fetch(queue, 0 if task_id else limit):
+        headers = message.headers or {}
+        if task_id and task_id not in (_task_id(message), message.message_id):
+            skipped.append(message)
+            continue
+        target = headers.get(retry.ORIGIN_HEADER) or queue_name
+        await channel.default_exchange.publish(
+            Message(
+                body=message.body,
+                content_type=message.content_type,
+                message_id=message.message_id,
+                delivery_mode=DeliveryMode.PERSISTENT,
+                headers={k: v for k, v in headers.items() if k != retry.RETRY_COUNT_HEADER},
+            ),
+            routing_key=target,
+        )
+        await message.ack()
+        replayed += 1
+        print(f"↩️  {_describe(message)} -> {target}")
+    # Остальные возвращаем после выборки, иначе get() снова выдаст их же
+    for message in skipped:
+        await message.nack(requeue=True)
+    print(f"{replayed} message(s) replayed")
+
+
+async def purge(channel, queue_name: str) -> None:
+    queue = await channel.declare_queue(retry.dead_letter_queue(queue_name), durable=True)
+    await queue.purge()
+    print(f"{queue.name} purged")
+
+
+async def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    parser = argparse.ArgumentParser(prog="python -m worker.dlq", description="Dead-letter queue tool")
+    parser.add_argument("command", choices=("list", "replay", "purge"))
+    parser.add_argument("--queue", default=config.TASK_QUEUE, help="task queue whose DLQ to use")
+    parser.add_argument("--limit", type=int, default=20, help="max messages (list/replay)")
+    parser.add_argument("--task-id", help="replay only this task")
+    args = parser.parse_args()
+
+    connection = await _connect()
+    async with connection:
+        channel = await connection.channel()
+        if args.command == "list":
+            await list_tasks(channel, args.queue, args.limit)
+        elif args.command == "replay":
+            await replay(channel, args.queue, args.limit, args.task_id)
+        else:
+            await purge(channel, args.queue)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
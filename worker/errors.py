@@ -0,0 +1,50 @@
+# /opt/RiverAI/worker/errors.py
+#
+# Ошибки выполнения задач. TransientError — задача повторяется позже (worker/retry.py),
+# PermanentError — повтор не поможет, задача сразу уходит в очередь недоставленных (DLQ).
+
+import asyncio
+
+import asyncpg
+import redis.exceptions
+
+
+class TaskError(Exception):
+    """Base class for errors raised while processing a task."""
+
+    # Текст для пользователя, если задача так и не выполнилась
+    user_message = "Не удалось выполнить запрос, попробуйте позже."
+
+
+class TransientError(TaskError):
+    """Temporary failure (timeout, rate limit, provider outage): retry with backoff."""
+
+    def __init__(self, message: str, retry_after: float | None = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class PermanentError(TaskError):
+    """Retrying will not help (bad request, invalid credentials, malformed task)."""
+
+
+# Сбои соединения с БД/Redis/сетью — временные
+_TRANSIENT_TYPES = (
+    asyncio.TimeoutError,
+    OSError,
+    asyncpg.exceptions.InterfaceError,
+    asyncpg.exceptions.ConnectionDoesNotExistError,
+    asyncpg.exceptions.TooManyConnectionsError,
+    asyncpg.exceptions.CannotConnectNowError,
+    redis.exceptions.ConnectionError,
+    redis.exceptions.TimeoutError,
+)
+
+
+def classify(exc: BaseException) -> TaskError:
+    """Map any exception to a TaskError; unknown errors (bugs) are permanent."""
+    if isinstance(exc, TaskError):
+        return exc
+    if isinstance(exc, _TRANSIENT_TYPES):
+        return TransientError(f"{type(exc).__name__}: {exc}")
+    return PermanentError(f"{type(exc).__name__}: {exc}")
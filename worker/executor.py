@@ -0,0 +1,70 @@
+# /opt/RiverAI/worker/executor.py
+
+import asyncio
+import logging
+from contextlib import AsyncExitStack, asynccontextmanager
+
+
+class TaskExecutor:
+    """
+    Bounded concurrent executor for task messages.
+
+    Each message is processed in its own asyncio task. A global semaphore caps
+    the total number of tasks running at once, and per-type semaphores cap
+    every task type separately (types without a limit share only the global cap).
+    reserved_interactive global slots can only be taken by interactive tasks,
+    so batch work never occupies the whole executor.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        type_limits: dict[str, int] | None = None,
+        reserved_interactive: int = 0,
+    ):
+        self._global = asyncio.Semaphore(max_concurrency)
+        reserved = min(max(reserved_interactive, 0), max_concurrency - 1)
+        self._batch = asyncio.Semaphore(max_concurrency - reserved) if reserved else None
+        self._limits = {
+            task_type: asyncio.Semaphore(limit)
+            for task_type, limit in (type_limits or {}).items()
+            if limit > 0
+        }
+        self._running: set[asyncio.Task] = set()
+
+    @property
+    def in_flight(self) -> int:
+        """Number of spawned tasks that have not finished yet (running or waiting for a slot)."""
+        return len(self._running)
+
+    def spawn(self, coro) -> asyncio.Task:
+        """Run coroutine in background, keeping a strong reference until it completes."""
+        task = asyncio.create_task(coro)
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+        return task
+
+    @asynccontextmanager
+    async def slot(self, task_type: str | None, interactive: bool = False):
+        """
+        Hold an execution slot for the given task type.
+        The per-type slot (and for batch tasks the batch share) is taken first
+        so that a saturated type does not occupy global slots while it waits.
+        """
+        async with AsyncExitStack() as stack:
+            type_sem = self._limits.get(task_type)
+            if type_sem is not None:
+                await stack.enter_async_context(type_sem)
+            if not interactive and self._batch is not None:
+                await stack.enter_async_context(self._batch)
+            await stack.enter_async_context(self._global)
+            yield
+
+    async def drain(self, timeout: float | None = None) -> None:
+        """Wait for running tasks to finish (used on shutdown)."""
+        if not self._running:
+            return
+        logging.info(f"⏳ Waiting for {len(self._running)} in-flight task(s)")
+        _, pending = await asyncio.wait(set(self._running), timeout=timeout)
+        for task in pending:
+            task.cancel()
@@ -4,44 +4,94 @@ import logging
 import json
 
 import aio_pika
-from aio_pika import Message
 
-from worker import config, db, redis_cache
+from worker import config, db, errors, redis_cache, metrics, migrate_profiles, results, retry
 from worker.consumers import task_consumer
-
-# Глобальная переменная для обмена (default exchange) RabbitMQ
-publish_exchange: aio_pika.Exchange | None = None
-
-async def handle_message(message: aio_pika.IncomingMessage):
-    async with message.process():
+from worker.services import latex_service, usage_meter
+from worker.executor import TaskExecutor
+
+# Пул параллельного выполнения задач (лимиты по типам задач из config)
+executor = TaskExecutor(
+    config.WORKER_CONCURRENCY,
+    config.TASK_CONCURRENCY_LIMITS,
+    reserved_interactive=config.INTERACTIVE_RESERVED,
+)
+
+async def on_message(message: aio_pika.IncomingMessage):
+    # Не блокируем консьюмер: каждое сообщение обрабатывается в отдельной задаче
+    executor.spawn(handle_message(message))
+
+async def on_interactive_message(message: aio_pika.IncomingMessage):
+    executor.spawn(handle_message(message, interactive=True))
+
+async def _publish_failure(task_data: dict, error: errors.TaskError):
+    """Tell the user the task failed for good (also frees the scheduler slot by task_id)."""
+    if "user_id" not in task_data:
+        return
+    failure = {"type": "error", "user_id": task_data["user_id"], "message": error.user_message}
+    if task_data.get("task_id"):
+        failure["task_id"] = task_data["task_id"]
+    try:
+        await results.publish(failure)
+    except Exception:
+        logging.exception("🔴 Failed to publish task failure:")
+
+async def handle_message(message: aio_pika.IncomingMessage, interactive: bool = False):
+    queue_name = config.INTERACTIVE_TASK_QUEUE if interactive else config.TASK_QUEUE
+    # requeue=True: если не удалось даже отложить повтор (RabbitMQ недоступен), сообщение вернётся в очередь
+    async with message.process(requeue=True):
         try:
             task_data = json.loads(message.body)
         except json.JSONDecodeError as e:
             logging.error(f"🔴 Failed to decode task message: {e}")
+            await retry.dead_letter(message, queue_name, errors.PermanentError(f"bad JSON: {e}"))
             return
 
         t = task_data.get("type")
+        task_id = task_data.get("task_id")
         logging.info(f"▶ Received task of type: {t}")
 
-        try:
-            result = await task_consumer.process_task_message(task_data)
-        except Exception:
-            logging.exception("🔴 Error while processing task:")
-            return
-
-        if not result:
-            logging.warning("⚠️ No result returned by task_consumer")
-            return
-
-        if publish_exchange is None:
-            logging.error("🔴 Cannot publish result: publish_exchange is not initialized")
-            return
+        # Задача уже выполнялась (повторная доставка) — отдаём сохранённый результат
+        result = None
+        if task_id:
+            try:
+                result = await results.get_completed(task_id)
+            except Exception as e:
+                logging.warning(f"⚠️ Completed-task lookup failed, processing task {task_id}: {e}")
+            if result is not None:
+                logging.info(f"↩️ Task {task_id} was already completed, replaying its result")
+
+        if result is None:
+            try:
+                async with executor.slot(t, interactive=interactive):
+                    result = await task_consumer.process_task_message(task_data)
+            except Exception as e:
+                error = errors.classify(e)
+                if isinstance(error, errors.TransientError):
+                    # Повтор через отложенную очередь — воркер не ждёт и берёт следующие задачи
+                    if await retry.retry_or_dead_letter(message, queue_name, error):
+                        return
+                else:
+                    logging.exception(f"🔴 Task {task_id} failed permanently:")
+                    await retry.dead_letter(message, queue_name, error)
+                await _publish_failure(task_data, error)
+                return
+
+            if not result:
+                logging.warning("⚠️ No result returned by task_consumer")
+                return
+
+            if task_id:
+                # Возвращаем task_id, чтобы планировщик освободил слот пользователя
+                result.setdefault("task_id", task_id)
+                # Запоминаем до публикации: упадём после неё — повтор не пересчитает задачу
+                try:
+                    await results.save_completed(task_id, result)
+                except Exception as e:
+                    logging.warning(f"⚠️ Failed to store result of task {task_id}: {e}")
 
         try:
-            await publish_exchange.publish(
-                Message(body=json.dumps(result).encode("utf-8")),
-                routing_key=config.RESULT_QUEUE
-            )
+            await results.publish(result)
             logging.info("✅ Published result to result queue")
         except Exception:
             logging.exception("🔴 Failed to publish result:")
@@ -66,6 +116,26 @@ async def main():
     await redis_cache.init_redis()
     logging.info("✔️ Redis cache initialized")
 
+    # Шаблоны LaTeX и предкомпилированные форматы (.fmt) — один раз при старте
+    await latex_service.warm_up()
+
+    # Фоновый перенос учеников в формат одного зашифрованного конверта
+    if config.PROFILE_MIGRATION_ENABLED:
+        asyncio.create_task(migrate_profiles.run_in_background())
+
+    # Учёт запросов: досписываем пачки, брошенные упавшим воркером, и сбрасываем счётчики в БД
+    if config.USAGE_METER_ENABLED:
+        try:
+            await usage_meter.recover(min_age=config.USAGE_BATCH_STALE_AFTER)
+        except Exception:
+            # Не мешаем старту: flush_loop повторит восстановление на каждом тике
+            logging.exception("🔴 Usage batch recovery at startup failed:")
+        asyncio.create_task(usage_meter.flush_loop())
+
+    # Периодический вывод метрик (очередь рендера, латентность и т.д.)
+    if config.METRICS_LOG_INTERVAL > 0:
+        asyncio.create_task(metrics.report_loop(config.METRICS_LOG_INTERVAL))
+
     # 3) Подключение к RabbitMQ
     connection = await aio_pika.connect_robust(
         host=config.RABBITMQ_HOST,
@@ -76,18 +146,44 @@ async def main():
     channel = await connection.channel()
     logging.info("✔️ Connected to RabbitMQ")
 
-    # Сохраняем default exchange из канала
-    global publish_exchange
-    publish_exchange = channel.default_exchange
+    # Сохраняем default exchange из канала (через него публикуются результаты)
+    results.init(channel.default_exchange)
+    if config.SCHEDULER_ENABLED:
+        # Очередь результатов для планировщика: без неё default exchange молча отбросит сообщения
+        await channel.declare_queue(config.WORKER_RESULT_QUEUE, durable=True)
+    # Отложенные очереди повторов и DLQ для обеих очередей задач
+    await retry.setup(channel, [config.TASK_QUEUE, config.INTERACTIVE_TASK_QUEUE])
 
     # 4) Объявляем очередь задач и подписываемся на неё
     task_queue = await channel.declare_queue(config.TASK_QUEUE, durable=True)
-    await channel.set_qos(prefetch_count=1)
-    await task_queue.consume(handle_message)
-    logging.info(f"✅ Subscribed to queue '{config.TASK_QUEUE}', waiting for tasks…")
+    await channel.set_qos(prefetch_count=config.WORKER_PREFETCH)
+    await task_queue.consume(on_message)
+    logging.info(
+        f"✅ Subscribed to queue '{config.TASK_QUEUE}' "
+        f"(concurrency={config.WORKER_CONCURRENCY}, prefetch={config.WORKER_PREFETCH})"
+    )
+
+    # Интерактивная очередь — на своём канале со своим prefetch,
+    # чтобы накопленная генерация не занимала окно доставки чата
+    interactive_channel = await connection.channel()
+    interactive_queue = await interactive_channel.declare_queue(config.INTERACTIVE_TASK_QUEUE, durable=True)
+    await interactive_channel.set_qos(prefetch_count=config.INTERACTIVE_PREFETCH)
+    await interactive_queue.consume(on_interactive_message)
+    logging.info(
+        f"✅ Subscribed to queue '{config.INTERACTIVE_TASK_QUEUE}' "
+        f"(reserved={config.INTERACTIVE_RESERVED}, prefetch={config.INTERACTIVE_PREFETCH}), waiting for tasks…"
+    )
 
     # 5) Блокировка, чтобы процесс не завершился
-    await asyncio.Future()
+    try:
+        await asyncio.Future()
+    finally:
+        await executor.drain(timeout=30)
+        if config.USAGE_METER_ENABLED:
+            try:
+                await usage_meter.flush()
+            except Exception:
+                logging.exception("🔴 Final usage flush failed (counters stay in Redis):")
 
 if __name__ == "__main__":
     asyncio.run(main())
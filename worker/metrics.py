@@ -0,0 +1,50 @@
+# /opt/RiverAI/worker/metrics.py
+
+import asyncio
+import logging
+
+# Простейший реестр метрик процесса воркера: счётчики, gauge-значения и тайминги
+_counters: dict[str, float] = {}
+_gauges: dict[str, float] = {}
+_timings: dict[str, list[float]] = {}   # name -> [count, total, max]
+
+
+def inc(name: str, value: float = 1) -> None:
+    """Increase a counter."""
+    _counters[name] = _counters.get(name, 0) + value
+
+
+def set_gauge(name: str, value: float) -> None:
+    """Set the current value of a gauge."""
+    _gauges[name] = value
+
+
+def observe(name: str, seconds: float) -> None:
+    """Record a duration sample (count, sum and max are kept)."""
+    stat = _timings.setdefault(name, [0, 0.0, 0.0])
+    stat[0] += 1
+    stat[1] += seconds
+    stat[2] = max(stat[2], seconds)
+
+
+def ratio(hits: str, misses: str) -> float:
+    """Hit ratio of two counters (0.0 when nothing was counted yet)."""
+    h = _counters.get(hits, 0)
+    total = h + _counters.get(misses, 0)
+    return h / total if total else 0.0
+
+
+def snapshot() -> dict:
+    """Return a copy of all metrics; timings are reported as count/avg/max."""
+    timings = {
+        name: {"count": int(c), "avg": (total / c if c else 0.0), "max": mx}
+        for name, (c, total, mx) in _timings.items()
+    }
+    return {"counters": dict(_counters), "gauges": dict(_gauges), "timings": timings}
+
+
+async def report_loop(interval: float) -> None:
+    """Periodically write the metrics snapshot to the log."""
+    while True:
+        await asyncio.sleep(interval)
+        logging.info(f"📊 Metrics: {snapshot()}")
@@ -0,0 +1,78 @@
+# /opt/RiverAI/worker/migrate_profiles.py
+#
+# Перешифровывает учеников из старого формата (name_enc, subject_enc, level_enc,
+# notes_enc) в один конверт profile_enc. Запуск вручную:
+#     python -m worker.migrate_profiles
+# или фоном в воркере при PROFILE_MIGRATION_ENABLED=1.
+
+import asyncio
+import logging
+
+from worker import config, db
+from worker.utils import encryption
+
+
+async def migrate_batch(batch_size: int, after_id: int = 0) -> tuple[int, int | None]:
+    """
+    Re-encrypt one batch of legacy rows with id > after_id.
+    Returns (rows migrated, last id seen) — last id is None when nothing is left.
+    """
+    pool = db._get_pool()
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            # SKIP LOCKED: несколько воркеров могут мигрировать одновременно, не мешая друг другу
+            rows = await conn.fetch(
+                "SELECT id, user_id, profile_enc, name_enc, subject_enc, level_enc, notes_enc "
+                "FROM students WHERE profile_enc IS NULL AND id > $2 ORDER BY id LIMIT $1 FOR UPDATE SKIP LOCKED",
+                batch_size, after_id,
+            )
+            if not rows:
+                return 0, None
+            updates = []
+            for row in rows:
+                profile = encryption.decrypt_profile(row)
+                if any(row[f"{field}_enc"] and not profile[field] for field in profile):
+                    # Не расшифровалось (другой ключ, повреждение) — не затираем исходные данные
+                    logging.error(f"🔴 Student {row['id']}: legacy fields failed to decrypt, skipped")
+                    continue
+                updates.append((encryption.encrypt_profile(profile), row["id"]))
+            await conn.executemany(
+                "UPDATE students SET profile_enc=$1, name_enc=NULL, subject_enc=NULL, level_enc=NULL, notes_enc=NULL "
+                "WHERE id=$2 AND profile_enc IS NULL",
+                updates,
+            )
+    return len(updates), rows[-1]["id"]
+
+
+async def migrate_all(batch_size: int = config.PROFILE_MIGRATION_BATCH,
+                      pause: float = config.PROFILE_MIGRATION_PAUSE) -> int:
+    """Migrate until no legacy rows are left, pausing between batches to keep the load low."""
+    total = 0
+    last_id = 0
+    while True:
+        migrated, last_id = await migrate_batch(batch_size, last_id)
+        if last_id is None:
+            break
+        total += migrated
+        logging.info(f"🔐 Migrated {total} student profile(s) to the envelope format")
+        await asyncio.sleep(pause)
+    return total
+
+
+async def run_in_background() -> None:
+    """Background task for the worker: errors are logged, not raised."""
+    try:
+        total = await migrate_all()
+        logging.info(f"✔️ Student profile migration finished ({total} row(s))")
+    except Exception:
+        logging.exception("🔴 Student profile migration failed:")
+
+
+async def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    await db.init_db_pool()
+    await migrate_all()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,5 +1,9 @@
 # /opt/RiverAI/worker/redis_cache.py
 
+import json
+import logging
+import zlib
+
 import redis.asyncio as redis
 from worker import config
 
@@ -23,27 +27,208 @@ def _get_client() -> redis.Redis:
         raise RuntimeError("Redis client is not initialized")
     return _client
 
-async def get_conversation(user_id: int, student_id: int) -> str | None:
+# ---------- Chat history ----------
+# chat:{user}:{student}:sys — системное сообщение (строка)
+# chat:{user}:{student}:log — LIST остальных сообщений, новые в конец (RPUSH + LTRIM)
+# chat:{user}:{student}:summary — краткое содержание реплик, уже убранных из :log
+# Ключи живут CHAT_HISTORY_TTL секунд с последней реплики.
+# Старый формат — весь диалог одной JSON-строкой в chat:{user}:{student}, переносится при чтении.
+
+# Маркер сжатого элемента; несжатый элемент — JSON и начинается с "{"
+_ZLIB_MARK = b"Z"
+
+def _chat_key(user_id: int, student_id: int) -> str:
+    return f"chat:{user_id}:{student_id}"
+
+def _encode_message(message: dict) -> bytes:
+    data = json.dumps(message, ensure_ascii=False).encode("utf-8")
+    if config.CHAT_COMPRESS_MIN_BYTES and len(data) >= config.CHAT_COMPRESS_MIN_BYTES:
+        return _ZLIB_MARK + zlib.compress(data)
+    return data
+
+def _decode_message(raw: bytes) -> dict | None:
+    try:
+        if raw.startswith(_ZLIB_MARK):
+            raw = zlib.decompress(raw[len(_ZLIB_MARK):])
+        return json.loads(raw)
+    except (zlib.error, ValueError) as e:
+        logging.warning(f"chat history: dropping unreadable entry: {e}")
+        return None
+
+async def get_conversation(user_id: int, student_id: int) -> tuple[dict | None, str | None, list[dict]]:
     """
-    Retrieve chat history (JSON string) for given user & student from Redis.
+    Return (system message or None, summary of older turns or None, other messages oldest first)
+    for given user & student.
     """
     client = _get_client()
-    key = f"chat:{user_id}:{student_id}"
-    data = await client.get(key)
-    return data.decode('utf-8') if data else None
+    key = _chat_key(user_id, student_id)
+    async with client.pipeline(transaction=False) as pipe:
+        pipe.get(key + ":sys")
+        pipe.get(key + ":summary")
+        pipe.lrange(key + ":log", 0, -1)
+        sys_raw, summary_raw, log_raw = await pipe.execute()
+    if sys_raw is None and summary_raw is None and not log_raw:
+        system, messages = await _migrate_legacy_conversation(user_id, student_id)
+        return system, None, messages
+    system = _decode_message(sys_raw) if sys_raw else None
+    summary = summary_raw.decode("utf-8") if summary_raw else None
+    return system, summary, [m for m in map(_decode_message, log_raw) if m is not None]
+
+async def append_conversation(user_id: int, student_id: int, messages: list[dict],
+                              max_messages: int, system: dict | None = None) -> None:
+    """
+    Append messages to the history, keep only the last max_messages and refresh the TTL —
+    one MULTI/EXEC round trip. system (if given) replaces the stored system message.
+    """
+    client = _get_client()
+    key = _chat_key(user_id, student_id)
+    ttl = config.CHAT_HISTORY_TTL
+    async with client.pipeline(transaction=True) as pipe:
+        if system is not None:
+            pipe.set(key + ":sys", _encode_message(system), ex=ttl)
+        else:
+            pipe.expire(key + ":sys", ttl)
+        if messages:
+            pipe.rpush(key + ":log", *map(_encode_message, messages))
+        pipe.ltrim(key + ":log", -max_messages, -1)
+        pipe.expire(key + ":log", ttl)
+        pipe.expire(key + ":summary", ttl)
+        await pipe.execute()
 
-async def save_conversation(user_id: int, student_id: int, conv_json: str) -> None:
+# Заменяет краткое содержание и убирает из начала :log свёрнутые в него реплики —
+# только если начало списка не изменилось, пока строилось содержание
+_COMMIT_SUMMARY_SCRIPT = """
+if redis.call('LINDEX', KEYS[1], tonumber(ARGV[1]) - 1) ~= ARGV[2] then
+    return 0
+end
+redis.call('LTRIM', KEYS[1], tonumber(ARGV[1]), -1)
+redis.call('SET', KEYS[2], ARGV[3], 'EX', tonumber(ARGV[4]))
+return 1
+"""
+
+async def commit_summary(user_id: int, student_id: int, summary: str, consumed: list[dict]) -> bool:
     """
-    Save chat history (JSON string) for given user & student to Redis.
+    Store a new summary that covers the first len(consumed) messages of the history and drop
+    those messages. Returns False if the history changed meanwhile (nothing is written then).
     """
     client = _get_client()
-    key = f"chat:{user_id}:{student_id}"
-    await client.set(key, conv_json)
+    key = _chat_key(user_id, student_id)
+    return bool(await client.eval(
+        _COMMIT_SUMMARY_SCRIPT, 2, key + ":log", key + ":summary",
+        len(consumed), _encode_message(consumed[-1]), summary, config.CHAT_HISTORY_TTL,
+    ))
+
+async def _migrate_legacy_conversation(user_id: int, student_id: int) -> tuple[dict | None, list[dict]]:
+    client = _get_client()
+    key = _chat_key(user_id, student_id)
+    data = await client.get(key)
+    if data is None:
+        return None, []
+    try:
+        conversation = json.loads(data)
+    except json.JSONDecodeError:
+        conversation = []
+    system = conversation[0] if conversation and conversation[0].get("role") == "system" else None
+    messages = conversation[1:] if system else conversation
+    # Переносим без обрезки: в старом формате длина уже была ограничена
+    async with client.pipeline(transaction=True) as pipe:
+        if system is not None:
+            pipe.set(key + ":sys", _encode_message(system), ex=config.CHAT_HISTORY_TTL)
+        if messages:
+            pipe.rpush(key + ":log", *map(_encode_message, messages))
+            pipe.expire(key + ":log", config.CHAT_HISTORY_TTL)
+        pipe.delete(key)
+        await pipe.execute()
+    return system, messages
 
 async def clear_conversation(user_id: int, student_id: int) -> None:
     """
-    Delete chat history for given user & student from Redis.
+    Delete chat history for given user & student from Redis (both formats).
+    """
+    client = _get_client()
+    key = _chat_key(user_id, student_id)
+    await client.delete(key, key + ":sys", key + ":summary", key + ":log")
+
+async def expire_legacy_conversations(ttl: int = config.CHAT_HISTORY_TTL) -> int:
+    """
+    Give a TTL to old-format chat keys that never expire (dialogs nobody reopens
+    are never migrated). Returns the number of keys updated.
+    """
+    client = _get_client()
+    updated = 0
+    async for key in client.scan_iter(match="chat:*", count=500, _type="string"):
+        if key.endswith((b":sys", b":summary")):
+            continue
+        # NX: не трогаем ключи, у которых TTL уже есть
+        if await client.expire(key, ttl, nx=True):
+            updated += 1
+    return updated
+
+async def memory_report(prefixes: tuple[str, ...] = ("chat:", "user:", "blob:", "usage:", "gptcache:", "pdfcache:", "sf:")) -> dict:
+    """
+    Key count and MEMORY USAGE bytes per key prefix (everything else is under "other").
+    Walks the whole database with SCAN — meant for occasional manual runs.
+    """
+    client = _get_client()
+    report = {p: {"keys": 0, "bytes": 0} for p in (*prefixes, "other")}
+    batch = []
+
+    async def _measure():
+        async with client.pipeline(transaction=False) as pipe:
+            for key in batch:
+                pipe.memory_usage(key)
+            sizes = await pipe.execute()
+        for key, size in zip(batch, sizes):
+            name = key.decode("utf-8", "replace")
+            prefix = next((p for p in prefixes if name.startswith(p)), "other")
+            report[prefix]["keys"] += 1
+            report[prefix]["bytes"] += size or 0
+        batch.clear()
+
+    async for key in client.scan_iter(count=1000):
+        batch.append(key)
+        if len(batch) >= 1000:
+            await _measure()
+    if batch:
+        await _measure()
+    return report
+
+async def get_bytes(key: str) -> bytes | None:
+    """
+    Retrieve a raw binary value from Redis.
+    """
+    client = _get_client()
+    return await client.get(key)
+
+async def set_bytes(key: str, data: bytes, ttl: int | None = None) -> None:
+    """
+    Store a raw binary value in Redis (with optional TTL in seconds).
     """
     client = _get_client()
-    key = f"chat:{user_id}:{student_id}"
-    await client.delete(key)
+    await client.set(key, data, ex=ttl)
+
+# Снимает блокировку, только если она всё ещё принадлежит нам (сравнение токена)
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+async def acquire_lock(key: str, token: str, ttl: int) -> bool:
+    """
+    Try to take a short-lived lock (SET NX EX). Returns True if acquired.
+    """
+    client = _get_client()
+    return bool(await client.set(key, token, nx=True, ex=ttl))
+
+async def release_lock(key: str, token: str) -> None:
+    """
+    Release a lock taken with acquire_lock (no-op if it expired or belongs to someone else).
+    """
+    client = _get_client()
+    await client.eval(_RELEASE_LOCK_SCRIPT, 1, key, token)
+
+async def exists(key: str) -> bool:
+    client = _get_client()
+    return bool(await client.exists(key))
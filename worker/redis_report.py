@@ -0,0 +1,26 @@
+# /opt/RiverAI/worker/redis_report.py
+#
+# Сколько памяти Redis занимают ключи по префиксам. Запуск вручную:
+#     python -m worker.redis_report [--expire-legacy]
+# --expire-legacy — выставить TTL старым историям чата (формат одной JSON-строки).
+
+import asyncio
+import logging
+import sys
+
+from worker import redis_cache
+
+
+async def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    await redis_cache.init_redis()
+    if "--expire-legacy" in sys.argv[1:]:
+        updated = await redis_cache.expire_legacy_conversations()
+        logging.info(f"⏳ TTL set on {updated} legacy chat key(s)")
+    report = await redis_cache.memory_report()
+    for prefix, stat in sorted(report.items(), key=lambda item: -item[1]["bytes"]):
+        print(f"{prefix:<12} {stat['keys']:>10} keys {stat['bytes'] / 1024 / 1024:>10.2f} MiB")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
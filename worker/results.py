@@ -0,0 +1,107 @@
+# /opt/RiverAI/worker/results.py
+
+import json
+import logging
+import time
+import uuid
+
+import aio_pika
+from aio_pika import Message
+
+from worker import config, redis_cache
+
+# Default exchange канала воркера; задаётся в main() после подключения к RabbitMQ
+_exchange: aio_pika.Exchange | None = None
+
+
+def init(exchange: aio_pika.Exchange) -> None:
+    global _exchange
+    _exchange = exchange
+
+
+async def publish(result: dict) -> None:
+    """Publish a result (final or partial) to the result queue (final ones via the scheduler if enabled)."""
+    if _exchange is None:
+        raise RuntimeError("Result exchange is not initialized")
+    via_scheduler = config.SCHEDULER_ENABLED and result.get("type") != "partial"
+    await _exchange.publish(
+        Message(body=json.dumps(result).encode("utf-8")),
+        routing_key=config.WORKER_RESULT_QUEUE if via_scheduler else config.RESULT_QUEUE,
+    )
+
+
+# task:done:{task_id} — сохранённый результат выполненной задачи (JSON)
+DONE_PREFIX = "task:done:"
+
+
+async def get_completed(task_id: str) -> dict | None:
+    """Stored result of an already completed task, or None."""
+    data = await redis_cache.get_bytes(DONE_PREFIX + task_id)
+    return json.loads(data) if data else None
+
+
+async def save_completed(task_id: str, result: dict) -> None:
+    """
+    Remember the result of a completed task for TASK_DONE_TTL seconds. If another copy of
+    the same task finished first, its result is kept (NX).
+    """
+    await redis_cache._get_client().set(
+        DONE_PREFIX + task_id, json.dumps(result).encode("utf-8"), nx=True, ex=config.TASK_DONE_TTL
+    )
+
+
+def stream_enabled(task_type: str) -> bool:
+    """Whether GPT output for this task type is streamed to the bot (GPT_STREAM_TASK_TYPES)."""
+    return task_type in config.GPT_STREAM_TASK_TYPES
+
+
+class PartialPublisher:
+    """
+    Throttled publisher of partial GPT output.
+
+    Called with the text accumulated so far; publishes at most one
+    {"type": "partial", ...} event per STREAM_PUBLISH_INTERVAL seconds,
+    numbered with an increasing "seq" so the bot can drop stale updates.
+    seq is based on wall-clock milliseconds, so it keeps growing when the
+    task is retried (a new publisher for the same stream_id).
+    The final result must carry the same stream_id.
+    """
+
+    def __init__(self, task: dict, kind: str):
+        self.stream_id = task.get("task_id") or uuid.uuid4().hex
+        self._base = {
+            "type": "partial",
+            "kind": kind,
+            "user_id": task["user_id"],
+            "student_id": task.get("student_id"),
+            "stream_id": self.stream_id,
+        }
+        self._seq = 0
+        self._last_sent = 0.0
+        self.published = False
+
+    def _next_seq(self) -> int:
+        self._seq = max(self._seq + 1, int(time.time() * 1000))
+        return self._seq
+
+    async def _publish(self, event: dict) -> None:
+        try:
+            await publish({**self._base, "seq": self._next_seq(), **event})
+            self.published = True
+        except Exception:
+            # Промежуточные события не критичны — финальный результат всё равно будет отправлен
+            logging.exception("🔴 Failed to publish partial result:")
+
+    async def __call__(self, text: str) -> None:
+        now = time.monotonic()
+        if now - self._last_sent < config.STREAM_PUBLISH_INTERVAL:
+            return
+        self._last_sent = now
+        await self._publish({"text": text})
+
+    async def reset(self) -> None:
+        """Tell the bot the stream starts over (the text shown so far is dropped)."""
+        if not self.published:
+            return
+        self._last_sent = time.monotonic()
+        await self._publish({"text": "", "reset": True})
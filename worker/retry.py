@@ -0,0 +1,109 @@
+# /opt/RiverAI/worker/retry.py
+#
+# Отложенные повторы задач без блокировки воркера. Для каждой очереди задач объявляются:
+#   <очередь>.retry.<n> — n-я попытка; сообщение лежит там до истечения TTL и через
+#                         dead-letter возвращается в исходную очередь
+#   <очередь>.dlq       — задачи, исчерпавшие попытки или с постоянной ошибкой
+# Задержка растёт экспоненциально (TASK_RETRY_BASE * 2^(n-1), не больше TASK_RETRY_MAX_DELAY)
+# со случайным разбросом, чтобы после сбоя провайдера повторы не приходили одной волной.
+
+import logging
+import random
+import time
+
+import aio_pika
+from aio_pika import DeliveryMode, Message
+
+from worker import config, metrics
+
+RETRY_COUNT_HEADER = "x-retry-count"
+ERROR_HEADER = "x-last-error"
+ORIGIN_HEADER = "x-origin-queue"
+
+_exchange: aio_pika.Exchange | None = None
+
+
+def retry_queue(queue_name: str, attempt: int) -> str:
+    return f"{queue_name}.retry.{attempt}"
+
+
+def dead_letter_queue(queue_name: str) -> str:
+    return f"{queue_name}.dlq"
+
+
+def tier_delay(attempt: int) -> float:
+    """Upper bound of the delay before the given attempt (1-based), seconds."""
+    return min(config.TASK_RETRY_MAX_DELAY, config.TASK_RETRY_BASE * 2 ** (attempt - 1))
+
+
+def backoff(attempt: int, retry_after: float | None = None) -> float:
+    """
+    Delay before the given attempt: "equal jitter" — half of the tier delay plus a random
+    part, never below the provider's Retry-After (capped by the tier delay).
+    """
+    cap = tier_delay(attempt)
+    delay = cap / 2 + random.uniform(0, cap / 2)
+    if retry_after:
+        delay = max(delay, min(retry_after, cap))
+    return delay
+
+
+async def setup(channel: aio_pika.abc.AbstractChannel, queue_names: list[str]) -> None:
+    """Declare retry tiers and the DLQ for every task queue; retries go out via the default exchange."""
+    global _exchange
+    _exchange = channel.default_exchange
+    for name in queue_names:
+        for attempt in range(1, config.TASK_MAX_RETRIES + 1):
+            await channel.declare_queue(
+                retry_queue(name, attempt),
+                durable=True,
+                arguments={
+                    # TTL очереди — верхняя граница; у сообщения свой expiration с разбросом
+                    "x-message-ttl": int(tier_delay(attempt) * 1000),
+                    "x-dead-letter-exchange": "",
+                    "x-dead-letter-routing-key": name,
+                },
+            )
+        await channel.declare_queue(dead_letter_queue(name), durable=True)
+
+
+def _copy(message: aio_pika.abc.AbstractIncomingMessage, headers: dict, expiration: float | None = None) -> Message:
+    return Message(
+        body=message.body,
+        content_type=message.content_type,
+        message_id=message.message_id,
+        delivery_mode=DeliveryMode.PERSISTENT,
+        headers={**(message.headers or {}), **headers},
+        expiration=expiration,
+    )
+
+
+async def retry_or_dead_letter(message: aio_pika.abc.AbstractIncomingMessage, queue_name: str,
+                               error: Exception) -> bool:
+    """
+    Schedule the next attempt of a failed task; after TASK_MAX_RETRIES attempts move it
+    to the DLQ. Returns True if the task will be retried.
+    The caller acks the original message after this returns.
+    """
+    attempt = int((message.headers or {}).get(RETRY_COUNT_HEADER, 0)) + 1
+    if attempt > config.TASK_MAX_RETRIES:
+        await dead_letter(message, queue_name, error)
+        return False
+    delay = backoff(attempt, getattr(error, "retry_after", None))
+    await _exchange.publish(
+        _copy(message, {RETRY_COUNT_HEADER: attempt, ERROR_HEADER: str(error)[:500]}, expiration=delay),
+        routing_key=retry_queue(queue_name, attempt),
+    )
+    metrics.inc("tasks.retried")
+    logging.warning(f"🔁 Task {message.message_id} failed ({error}); attempt {attempt} in {delay:.1f}s")
+    return True
+
+
+async def dead_letter(message: aio_pika.abc.AbstractIncomingMessage, queue_name: str, error: Exception) -> None:
+    """Move a task to the DLQ of its queue (kept for inspection and replay)."""
+    await _exchange.publish(
+        _copy(message, {ERROR_HEADER: str(error)[:500], ORIGIN_HEADER: queue_name, "x-failed-at": int(time.time())}),
+        routing_key=dead_letter_queue(queue_name),
+    )
+    metrics.inc("tasks.dead_lettered")
+    logging.error(f"☠️ Task {message.message_id} moved to {dead_letter_queue(queue_name)}: {error}")
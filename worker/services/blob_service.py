@@ -0,0 +1,37 @@
+# /opt/RiverAI/worker/services/blob_service.py
+
+import base64
+import logging
+
+from common.blob_store import BlobStore, LocalBlobStore, RedisBlobStore
+from worker import config, metrics, redis_cache
+
+_store: BlobStore | None = None
+
+
+def _get_store() -> BlobStore | None:
+    global _store
+    if _store is None:
+        if config.BLOB_BACKEND == "redis":
+            _store = RedisBlobStore(redis_cache._get_client(), ttl=config.BLOB_TTL)
+        elif config.BLOB_BACKEND == "local":
+            _store = LocalBlobStore(config.BLOB_DIR, ttl=config.BLOB_TTL)
+    return _store
+
+
+async def attach_pdf(result: dict, pdf_bytes: bytes) -> None:
+    """
+    Attach a PDF to the result: as a blob reference (result["blob"]) when a
+    blob store is configured, otherwise (or if the store fails) inline as
+    base64 in result["file"].
+    """
+    store = _get_store()
+    if store is not None:
+        try:
+            result["blob"] = await store.put(pdf_bytes)
+            metrics.inc("blob.put")
+            metrics.inc("blob.bytes", len(pdf_bytes))
+            return
+        except Exception as e:
+            logging.warning(f"⚠️ Blob store unavailable, sending PDF inline: {e}")
+    result["file"] = base64.b64encode(pdf_bytes).decode("utf-8")
@@ -0,0 +1,142 @@
+# /opt/RiverAI/worker/services/context_builder.py
+#
+# Собирает промпт чата в пределах бюджета токенов модели: системное сообщение,
+# краткое содержание старых реплик и столько последних реплик, сколько помещается.
+# Реплики, не попавшие в промпт, сворачиваются в краткое содержание фоном (summarize_later).
+
+import asyncio
+import logging
+import uuid
+
+from worker import config, metrics, redis_cache
+from worker.errors import TaskError
+from worker.services import gpt_service
+
+try:
+    import tiktoken
+except ImportError:  # без tiktoken — приблизительная оценка по длине текста
+    tiktoken = None
+
+# Служебные токены на каждое сообщение и на начало ответа (формат ChatML)
+_TOKENS_PER_MESSAGE = 4
+_TOKENS_REPLY_PRIMING = 3
+
+_encodings: dict[str, object] = {}
+
+# Фоновые задачи свёртки (ссылки, чтобы их не собрал GC)
+_pending: set[asyncio.Task] = set()
+
+
+def _encoding(model: str):
+    enc = _encodings.get(model)
+    if enc is None:
+        try:
+            enc = tiktoken.encoding_for_model(model)
+        except KeyError:
+            enc = tiktoken.get_encoding("cl100k_base")
+        _encodings[model] = enc
+    return enc
+
+
+def count_tokens(text: str, model: str) -> int:
+    if tiktoken is None:
+        # ~3 символа на токен для смешанного RU/EN текста, как в gpt_service.estimate_tokens
+        return len(text) // 3 + 1
+    return len(_encoding(model).encode(text))
+
+
+def message_tokens(message: dict, model: str) -> int:
+    return _TOKENS_PER_MESSAGE + count_tokens(message.get("content") or "", model)
+
+
+def budget_for(model: str) -> int:
+    return config.CHAT_CONTEXT_BUDGETS.get(model, config.CHAT_CONTEXT_BUDGET)
+
+
+def _summary_message(summary: str) -> dict:
+    return {"role": "system", "content": f"Краткое содержание предыдущей части диалога:\n{summary}"}
+
+
+def build(system: dict | None, summary: str | None, history: list[dict],
+          user_entry: dict, model: str) -> tuple[list[dict], int]:
+    """
+    Pack the prompt: system message, summary, then the newest history turns that fit into the
+    model budget, then the new user message (always included).
+    Returns (messages, number of oldest history messages left out).
+    """
+    head = []
+    if system:
+        head.append(system)
+    if summary:
+        head.append(_summary_message(summary))
+    used = _TOKENS_REPLY_PRIMING + sum(message_tokens(m, model) for m in head) + message_tokens(user_entry, model)
+    budget = budget_for(model)
+
+    kept = 0
+    for message in reversed(history):
+        cost = message_tokens(message, model)
+        if used + cost > budget:
+            break
+        used += cost
+        kept += 1
+    # Не начинаем окно с ответа ассистента без вопроса к нему
+    if kept and kept < len(history) and history[-kept]["role"] == "assistant":
+        used -= message_tokens(history[-kept], model)
+        kept -= 1
+
+    metrics.inc("chat.turns")
+    metrics.inc("chat.prompt_tokens", used)
+    metrics.set_gauge("chat.prompt_tokens_last", used)
+    window = history[len(history) - kept:]
+    return head + window + [user_entry], len(history) - kept
+
+
+async def _summarize(user_id: int, student_id: int, summary: str | None, consumed: list[dict]) -> None:
+    lock_key = f"chat:{user_id}:{student_id}:summarizing"
+    token = uuid.uuid4().hex
+    locked = False
+    try:
+        # Одна свёртка на диалог одновременно; пропущенные реплики свернёт следующий ход
+        locked = await redis_cache.acquire_lock(lock_key, token, ttl=120)
+        if not locked:
+            return
+        transcript = "\n".join(f"{m['role']}: {m.get('content') or ''}" for m in consumed)
+        prompt = (
+            "Обнови краткое содержание диалога репетитора с ассистентом. Сохрани факты об ученике, "
+            "темы, договорённости и нерешённые вопросы; без вступлений, не длиннее "
+            f"{config.CHAT_SUMMARY_MAX_TOKENS} токенов.\n\n"
+            f"Текущее краткое содержание:\n{summary or '(нет)'}\n\nНовые реплики:\n{transcript}"
+        )
+        answer = await gpt_service.ask_gpt(
+            [{"role": "user", "content": prompt}], model=config.CHAT_SUMMARY_MODEL, temperature=0.2
+        )
+        if not answer:
+            return
+        if await redis_cache.commit_summary(user_id, student_id, answer.strip(), consumed):
+            metrics.inc("chat.summaries")
+            logging.info(f"📝 Chat {user_id}:{student_id}: folded {len(consumed)} message(s) into the summary")
+    except TaskError as e:
+        # Не страшно: свернём на следующем ходе
+        logging.warning(f"chat summary for {user_id}:{student_id} failed: {e}")
+    except Exception:
+        logging.exception("🔴 Chat summary failed:")
+    finally:
+        if locked:
+            try:
+                await redis_cache.release_lock(lock_key, token)
+            except Exception as e:
+                logging.warning(f"chat summary lock release failed (expires by TTL): {e}")
+
+
+def overflow(history: list[dict], added: int, max_messages: int) -> int:
+    """How many oldest messages exceed max_messages once `added` more are appended."""
+    return max(0, len(history) + added - max_messages)
+
+
+def summarize_later(user_id: int, student_id: int, summary: str | None, consumed: list[dict]) -> None:
+    """Fold the given oldest history messages into the summary in the background."""
+    if not consumed:
+        return
+    task = asyncio.create_task(_summarize(user_id, student_id, summary, consumed))
+    _pending.add(task)
+    task.add_done_callback(_pending.discard)
@@ -0,0 +1,58 @@
+# /opt/RiverAI/worker/services/gpt_cache.py
+
+import hashlib
+import json
+import logging
+
+from worker import config, metrics, redis_cache
+
+REDIS_KEY_PREFIX = "gptcache:"
+
+
+def enabled_for(task_type: str) -> bool:
+    """Whether responses for this task type may be cached (GPT_CACHE_TASK_TYPES)."""
+    return task_type in config.GPT_CACHE_TASK_TYPES
+
+
+def normalize_messages(messages: list[dict]) -> list[dict]:
+    """Drop everything except role/content and collapse whitespace in the content."""
+    return [
+        {"role": m.get("role", "user"), "content": " ".join(str(m.get("content") or "").split())}
+        for m in messages
+    ]
+
+
+def request_fingerprint(messages: list[dict], model: str, **params) -> str:
+    """Stable sha256 of normalized messages, model and extra request parameters."""
+    payload = json.dumps(
+        {"messages": normalize_messages(messages), "model": model, **params},
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def make_key(messages: list[dict], model: str, temperature: float) -> str:
+    return REDIS_KEY_PREFIX + request_fingerprint(messages, model, temperature=temperature)
+
+
+async def get(key: str) -> str | None:
+    """Return a cached answer or None (Redis errors count as a miss)."""
+    try:
+        data = await redis_cache.get_bytes(key)
+    except Exception as e:
+        logging.warning(f"⚠️ GPT cache lookup failed: {e}")
+        data = None
+    if data is None:
+        metrics.inc("gpt_cache.misses")
+    else:
+        metrics.inc("gpt_cache.hits")
+    metrics.set_gauge("gpt_cache.hit_ratio", metrics.ratio("gpt_cache.hits", "gpt_cache.misses"))
+    return data.decode("utf-8") if data is not None else None
+
+
+async def put(key: str, answer: str) -> None:
+    try:
+        await redis_cache.set_bytes(key, answer.encode("utf-8"), ttl=config.GPT_CACHE_TTL)
+    except Exception as e:
+        logging.warning(f"⚠️ GPT cache store failed: {e}")
@@ -1,43 +1,231 @@
 # /opt/RiverAI/worker/services/gpt_service.py
 
+import time
+
 import openai
-import string
+from typing import Awaitable, Callable
 from worker import config
+from worker.errors import PermanentError, TaskError, TransientError
+from worker.services import gpt_cache, singleflight
+from worker.services.key_pool import ApiKey, KeyPool
+from worker.services.model_router import ModelRouter
+
+# Запас токенов на ответ модели при предварительной оценке запроса
+COMPLETION_TOKENS_ESTIMATE = 500
+
+# Пул ключей OpenAI с отдельными лимитами на каждый ключ
+key_pool = KeyPool(
+    config.OPENAI_API_KEYS,
+    rpm=config.OPENAI_KEY_RPM,
+    tpm=config.OPENAI_KEY_TPM,
+    cooldown=config.OPENAI_KEY_COOLDOWN,
+)
+
+# Выбор модели по состоянию circuit breaker'ов: обработчики вызывают router.resolve(model)
+# и передают полученный билет в ask_gpt(ticket=...)
+router = ModelRouter(
+    config.MODEL_FALLBACKS,
+    config.MODEL_LATENCY_SLOS,
+    default_slo=config.MODEL_LATENCY_SLO,
+    window=config.CIRCUIT_WINDOW,
+    min_requests=config.CIRCUIT_MIN_REQUESTS,
+    error_rate=config.CIRCUIT_ERROR_RATE,
+    slow_rate=config.CIRCUIT_SLOW_RATE,
+    open_seconds=config.CIRCUIT_OPEN_SECONDS,
+)
+
+def tag_model(result: dict, model: str, fallback_from: str | None) -> None:
+    """Record in a task result which model answered (and which one it replaced)."""
+    result["model"] = model
+    if fallback_from:
+        result["fallback_from"] = fallback_from
+
+def estimate_tokens(messages: list[dict]) -> int:
+    """
+    Грубая оценка числа токенов запроса (около 3 символов на токен для смешанного RU/EN текста)
+    плюс запас на ответ.
+    """
+    chars = sum(len(m.get("content") or "") for m in messages)
+    return chars // 3 + 4 * len(messages) + COMPLETION_TOKENS_ESTIMATE
+
+# Перегрузка и сбои провайдера — временные; неверный запрос или ключ — постоянные
+_TRANSIENT_OPENAI_ERRORS = (
+    openai.error.RateLimitError,
+    openai.error.Timeout,
+    openai.error.APIConnectionError,
+    openai.error.ServiceUnavailableError,
+    openai.error.TryAgain,
+)
 
-# Индекс для круговой смены ключей
-_key_index = 0
+# Сбои, при которых запрос повторяется на другом ключе, а текущий ключ ненадолго выводится из ротации
+_TRANSIENT_KEY_ERRORS = (
+    openai.error.Timeout,
+    openai.error.APIConnectionError,
+    openai.error.ServiceUnavailableError,
+    openai.error.TryAgain,
+    openai.error.APIError,
+)
 
-def get_next_api_key() -> str | None:
+def _classify_openai_error(e: openai.error.OpenAIError) -> TaskError:
+    if isinstance(e, _TRANSIENT_OPENAI_ERRORS) or (
+        isinstance(e, openai.error.APIError) and (e.http_status or 500) >= 500
+    ):
+        retry_after = None
+        if getattr(e, "headers", None):
+            try:
+                retry_after = float(e.headers.get("retry-after"))
+            except (TypeError, ValueError):
+                pass
+        return TransientError(f"OpenAI: {e}", retry_after=retry_after)
+    err = PermanentError(f"OpenAI: {e}")
+    if isinstance(e, openai.error.InvalidRequestError):
+        err.user_message = "Запрос не принят моделью (слишком длинный или некорректный текст)."
+    return err
+
+async def _ask_gpt_stream(
+    messages: list[dict],
+    model: str,
+    temperature: float,
+    on_partial: Callable[[str], Awaitable[None]],
+    api_key: str | None,
+) -> str:
+    """
+    Запрашивает ответ потоком (stream=True) и вызывает on_partial с накопленным текстом.
+    Возвращает полный ответ.
+    """
+    response = await openai.ChatCompletion.acreate(
+        model=model,
+        messages=messages,
+        temperature=temperature,
+        stream=True,
+        api_key=api_key,
+        request_timeout=config.OPENAI_REQUEST_TIMEOUT,
+    )
+    text = ""
+    async for chunk in response:
+        delta = chunk["choices"][0].get("delta", {}).get("content")
+        if delta:
+            text += delta
+            await on_partial(text)
+    return text
+
+async def _call_openai(
+    messages: list[dict],
+    model: str,
+    temperature: float,
+    on_partial: Callable[[str], Awaitable[None]] | None,
+    ticket: int | None = None,
+) -> str:
+    """
+    Запрос к модели с учётом исхода в её circuit breaker: успех с латентностью или сбой —
+    любой, включая таймауты asyncio, ошибки сети и отмену. Ошибки самого запроса
+    (неверный запрос, ключ) не учитываются, но освобождают пробу half-open.
+    ticket — билет из router.resolve(): исход вызова, допущенного в прошлом состоянии, не учитывается.
+    """
+    started = time.monotonic()
+    try:
+        answer = await _call_with_keys(messages, model, temperature, on_partial)
+    except openai.error.OpenAIError as e:
+        if isinstance(_classify_openai_error(e), TransientError):
+            router.record(model, False, time.monotonic() - started, ticket)
+        else:
+            router.release(model, ticket)
+        raise
+    except BaseException:
+        router.record(model, False, time.monotonic() - started, ticket)
+        raise
+    router.record(model, True, time.monotonic() - started, ticket)
+    return answer
+
+async def _call_with_keys(
+    messages: list[dict],
+    model: str,
+    temperature: float,
+    on_partial: Callable[[str], Awaitable[None]] | None,
+) -> str:
     """
-    Возвращает следующий API-ключ из списка и устанавливает его в openai.api_key.
+    Выполняет запрос через пул ключей. При 429, таймауте, обрыве соединения или 5xx ключ
+    выводится из ротации, и запрос повторяется на другом ключе (не больше одного раза на ключ).
     """
-    global _key_index
-    keys = config.OPENAI_API_KEYS
-    if not keys:
-        return None
-    key = keys[_key_index]
-    _key_index = (_key_index + 1) % len(keys)
-    openai.api_key = key
-    return key
+    estimated = estimate_tokens(messages)
+    attempts = max(1, len(key_pool))
+    for attempt in range(attempts):
+        key: ApiKey | None = await key_pool.acquire(estimated)
+        api_key = key.key if key else None
+        used_tokens = None
+        try:
+            if on_partial is not None:
+                if attempt and hasattr(on_partial, "reset"):
+                    # Поток на прошлом ключе оборвался, а бот уже показал его начало — начинаем заново
+                    await on_partial.reset()
+                answer = await _ask_gpt_stream(messages, model, temperature, on_partial, api_key)
+            else:
+                response = await openai.ChatCompletion.acreate(
+                    model=model,
+                    messages=messages,
+                    temperature=temperature,
+                    api_key=api_key,
+                    request_timeout=config.OPENAI_REQUEST_TIMEOUT,
+                )
+                answer = response.choices[0].message.content
+                usage = response.get("usage")
+                used_tokens = usage["total_tokens"] if usage else None
+            key_pool.report_success(key)
+            return answer
+        except openai.error.RateLimitError as e:
+            key_pool.report_rate_limited(key, getattr(e, "headers", None))
+            if attempt + 1 >= attempts:
+                raise
+        except (openai.error.AuthenticationError, openai.error.PermissionError):
+            key_pool.report_failure(key, permanent=True)
+            if attempt + 1 >= attempts:
+                raise
+        except _TRANSIENT_KEY_ERRORS as e:
+            # 4xx от API — ошибка запроса, а не ключа: другой ключ не поможет
+            if isinstance(e, openai.error.APIError) and (e.http_status or 500) < 500:
+                raise
+            key_pool.report_failure(key)
+            if attempt + 1 >= attempts:
+                raise
+        finally:
+            key_pool.release(key, estimated, used_tokens)
 
 async def ask_gpt(
     messages: list[dict],
-    model: str = "gpt-3.5-turbo"
+    model: str = "gpt-3.5-turbo",
+    temperature: float = 0.7,
+    use_cache: bool = False,
+    on_partial: Callable[[str], Awaitable[None]] | None = None,
+    ticket: int | None = None,
 ) -> str:
     """
     Отправляет список сообщений в OpenAI ChatCompletion и возвращает ответ.
     messages: [{"role":"user"|"system"|"assistant","content": "..."}]
+    use_cache: брать/сохранять ответ в кэше Redis (ключ — нормализованные сообщения, модель, температура)
+    on_partial: если задан, ответ запрашивается потоком и callback получает накопленный текст
+    ticket: билет circuit breaker'а модели из router.resolve()
+    Ошибки OpenAI пробрасываются как TransientError / PermanentError (worker/errors.py).
     """
-    # Подменяем ключ, если больше одного
-    get_next_api_key()
+    cache_key = gpt_cache.make_key(messages, model, temperature) if use_cache else None
+    if cache_key:
+        cached = await gpt_cache.get(cache_key)
+        if cached is not None:
+            return cached
 
     try:
-        response = await openai.ChatCompletion.acreate(
-            model=model,
-            messages=messages,
-            temperature=0.7,
-        )
-        return response.choices[0].message.content
-    except Exception as e:
-        # В случае ошибки возвращаем текст с префиксом "Ошибка GPT:"
-        return f"Ошибка GPT: {e}"
+        if on_partial is None and config.SINGLEFLIGHT_ENABLED:
+            # Одинаковые одновременные запросы (двойное нажатие, повторная доставка) выполняются один раз.
+            # В ключе — все параметры, от которых зависит ответ (как у кэша ответов)
+            flight_key = gpt_cache.request_fingerprint(messages, model, temperature=temperature)
+            answer = await singleflight.do(
+                flight_key, lambda: _call_openai(messages, model, temperature, None, ticket)
+            )
+        else:
+            answer = await _call_openai(messages, model, temperature, on_partial, ticket)
+    except openai.error.OpenAIError as e:
+        # Ошибка не превращается в текст ответа: задача повторяется или уходит в DLQ (worker/retry.py)
+        raise _classify_openai_error(e) from e
+    # Кэшируем только успешные ответы
+    if cache_key and answer:
+        await gpt_cache.put(cache_key, answer)
+    return answer
@@ -0,0 +1,154 @@
+# /opt/RiverAI/worker/services/key_pool.py
+
+import asyncio
+import logging
+import re
+import time
+
+from common.rate_limit import TokenBucket
+from worker import metrics
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_duration(value: str | None) -> float | None:
+    """Parse OpenAI reset durations like '1s', '6m0s', '20ms' (or plain seconds)."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_RE.findall(value)
+    if not parts:
+        return None
+    return sum(float(num) * _UNITS[unit] for num, unit in parts)
+
+
+class ApiKey:
+    """State of one OpenAI key: its own request/token buckets, load and health."""
+
+    def __init__(self, key: str, rpm: int, tpm: int):
+        self.key = key
+        self.requests = TokenBucket(rpm / 60.0, rpm)
+        self.tokens = TokenBucket(tpm / 60.0, tpm)
+        self.in_flight = 0
+        self.failures = 0
+        self.disabled_until = 0.0
+
+    @property
+    def label(self) -> str:
+        return f"...{self.key[-4:]}"
+
+    def healthy(self, now: float) -> bool:
+        return now >= self.disabled_until
+
+
+class KeyPool:
+    """
+    Pool of OpenAI API keys with per-key rate limiting.
+
+    acquire() picks the least loaded healthy key that has request and token
+    budget left (waiting if none has), release() settles the actual token
+    usage. Rate-limit responses and failures take a key out of rotation for
+    a while; the selected key is passed explicitly to each API call.
+    """
+
+    def __init__(self, keys: list[str], rpm: int, tpm: int, cooldown: float):
+        self._keys = [ApiKey(k, rpm, tpm) for k in keys]
+        self._cooldown = cooldown
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def _pick(self, estimated_tokens: int) -> ApiKey | None:
+        now = time.monotonic()
+        candidates = [
+            k for k in self._keys
+            if k.healthy(now)
+            and k.requests.delay_for(1) == 0
+            and k.tokens.delay_for(estimated_tokens) == 0
+        ]
+        if not candidates:
+            return None
+        # Меньше запросов в работе, затем больше свободного бюджета токенов
+        return min(candidates, key=lambda k: (k.in_flight, -k.tokens.tokens))
+
+    def _wait_time(self, estimated_tokens: int) -> float:
+        now = time.monotonic()
+        waits = []
+        for k in self._keys:
+            wait = max(
+                k.disabled_until - now,
+                k.requests.delay_for(1),
+                k.tokens.delay_for(estimated_tokens),
+            )
+            waits.append(wait)
+        return max(0.05, min(waits))
+
+    async def acquire(self, estimated_tokens: int) -> ApiKey | None:
+        """Reserve a key for one request; returns None if no keys are configured."""
+        if not self._keys:
+            return None
+        waited = 0.0
+        while True:
+            key = self._pick(estimated_tokens)
+            if key is not None:
+                key.requests.consume(1)
+                key.tokens.consume(estimated_tokens)
+                key.in_flight += 1
+                if waited:
+                    metrics.observe("openai.key_wait", waited)
+                return key
+            delay = self._wait_time(estimated_tokens)
+            waited += delay
+            await asyncio.sleep(delay)
+
+    def release(self, key: ApiKey | None, estimated_tokens: int, used_tokens: int | None = None) -> None:
+        """Finish a request: return the key and correct the token estimate with the real usage."""
+        if key is None:
+            return
+        key.in_flight -= 1
+        if used_tokens is not None:
+            key.tokens.consume(used_tokens - estimated_tokens)
+
+    def report_success(self, key: ApiKey | None) -> None:
+        if key is not None:
+            key.failures = 0
+
+    def report_rate_limited(self, key: ApiKey | None, headers: dict | None) -> None:
+        """Adapt to a 429: honour retry-after / x-ratelimit-* headers and pause the key."""
+        if key is None:
+            return
+        headers = {k.lower(): v for k, v in (headers or {}).items()}
+        remaining_requests = headers.get("x-ratelimit-remaining-requests")
+        remaining_tokens = headers.get("x-ratelimit-remaining-tokens")
+        if remaining_requests is not None:
+            key.requests.limit(float(remaining_requests))
+        if remaining_tokens is not None:
+            key.tokens.limit(float(remaining_tokens))
+        pause = (
+            parse_duration(headers.get("retry-after"))
+            or max(
+                parse_duration(headers.get("x-ratelimit-reset-requests")) or 0,
+                parse_duration(headers.get("x-ratelimit-reset-tokens")) or 0,
+            )
+            or self._cooldown
+        )
+        key.disabled_until = time.monotonic() + pause
+        metrics.inc("openai.rate_limited")
+        logging.warning(f"⚠️ OpenAI key {key.label} rate limited, paused for {pause:.1f}s")
+
+    def report_failure(self, key: ApiKey | None, permanent: bool = False) -> None:
+        """Take a failing key out of rotation (exponential cooldown, long one for auth errors)."""
+        if key is None:
+            return
+        key.failures += 1
+        if permanent:
+            pause = self._cooldown * 20
+        else:
+            pause = min(self._cooldown * (2 ** (key.failures - 1)), self._cooldown * 20)
+        key.disabled_until = time.monotonic() + pause
+        metrics.inc("openai.key_failures")
+        logging.warning(f"⚠️ OpenAI key {key.label} failed ({key.failures}x), out of rotation for {pause:.0f}s")
@@ -1,83 +1,104 @@
-import subprocess
-import tempfile
+import asyncio
+import logging
 import os
 
-# Paths to LaTeX templates (if needed)
-PLAN_TEMPLATE_PATH = "templates/plan_template.tex"
-TASKS_TEMPLATE_PATH = "templates/tasks_template.tex"
-REPORT_TEMPLATE_PATH = "templates/report_template.tex"
+from worker import config
+from worker.services import pdf_cache, render_service
 
-def generate_plan_pdf(plan_text: str) -> str:
+# Paths to LaTeX templates
+PLAN_TEMPLATE_PATH = os.path.join(config.LATEX_TEMPLATES_DIR, "plan_template.tex")
+TASKS_TEMPLATE_PATH = os.path.join(config.LATEX_TEMPLATES_DIR, "tasks_template.tex")
+REPORT_TEMPLATE_PATH = os.path.join(config.LATEX_TEMPLATES_DIR, "report_template.tex")
+
+_TEMPLATE_PATHS = {
+    "plan": PLAN_TEMPLATE_PATH,
+    "tasks": TASKS_TEMPLATE_PATH,
+    "report": REPORT_TEMPLATE_PATH,
+}
+
+# name -> (preamble, document header); filled once by load_templates()
+_templates: dict[str, tuple[str, str]] = {}
+# name -> precompiled format name (only for templates whose format was built)
+_formats: dict[str, str] = {}
+
+def _escape(text: str) -> str:
+    return text.replace('%', r'\%')
+
+def _parse_template(source: str) -> tuple[str, str]:
+    """
+    Split a template into its preamble and the fixed document header
+    (non-comment lines between \\begin{document} and \\end{document}).
+    """
+    preamble, _, body = source.partition(r"\begin{document}")
+    body = body.replace(r"\end{document}", "")
+    header = "\n".join(
+        line for line in body.splitlines()
+        if line.strip() and not line.lstrip().startswith("%")
+    )
+    return preamble.strip(), header
+
+def load_templates() -> None:
+    """Read templates/*.tex once and keep them in memory."""
+    for name, path in _TEMPLATE_PATHS.items():
+        with open(path, encoding="utf-8") as f:
+            _templates[name] = _parse_template(f.read())
+
+async def warm_up() -> None:
+    """
+    Load the templates and dump a precompiled format per template, so that
+    every render starts from an already parsed preamble.
+    """
+    load_templates()
+    names = list(_templates)
+    built = await asyncio.gather(
+        *(render_service.build_format(f"riverai_{name}", _templates[name][0]) for name in names)
+    )
+    for name, fmt in zip(names, built):
+        if fmt:
+            _formats[name] = fmt
+    logging.info(f"✔️ LaTeX templates loaded, precompiled formats: {sorted(_formats)}")
+
+async def _render(name: str, content: str) -> bytes | None:
+    if not _templates:
+        load_templates()
+    preamble, header = _templates[name]
+    # Identical (template, body) pairs are served from the cache without running pdflatex
+    cache_key = pdf_cache.make_key(f"{name}\n{preamble}\n{header}", content)
+    cached = await pdf_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    document = r"\begin{document}" + "\n" + header + "\n" + content + "\n" + r"\end{document}" + "\n"
+    fmt = _formats.get(name)
+    if fmt:
+        data = await render_service.render_pdf(document, name, fmt=fmt)
+    else:
+        data = await render_service.render_pdf(preamble + "\n" + document, name)
+    if data:
+        await pdf_cache.put(cache_key, data)
+    return data
+
+async def generate_plan_pdf(plan_text: str) -> bytes | None:
     """
-    Generate a PDF for the study plan. Returns the file path or None if failed.
+    Generate a PDF for the study plan. Returns the PDF bytes or None if failed.
     """
-    # Simple LaTeX generation: embed plan_text into a basic template
-    latex_content = r"\documentclass{article}\begin{document}" + "\n"
-    latex_content += plan_text.replace('%', '\%') + "\n"  # escape %
-    latex_content += r"\end{document}"
-    try:
-        with tempfile.TemporaryDirectory() as tmpdir:
-            tex_path = os.path.join(tmpdir, "plan.tex")
-            pdf_path = os.path.join(tmpdir, "plan.pdf")
-            with open(tex_path, "w", encoding="utf-8") as f:
-                f.write(latex_content)
-            # Run pdflatex
-            result = subprocess.run(["pdflatex", "-interaction=batchmode", tex_path], cwd=tmpdir, capture_output=True)
-            if result.returncode == 0 and os.path.exists(pdf_path):
-                # Copy PDF out of temp dir (since it will be cleaned up)
-                final_path = os.path.join(os.getcwd(), f"plan_{os.getpid()}.pdf")
-                os.replace(pdf_path, final_path)
-                return final_path
-    except Exception as e:
-        print(f"PDF generation error: {e}")
-    return None
+    return await _render("plan", _escape(plan_text))
 
-def generate_tasks_pdf(tasks_parts: list) -> str:
+async def generate_tasks_pdf(tasks_parts: list) -> bytes | None:
     """
     Generate PDF for tasks. tasks_parts is list of alternating task and solution texts.
     """
-    latex_content = r"\documentclass{article}\usepackage{enumitem}\begin{document}\section*{Сгенерированные задания}" + "\n"
-    latex_content += r"\begin{enumerate}[leftmargin=*]" + "\n"
+    latex_content = r"\begin{enumerate}[leftmargin=*]" + "\n"
     for i in range(0, len(tasks_parts), 2):
         task = tasks_parts[i].strip()
-        latex_content += r"\item " + task.replace('%', '\%') + "\n"
+        latex_content += r"\item " + _escape(task) + "\n"
         if i+1 < len(tasks_parts):
             solution = tasks_parts[i+1].strip()
-            latex_content += r"\newline \textbf{Решение:} " + solution.replace('%', '\%') + "\n"
-    latex_content += r"\end{enumerate}\end{document}"
-    try:
-        with tempfile.TemporaryDirectory() as tmpdir:
-            tex_path = os.path.join(tmpdir, "tasks.tex")
-            pdf_path = os.path.join(tmpdir, "tasks.pdf")
-            with open(tex_path, "w", encoding="utf-8") as f:
-                f.write(latex_content)
-            result = subprocess.run(["pdflatex", "-interaction=batchmode", tex_path], cwd=tmpdir, capture_output=True)
-            if result.returncode == 0 and os.path.exists(pdf_path):
-                final_path = os.path.join(os.getcwd(), f"tasks_{os.getpid()}.pdf")
-                os.replace(pdf_path, final_path)
-                return final_path
-    except Exception as e:
-        print(f"PDF generation error: {e}")
-    return None
+            latex_content += r"\newline \textbf{Решение:} " + _escape(solution) + "\n"
+    latex_content += r"\end{enumerate}"
+    return await _render("tasks", latex_content)
 
-def generate_report_pdf(report_text: str) -> str:
+async def generate_report_pdf(report_text: str) -> bytes | None:
     """
     Generate PDF for homework check report.
     """
-    latex_content = r"\documentclass{article}\begin{document}\section*{Отчёт проверки}" + "\n"
-    latex_content += report_text.replace('%', '\%') + "\n"
-    latex_content += r"\end{document}"
-    try:
-        with tempfile.TemporaryDirectory() as tmpdir:
-            tex_path = os.path.join(tmpdir, "report.tex")
-            pdf_path = os.path.join(tmpdir, "report.pdf")
-            with open(tex_path, "w", encoding="utf-8") as f:
-                f.write(latex_content)
-            result = subprocess.run(["pdflatex", "-interaction=batchmode", tex_path], cwd=tmpdir, capture_output=True)
-            if result.returncode == 0 and os.path.exists(pdf_path):
-                final_path = os.path.join(os.getcwd(), f"report_{os.getpid()}.pdf")
-                os.replace(pdf_path, final_path)
-                return final_path
-    except Exception as e:
-        print(f"PDF generation error: {e}")
-    return None
+    return await _render("report", _escape(report_text))
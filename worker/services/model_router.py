@@ -0,0 +1,162 @@
+# /opt/RiverAI/worker/services/model_router.py
+
+import logging
+import time
+from collections import deque
+
+from worker import metrics
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+_STATE_GAUGE = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitBreaker:
+    """
+    Circuit of one model over a rolling window of outcomes (time, ok, latency).
+
+    The circuit opens when, with at least `min_requests` in the window, the share
+    of errors or of responses slower than the latency SLO reaches its threshold.
+    After `open_seconds` it is half-open: a single probe request is let through —
+    a fast success closes the circuit, anything else opens it again.
+
+    allow() hands out a ticket (the breaker generation); record() ignores outcomes whose
+    ticket is stale — calls admitted before the last state change or a superseded probe.
+    """
+
+    def __init__(self, model: str, window: float, min_requests: int, error_rate: float,
+                 latency_slo: float, slow_rate: float, open_seconds: float):
+        self.model = model
+        self.window = window
+        self.min_requests = min_requests
+        self.error_rate = error_rate
+        self.latency_slo = latency_slo
+        self.slow_rate = slow_rate
+        self.open_seconds = open_seconds
+        self.state = CLOSED
+        self._outcomes: deque[tuple[float, bool, float]] = deque()
+        self._opened_at = 0.0
+        # Время выдачи пробного запроса в half-open (0 — пробы нет)
+        self._probe_at = 0.0
+        # Растёт при каждой смене состояния и выдаче пробы; выдаётся вызовам как билет
+        self._generation = 0
+
+    def _trim(self, now: float) -> None:
+        while self._outcomes and self._outcomes[0][0] < now - self.window:
+            self._outcomes.popleft()
+
+    def _set_state(self, state: str, reason: str = "") -> None:
+        if state != self.state:
+            logging.warning(f"⚡ Circuit for {self.model}: {self.state} -> {state} {reason}".rstrip())
+            self._generation += 1
+        self.state = state
+        metrics.set_gauge(f"circuit.{self.model}", _STATE_GAUGE[state])
+
+    def allow(self) -> int | None:
+        """
+        Ticket for a request to this model now (takes the probe slot when half-open),
+        or None if the circuit does not let it through.
+        """
+        now = time.monotonic()
+        if self.state == OPEN and now - self._opened_at >= self.open_seconds:
+            self._set_state(HALF_OPEN)
+            self._probe_at = 0.0
+        if self.state == CLOSED:
+            return self._generation
+        if self.state == HALF_OPEN:
+            # Проба, которая так и не отчиталась (ответ из кэша, отмена), освобождает слот через SLO;
+            # новый билет делает её запоздалый исход недействительным
+            if not self._probe_at or now - self._probe_at > self.latency_slo:
+                self._probe_at = now
+                self._generation += 1
+                return self._generation
+        return None
+
+    def release(self, ticket: int | None) -> None:
+        """Free the probe slot without an outcome (the call failed for reasons unrelated to the model)."""
+        if self.state == HALF_OPEN and ticket is not None and ticket == self._generation:
+            self._probe_at = 0.0
+
+    def record(self, ok: bool, latency: float, ticket: int | None = None) -> None:
+        """
+        Account an outcome. ticket is what allow() returned; without one (the call did not go
+        through the router) the outcome only counts while the circuit is closed.
+        """
+        if ticket is not None and ticket != self._generation:
+            return
+        if ticket is None and self.state != CLOSED:
+            return
+        now = time.monotonic()
+        slow = latency > self.latency_slo
+        if self.state == HALF_OPEN:
+            if ok and not slow:
+                self._outcomes.clear()
+                self._set_state(CLOSED, f"(probe ok in {latency:.1f}s)")
+            else:
+                self._opened_at = now
+                self._set_state(OPEN, "(probe failed)")
+            self._probe_at = 0.0
+            return
+
+        self._outcomes.append((now, ok, latency))
+        self._trim(now)
+        total = len(self._outcomes)
+        if self.state != CLOSED or total < self.min_requests:
+            return
+        errors = sum(1 for _, success, _ in self._outcomes if not success)
+        slow_count = sum(1 for _, success, lat in self._outcomes if success and lat > self.latency_slo)
+        if errors / total >= self.error_rate or slow_count / total >= self.slow_rate:
+            self._opened_at = now
+            self._set_state(OPEN, f"(errors {errors}/{total}, slow {slow_count}/{total} in {self.window:.0f}s)")
+
+
+class ModelRouter:
+    """
+    Picks the model for a request: the requested one while its circuit is closed,
+    otherwise the first fallback (MODEL_FALLBACKS, may be a chain) whose circuit allows it.
+    """
+
+    def __init__(self, fallbacks: dict[str, str], latency_slos: dict[str, float], *, default_slo: float,
+                 window: float, min_requests: int, error_rate: float, slow_rate: float, open_seconds: float):
+        self._fallbacks = fallbacks
+        self._latency_slos = latency_slos
+        self._default_slo = default_slo
+        self._params = dict(window=window, min_requests=min_requests, error_rate=error_rate,
+                            slow_rate=slow_rate, open_seconds=open_seconds)
+        self._breakers: dict[str, CircuitBreaker] = {}
+
+    def breaker(self, model: str) -> CircuitBreaker:
+        breaker = self._breakers.get(model)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                model, latency_slo=self._latency_slos.get(model, self._default_slo), **self._params
+            )
+            self._breakers[model] = breaker
+        return breaker
+
+    def resolve(self, model: str) -> tuple[str, str | None, int | None]:
+        """
+        Return (model to use, requested model if a fallback was chosen else None, breaker ticket
+        to pass back to record()).
+        """
+        candidate = model
+        seen = set()
+        while candidate and candidate not in seen:
+            seen.add(candidate)
+            ticket = self.breaker(candidate).allow()
+            if ticket is not None:
+                if candidate != model:
+                    metrics.inc(f"router.fallback.{model}")
+                    return candidate, model, ticket
+                return model, None, ticket
+            candidate = self._fallbacks.get(candidate)
+        # Все цепочки открыты — остаёмся на запрошенной модели (ошибка уйдёт в повтор задачи)
+        return model, None, None
+
+    def record(self, model: str, ok: bool, latency: float, ticket: int | None = None) -> None:
+        self.breaker(model).record(ok, latency, ticket)
+
+    def release(self, model: str, ticket: int | None) -> None:
+        self.breaker(model).release(ticket)
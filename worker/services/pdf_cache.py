@@ -0,0 +1,157 @@
+# /opt/RiverAI/worker/services/pdf_cache.py
+
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+
+from worker import config, metrics, redis_cache
+
+REDIS_KEY_PREFIX = "pdfcache:"
+
+# LRU-индекс локального кэша: key -> размер файла в байтах
+_index: "OrderedDict[str, int]" = OrderedDict()
+_total_bytes = 0
+_loaded = False
+
+
+def make_key(template: str, body: str) -> str:
+    """Content address of a document: sha256 of the template source and the escaped body."""
+    h = hashlib.sha256()
+    h.update(template.encode("utf-8"))
+    h.update(b"\0")
+    h.update(body.encode("utf-8"))
+    return h.hexdigest()
+
+
+def _local_path(key: str) -> str:
+    return os.path.join(config.PDF_CACHE_DIR, f"{key}.pdf")
+
+
+def _load_index() -> None:
+    """Rebuild the LRU index from files on disk (oldest mtime first)."""
+    global _total_bytes, _loaded
+    _loaded = True
+    os.makedirs(config.PDF_CACHE_DIR, exist_ok=True)
+    entries = []
+    for fname in os.listdir(config.PDF_CACHE_DIR):
+        if not fname.endswith(".pdf"):
+            continue
+        st = os.stat(os.path.join(config.PDF_CACHE_DIR, fname))
+        entries.append((st.st_mtime, fname[:-4], st.st_size))
+    for _, key, size in sorted(entries):
+        _index[key] = size
+        _total_bytes += size
+    _evict()
+
+
+def _evict() -> None:
+    global _total_bytes
+    while _total_bytes > config.PDF_CACHE_MAX_BYTES and _index:
+        key, size = _index.popitem(last=False)
+        _total_bytes -= size
+        try:
+            os.remove(_local_path(key))
+        except FileNotFoundError:
+            pass
+        metrics.inc("pdf_cache.evictions")
+    metrics.set_gauge("pdf_cache.local_bytes", _total_bytes)
+
+
+def _get_local(key: str) -> bytes | None:
+    if key not in _index:
+        return None
+    path = _local_path(key)
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        _forget(key)
+        return None
+    _index.move_to_end(key)
+    os.utime(path)
+    return data
+
+
+def _forget(key: str) -> None:
+    global _total_bytes
+    size = _index.pop(key, None)
+    if size is not None:
+        _total_bytes -= size
+
+
+def _put_local(key: str, data: bytes) -> None:
+    global _total_bytes
+    path = _local_path(key)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    _forget(key)
+    _index[key] = len(data)
+    _total_bytes += len(data)
+    _evict()
+
+
+async def _get_shared(key: str) -> bytes | None:
+    if config.PDF_CACHE_SHARED == "redis":
+        return await redis_cache.get_bytes(REDIS_KEY_PREFIX + key)
+    if config.PDF_CACHE_SHARED == "dir" and config.PDF_CACHE_SHARED_DIR:
+        path = os.path.join(config.PDF_CACHE_SHARED_DIR, f"{key}.pdf")
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                return f.read()
+    return None
+
+
+async def _put_shared(key: str, data: bytes) -> None:
+    if config.PDF_CACHE_SHARED == "redis":
+        await redis_cache.set_bytes(REDIS_KEY_PREFIX + key, data, ttl=config.PDF_CACHE_SHARED_TTL)
+    elif config.PDF_CACHE_SHARED == "dir" and config.PDF_CACHE_SHARED_DIR:
+        os.makedirs(config.PDF_CACHE_SHARED_DIR, exist_ok=True)
+        path = os.path.join(config.PDF_CACHE_SHARED_DIR, f"{key}.pdf")
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+
+def _record(hit: bool, size: int = 0) -> None:
+    if hit:
+        metrics.inc("pdf_cache.hits")
+        metrics.inc("pdf_cache.bytes_saved", size)
+    else:
+        metrics.inc("pdf_cache.misses")
+    metrics.set_gauge("pdf_cache.hit_ratio", metrics.ratio("pdf_cache.hits", "pdf_cache.misses"))
+
+
+async def get(key: str) -> bytes | None:
+    """Look the PDF up in the local cache, then in the shared tier."""
+    if not config.PDF_CACHE_ENABLED:
+        return None
+    try:
+        if not _loaded:
+            _load_index()
+        data = _get_local(key)
+        if data is None:
+            data = await _get_shared(key)
+            if data is not None:
+                _put_local(key, data)
+    except Exception as e:
+        logging.warning(f"⚠️ PDF cache lookup failed: {e}")
+        data = None
+    _record(data is not None, len(data) if data else 0)
+    return data
+
+
+async def put(key: str, data: bytes) -> None:
+    """Store a rendered PDF locally and in the shared tier (errors are only logged)."""
+    if not config.PDF_CACHE_ENABLED:
+        return
+    try:
+        if not _loaded:
+            _load_index()
+        _put_local(key, data)
+        await _put_shared(key, data)
+    except Exception as e:
+        logging.warning(f"⚠️ PDF cache store failed: {e}")
@@ -0,0 +1,137 @@
+# /opt/RiverAI/worker/services/render_service.py
+
+import asyncio
+import logging
+import os
+import tempfile
+import time
+
+from worker import config, metrics
+
+# Ограничитель числа одновременно работающих pdflatex (создаётся лениво внутри event loop)
+_slots: asyncio.Semaphore | None = None
+_queued = 0
+_running = 0
+
+
+def _get_slots() -> asyncio.Semaphore:
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(max(1, config.RENDER_CONCURRENCY))
+    return _slots
+
+
+def stats() -> dict:
+    """Current queue depth and number of running renders."""
+    return {"queued": _queued, "running": _running, "capacity": config.RENDER_CONCURRENCY}
+
+
+def _format_env() -> dict:
+    # Добавляем каталог с нашими .fmt в путь поиска форматов (пустой элемент — системные пути)
+    env = dict(os.environ)
+    env["TEXFORMATS"] = f"{config.LATEX_FORMAT_DIR}{os.pathsep}"
+    return env
+
+
+async def _run_pdflatex(args: list[str], cwd: str, env: dict | None = None) -> int | None:
+    """
+    Run pdflatex as an asyncio subprocess.
+    Returns the exit code, or None if the process was killed on timeout.
+    """
+    proc = await asyncio.create_subprocess_exec(
+        "pdflatex", *args,
+        cwd=cwd,
+        env=env,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.DEVNULL,
+    )
+    try:
+        return await asyncio.wait_for(proc.wait(), timeout=config.RENDER_TIMEOUT)
+    except asyncio.TimeoutError:
+        metrics.inc("render.timeouts")
+        logging.warning(f"⚠️ pdflatex timed out after {config.RENDER_TIMEOUT}s, killing pid={proc.pid}")
+        return None
+    finally:
+        # Убиваем процесс и при таймауте, и при отмене задачи
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+
+
+async def build_format(name: str, preamble: str) -> str | None:
+    """
+    Dump the given preamble into a precompiled format LATEX_FORMAT_DIR/<name>.fmt.
+    Documents compiled with this format skip loading the class and packages.
+    Returns the format name or None if the build failed.
+    """
+    os.makedirs(config.LATEX_FORMAT_DIR, exist_ok=True)
+    src_path = os.path.join(config.LATEX_FORMAT_DIR, f"{name}.tex")
+    with open(src_path, "w", encoding="utf-8") as f:
+        f.write(preamble + "\n\\dump\n")
+    started_at = time.monotonic()
+    try:
+        returncode = await _run_pdflatex(
+            ["-ini", "-interaction=batchmode", f"-jobname={name}", "&pdflatex", src_path],
+            config.LATEX_FORMAT_DIR,
+        )
+    except Exception as e:
+        logging.error(f"LaTeX format build error ({name}): {e}")
+        return None
+    fmt_path = os.path.join(config.LATEX_FORMAT_DIR, f"{name}.fmt")
+    if returncode != 0 or not os.path.exists(fmt_path):
+        logging.warning(f"⚠️ Could not build LaTeX format '{name}', falling back to cold compiles")
+        return None
+    logging.info(f"✔️ LaTeX format '{name}' built in {time.monotonic() - started_at:.2f}s")
+    return name
+
+
+async def render_pdf(latex_source: str, jobname: str = "document", fmt: str | None = None) -> bytes | None:
+    """
+    Compile LaTeX source to PDF in the bounded render pool.
+    Waits for a free slot, then runs pdflatex in a temporary directory.
+    If fmt is given, the source must contain only the document part
+    (from \\begin{document}) and is compiled against that precompiled format.
+    Returns the PDF bytes or None if rendering failed or timed out.
+    """
+    global _queued, _running
+    slots = _get_slots()
+    enqueued_at = time.monotonic()
+    _queued += 1
+    metrics.set_gauge("render.queue_depth", _queued)
+    try:
+        await slots.acquire()
+    finally:
+        _queued -= 1
+        metrics.set_gauge("render.queue_depth", _queued)
+
+    started_at = time.monotonic()
+    metrics.observe("render.queue_wait", started_at - enqueued_at)
+    _running += 1
+    metrics.set_gauge("render.running", _running)
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tex_path = os.path.join(tmpdir, f"{jobname}.tex")
+            pdf_path = os.path.join(tmpdir, f"{jobname}.pdf")
+            with open(tex_path, "w", encoding="utf-8") as f:
+                f.write(latex_source)
+            if fmt:
+                args = [f"-fmt={fmt}", "-interaction=batchmode", tex_path]
+                returncode = await _run_pdflatex(args, tmpdir, env=_format_env())
+            else:
+                returncode = await _run_pdflatex(["-interaction=batchmode", tex_path], tmpdir)
+            if returncode == 0 and os.path.exists(pdf_path):
+                with open(pdf_path, "rb") as f:
+                    data = f.read()
+                metrics.inc("render.ok")
+                return data
+            metrics.inc("render.failed")
+    except Exception as e:
+        metrics.inc("render.failed")
+        logging.error(f"PDF generation error: {e}")
+    finally:
+        _running -= 1
+        metrics.set_gauge("render.running", _running)
+        metrics.observe("render.latency", time.monotonic() - started_at)
+        slots.release()
+    return None
@@ -0,0 +1,104 @@
+# /opt/RiverAI/worker/services/singleflight.py
+
+import asyncio
+import logging
+import time
+import uuid
+from typing import Awaitable, Callable
+
+from worker import config, metrics, redis_cache
+
+LOCK_PREFIX = "sf:lock:"
+RESULT_PREFIX = "sf:result:"
+
+# Запросы, выполняющиеся в этом процессе: key -> Future с результатом
+_in_flight: dict[str, asyncio.Future] = {}
+
+
+async def do(key: str, fn: Callable[[], Awaitable[str]]) -> str:
+    """
+    Run fn() once for all concurrent callers with the same key.
+
+    Within the process, followers await the leader's future. Across worker
+    processes, the leader holds a short Redis lock and publishes its answer
+    under a short-lived result key; followers in other processes poll for it
+    and run fn() themselves only if the leader disappears without a result.
+    If the leader fails, its local followers receive the same exception; if the
+    leader is cancelled, they start over (one of them becomes the new leader).
+    """
+    fut = _in_flight.get(key)
+    while fut is not None:
+        metrics.inc("singleflight.coalesced_local")
+        # wait() не отменяет fut при отмене ожидающего и не бросает CancelledError при отмене fut
+        await asyncio.wait({fut})
+        if not fut.cancelled():
+            return fut.result()
+        fut = _in_flight.get(key)
+
+    fut = asyncio.get_running_loop().create_future()
+    _in_flight[key] = fut
+    try:
+        answer = await _do_distributed(key, fn)
+    except asyncio.CancelledError:
+        fut.cancel()
+        raise
+    except Exception as e:
+        # Ожидающие в этом процессе получат то же исключение; помечаем его как прочитанное
+        fut.set_exception(e)
+        fut.exception()
+        raise
+    else:
+        fut.set_result(answer)
+        return answer
+    finally:
+        _in_flight.pop(key, None)
+
+
+async def _do_distributed(key: str, fn: Callable[[], Awaitable[str]]) -> str:
+    token = uuid.uuid4().hex
+    try:
+        locked = await redis_cache.acquire_lock(LOCK_PREFIX + key, token, config.SINGLEFLIGHT_LOCK_TTL)
+    except Exception as e:
+        logging.warning(f"⚠️ Single-flight lock unavailable, running request directly: {e}")
+        return await fn()
+
+    if locked:
+        try:
+            answer = await fn()
+            try:
+                await redis_cache.set_bytes(
+                    RESULT_PREFIX + key, answer.encode("utf-8"), ttl=config.SINGLEFLIGHT_RESULT_TTL
+                )
+            except Exception as e:
+                logging.warning(f"⚠️ Single-flight result store failed: {e}")
+            return answer
+        finally:
+            try:
+                await redis_cache.release_lock(LOCK_PREFIX + key, token)
+            except Exception:
+                pass
+
+    # Другой воркер уже выполняет такой же запрос — ждём его результат
+    metrics.inc("singleflight.coalesced_remote")
+    data = await _wait_remote(key)
+    if data is not None:
+        return data
+    return await fn()
+
+
+async def _wait_remote(key: str) -> str | None:
+    """Poll for the result of another worker; None if it finished without one or Redis failed."""
+    deadline = time.monotonic() + config.SINGLEFLIGHT_LOCK_TTL
+    try:
+        while time.monotonic() < deadline:
+            await asyncio.sleep(config.SINGLEFLIGHT_POLL_INTERVAL)
+            data = await redis_cache.get_bytes(RESULT_PREFIX + key)
+            if data is not None:
+                return data.decode("utf-8")
+            if not await redis_cache.exists(LOCK_PREFIX + key):
+                # Лидер завершился — результат мог появиться между двумя проверками
+                data = await redis_cache.get_bytes(RESULT_PREFIX + key)
+                return data.decode("utf-8") if data is not None else None
+    except Exception as e:
+        logging.warning(f"⚠️ Single-flight wait failed: {e}")
+    return None
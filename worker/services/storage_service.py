@@ -1,23 +1,49 @@
+import logging
+
 import aiohttp
 from worker import config
+from worker.errors import PermanentError, TaskError, TransientError
 
-async def upload_to_yadisk(token: str, file_path: str, remote_path: str):
+async def upload_to_yadisk(token: str, data: bytes, remote_path: str):
     """
-    Upload a file to Yandex Disk using API. remote_path is the path on Yandex.Disk.
-    Returns True on success.
+    Upload file content to Yandex Disk using API. remote_path is the path on Yandex.Disk.
+    Raises TransientError (network, 429, 5xx) or PermanentError (bad token, other 4xx).
     """
     api_base = "https://cloud-api.yandex.net/v1/disk"
     headers = {"Authorization": f"OAuth {token}"}
-    # Get upload URL
-    async with aiohttp.ClientSession() as session:
-        params = {"path": remote_path, "overwrite": "true"}
-        async with session.get(f"{api_base}/resources/upload", headers=headers, params=params) as resp:
-            if resp.status != 200:
-                return False
-            data = await resp.json()
-            href = data.get("href")
-            if not href:
-                return False
-        # Upload file by PUT
-        async with session.put(href, data=open(file_path, 'rb')) as put_resp:
-            return 200 <= put_resp.status < 300
+    try:
+        # Get upload URL
+        async with aiohttp.ClientSession() as session:
+            params = {"path": remote_path, "overwrite": "true"}
+            async with session.get(f"{api_base}/resources/upload", headers=headers, params=params) as resp:
+                _raise_for_status(resp.status, "upload link")
+                data_json = await resp.json()
+                href = data_json.get("href")
+                if not href:
+                    raise PermanentError("Yandex Disk: no upload link in response")
+            # Upload file by PUT
+            async with session.put(href, data=data) as put_resp:
+                _raise_for_status(put_resp.status, "upload")
+    except aiohttp.ClientError as e:
+        raise TransientError(f"Yandex Disk: {e}") from e
+
+def _raise_for_status(status: int, step: str) -> None:
+    if 200 <= status < 300:
+        return
+    if status == 429 or status >= 500:
+        raise TransientError(f"Yandex Disk {step}: HTTP {status}")
+    raise PermanentError(f"Yandex Disk {step}: HTTP {status}")
+
+async def upload_pdf(token: str, pdf_bytes: bytes | None, remote_path: str) -> bool:
+    """
+    Upload a generated PDF to the user's Yandex Disk. Returns False if it failed —
+    the PDF is then sent via Telegram, so a storage error does not fail the task.
+    """
+    if not pdf_bytes:
+        return False
+    try:
+        await upload_to_yadisk(token, pdf_bytes, remote_path)
+        return True
+    except TaskError as e:
+        logging.warning(f"⚠️ Yandex Disk upload of {remote_path} failed, sending via Telegram: {e}")
+        return False
@@ -0,0 +1,90 @@
+# /opt/RiverAI/worker/services/usage_meter.py
+#
+# Учёт запросов без UPDATE на каждую задачу: счётчик увеличивается в Redis,
+# flush_loop раз в USAGE_FLUSH_INTERVAL секунд переносит накопленное в users.usage_count
+# одним UPDATE на пачку. Формат ключей — common/usage_meter.py.
+
+import asyncio
+import logging
+import time
+import uuid
+
+from common.usage_meter import BATCH_PREFIX, BATCHES_KEY, PENDING_KEY
+from worker import config, db, redis_cache
+
+# Снимает накопленные счётчики в отдельную пачку атомарно:
+# HINCRBY после RENAME попадут уже в новый usage:pending
+_TAKE_BATCH_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+redis.call('RENAME', KEYS[1], KEYS[2])
+redis.call('ZADD', KEYS[3], ARGV[1], KEYS[2])
+return 1
+"""
+
+
+async def record(user_id: int, amount: int = 1) -> None:
+    """Count a request; falls back to a direct UPDATE if Redis is unavailable."""
+    if config.USAGE_METER_ENABLED:
+        try:
+            await redis_cache._get_client().hincrby(PENDING_KEY, user_id, amount)
+            return
+        except Exception as e:
+            logging.warning(f"usage meter: Redis unavailable, writing to DB directly: {e}")
+    await db.increment_usage(user_id, amount)
+
+
+async def _apply_batch(key: str) -> None:
+    client = redis_cache._get_client()
+    raw = await client.hgetall(key)
+    deltas = {int(uid): int(n) for uid, n in raw.items() if int(n)}
+    batch_id = key[len(BATCH_PREFIX):]
+    if deltas:
+        applied = await db.apply_usage_batch(batch_id, deltas)
+        if applied:
+            logging.info(f"📊 Usage: flushed {sum(deltas.values())} request(s) for {len(deltas)} user(s)")
+        else:
+            # Пачка уже в БД (упали между коммитом и удалением ключа) — только убираем ключ
+            logging.info(f"📊 Usage batch {batch_id} was already applied, dropping it")
+    async with client.pipeline(transaction=True) as pipe:
+        pipe.delete(key)
+        pipe.zrem(BATCHES_KEY, key)
+        await pipe.execute()
+
+
+async def flush() -> None:
+    """Move pending counters into a new batch and write it to Postgres."""
+    client = redis_cache._get_client()
+    key = f"{BATCH_PREFIX}{int(time.time())}-{uuid.uuid4().hex}"
+    taken = await client.eval(_TAKE_BATCH_SCRIPT, 3, PENDING_KEY, key, BATCHES_KEY, time.time())
+    if taken:
+        await _apply_batch(key)
+
+
+async def recover(min_age: float = 0) -> None:
+    """
+    Re-apply batches left behind by a crashed flush (older than min_age seconds,
+    so batches another worker is writing right now are left alone).
+    """
+    client = redis_cache._get_client()
+    for key in await client.zrangebyscore(BATCHES_KEY, "-inf", time.time() - min_age):
+        try:
+            await _apply_batch(key.decode() if isinstance(key, bytes) else key)
+        except Exception:
+            logging.exception(f"🔴 Usage: failed to recover batch {key!r}:")
+
+
+async def flush_loop(interval: float = config.USAGE_FLUSH_INTERVAL) -> None:
+    """Background task for the worker: errors are logged, not raised."""
+    last_prune = 0.0
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await flush()
+            await recover(min_age=config.USAGE_BATCH_STALE_AFTER)
+            if time.monotonic() - last_prune > 3600:
+                await db.prune_usage_flush_log(config.USAGE_FLUSH_LOG_RETENTION_DAYS)
+                last_prune = time.monotonic()
+        except Exception:
+            logging.exception("🔴 Usage flush failed:")
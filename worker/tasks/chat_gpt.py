@@ -1,61 +1,57 @@
-import json
-from worker import redis_cache, db
-from worker.services import gpt_service
+from worker import redis_cache, db, results, config
+from worker.services import context_builder, gpt_service
 
-MAX_HISTORY_MESSAGES = 10  # limit conversation length
+# Предел длины хранимой истории (пар вопрос/ответ): всё, что сверх него, сворачивается
+# в краткое содержание (context_builder). Обычно раньше срабатывает бюджет токенов
+MAX_HISTORY_MESSAGES = 25
+# Аварийный предел на случай, если свёртка раз за разом не удаётся (обрезает без свёртки)
+HISTORY_HARD_LIMIT = 4 * MAX_HISTORY_MESSAGES
 
 async def handle_chat_gpt(task):
     user_id = task["user_id"]
     student_id = task["student_id"]
     user_message = task["message"]
-    # Retrieve conversation history from Redis
-    conv_json = await redis_cache.get_conversation(user_id, student_id)
-    conversation = []
-    if conv_json:
-        try:
-            conversation = json.loads(conv_json)
-        except json.JSONDecodeError:
-            conversation = []
+    model = config.CHAT_MODEL
+    model, fallback_from, ticket = gpt_service.router.resolve(model)
+    # Retrieve conversation history from Redis (system message and summary are stored separately)
+    system, summary, history = await redis_cache.get_conversation(user_id, student_id)
+    new_system = None
     # If no history, add a system message with context (optional)
-    if not conversation:
-        student = await db.get_student(student_id)
-        if student:
-            subject = student["subject_enc"]
-            level = student["level_enc"]
-            # Decrypt subject and level for context
-            from worker.utils import encryption
-            subject = encryption.decrypt_str(subject) if subject else ""
-            level = encryption.decrypt_str(level) if level else ""
+    if system is None and summary is None and not history:
+        ctx = await db.get_task_context(user_id, student_id)
+        if ctx.student:
+            subject = ctx.subject
+            level = ctx.level
             sys_content = f"You are a helpful tutor assistant. The student is learning {subject} at {level} level."
-            conversation.append({"role": "system", "content": sys_content})
-    # Add user message to conversation
-    conversation.append({"role": "user", "content": user_message})
-    # Trim conversation if too long
-    # Keep system + last (MAX_HISTORY_MESSAGES*2) messages (user+assistant pairs)
-    if len(conversation) > 1 + 2 * MAX_HISTORY_MESSAGES:
-        # remove oldest user+assistant pair
-        # (assuming system is at index 0)
-        if conversation[0]["role"] == "system":
-            # remove items at index 1 and 2 (first user and assistant) if exist
-            if len(conversation) > 2:
-                conversation = [conversation[0]] + conversation[-2*MAX_HISTORY_MESSAGES:]
-        else:
-            conversation = conversation[-2*MAX_HISTORY_MESSAGES:]
-    # Ask GPT with conversation
-    answer = await gpt_service.ask_gpt(conversation)
+            system = new_system = {"role": "system", "content": sys_content}
+    # Newest turns that fit into the model's token budget; older ones go into the summary
+    user_entry = {"role": "user", "content": user_message}
+    conversation, dropped = context_builder.build(system, summary, history, user_entry, model)
+    # Ask GPT with conversation (streamed to the bot as partial results if enabled)
+    partial = results.PartialPublisher(task, kind="chat") if results.stream_enabled("chat_gpt") else None
+    answer = await gpt_service.ask_gpt(conversation, model=model, on_partial=partial, ticket=ticket)
     assistant_reply = answer.strip() if answer else "Ошибка или пустой ответ."
-    # Add assistant reply to conversation
-    conversation.append({"role": "assistant", "content": assistant_reply})
-    # Save updated conversation to Redis
-    conv_json = json.dumps(conversation, ensure_ascii=False)
-    await redis_cache.save_conversation(user_id, student_id, conv_json)
+    # Append the question and the reply to the history (append + trim + TTL in one round trip)
+    await redis_cache.append_conversation(
+        user_id, student_id,
+        [user_entry, {"role": "assistant", "content": assistant_reply}],
+        max_messages=2 * HISTORY_HARD_LIMIT,
+        system=new_system,
+    )
+    # Реплики сверх MAX_HISTORY_MESSAGES убирает из истории только свёртка, после того как они в содержании
+    consumed = max(dropped, context_builder.overflow(history, 2, 2 * MAX_HISTORY_MESSAGES))
+    context_builder.summarize_later(user_id, student_id, summary, history[:consumed])
     # Return result
-    return {
+    result = {
         "type": "chat",
         "user_id": user_id,
         "student_id": student_id,
         "answer": assistant_reply
     }
+    gpt_service.tag_model(result, model, fallback_from)
+    if partial:
+        result["stream_id"] = partial.stream_id
+    return result
 
 async def handle_end_chat(task):
     """Clear chat context for given user & student."""
@@ -1,51 +1,43 @@
-from worker import db, config
-from worker.utils import encryption
-from worker.services import gpt_service, latex_service, storage_service
+from worker import db, config, results
+from worker.services import blob_service, gpt_cache, gpt_service, latex_service, storage_service, usage_meter
 
 async def handle_generate_plan(task):
     user_id = task["user_id"]
     student_id = task["student_id"]
     description = task["description"]
-    # Fetch student data
-    student_row = await db.get_student(student_id)
-    subject = ""
-    level = ""
-    if student_row:
-        subject = encryption.decrypt_str(student_row["subject_enc"]) if student_row["subject_enc"] else ""
-        level = encryption.decrypt_str(student_row["level_enc"]) if student_row["level_enc"] else ""
+    # User and student data in one query (cached briefly per user/student)
+    ctx = await db.get_task_context(user_id, student_id)
+    subject = ctx.subject
+    level = ctx.level
     # Compose prompt for GPT
     prompt = (f"Сгенерируй учебный план по предмету {subject or 'N/A'}, уровень {level or 'N/A'}, учитывая: {description}. "
               f"Предоставь план как список тем или занятий.")
     messages = [{"role": "user", "content": prompt}]
     # Choose model based on user plan
-    user = await db.get_user(user_id)
     model = "gpt-3.5-turbo"
-    if user and user["plan"] == "premium":
+    if ctx.plan == "premium":
         model = "gpt-4"  # use GPT-4 for premium users
+    # Модель с открытым circuit breaker'ом заменяется запасной (результат помечается для бота)
+    model, fallback_from, ticket = gpt_service.router.resolve(model)
     # Ask GPT
-    answer = await gpt_service.ask_gpt(messages, model=model)
+    # Response cache is opt-in per task type and bypassed for "refine" requests
+    use_cache = gpt_cache.enabled_for("generate_plan") and not task.get("refine")
+    # Stream the plan to the bot while it is being generated
+    partial = results.PartialPublisher(task, kind="plan") if results.stream_enabled("generate_plan") else None
+    answer = await gpt_service.ask_gpt(messages, model=model, use_cache=use_cache, on_partial=partial, ticket=ticket)
     plan_text = answer.strip() if answer else "(Нет ответа)"
     # Try to generate PDF
-    pdf_path = latex_service.generate_plan_pdf(plan_text)
+    pdf_bytes = await latex_service.generate_plan_pdf(plan_text)
     file_url = None
-    file_data_b64 = None
     # If user has Yandex Disk, upload there
-    if user and user["ydisk_token_enc"]:
-        token = encryption.decrypt_str(user["ydisk_token_enc"])
-        if token:
-            # Use a default remote path
-            remote_path = f"AI_Tutor/Plan_{student_id}.pdf"
-            success = await storage_service.upload_to_yadisk(token, pdf_path, remote_path) if pdf_path else False
-            if success:
-                file_url = "yadisk"
-    # If no Yandex Disk or upload failed, we will return file content (base64) to send via Telegram
-    if file_url is None and pdf_path:
-        # Read file and encode to base64
-        import base64
-        with open(pdf_path, "rb") as f:
-            file_data_b64 = base64.b64encode(f.read()).decode('utf-8')
+    if ctx.ydisk_token:
+        # Use a default remote path
+        remote_path = f"AI_Tutor/Plan_{student_id}.pdf"
+        success = await storage_service.upload_pdf(ctx.ydisk_token, pdf_bytes, remote_path)
+        if success:
+            file_url = "yadisk"
     # Increment usage count
-    await db.increment_usage(user_id)
+    await usage_meter.record(user_id)
     # Prepare result message
     result = {
         "type": "plan",
@@ -54,6 +46,10 @@ async def handle_generate_plan(task):
         "plan_text": plan_text,
         "file_url": file_url
     }
-    if file_data_b64:
-        result["file"] = file_data_b64
+    gpt_service.tag_model(result, model, fallback_from)
+    # If no Yandex Disk or upload failed, the PDF is sent via Telegram (blob reference or inline)
+    if file_url is None and pdf_bytes:
+        await blob_service.attach_pdf(result, pdf_bytes)
+    if partial:
+        result["stream_id"] = partial.stream_id
     return result
@@ -0,0 +1,69 @@
+import asyncio
+import logging
+import uuid
+
+from worker import db, config, results
+from worker.tasks import generate_tasks
+
+async def handle_generate_tasks_batch(task):
+    """
+    Generate tasks from one description for several students of the same user.
+    Student profiles are loaded in one query, students are processed with bounded
+    parallelism, and each student's result is published as soon as it is ready.
+    Returns the final batch summary.
+    """
+    user_id = task["user_id"]
+    student_ids = [int(sid) for sid in task.get("student_ids") or []]
+    batch_id = task.get("task_id") or uuid.uuid4().hex
+    # Контекст пользователя загружается один раз, профили учеников — одним запросом
+    user_ctx = await db.get_task_context(user_id)
+    rows = await db.get_students(user_id, student_ids) if student_ids else []
+    semaphore = asyncio.Semaphore(max(1, config.BATCH_PARALLELISM))
+
+    async def run_one(row) -> bool:
+        async with semaphore:
+            # Свой task_id у результата каждого ученика: при повторной доставке пакета готовые
+            # ученики не пересчитываются, а их результат повторяется (бот отбросит уже доставленный)
+            student_task_id = f"{batch_id}:{row['id']}"
+            result = None
+            try:
+                result = await results.get_completed(student_task_id)
+            except Exception as e:
+                logging.warning(f"⚠️ Completed-task lookup failed, processing {student_task_id}: {e}")
+            student_task = {
+                "type": "generate_tasks",
+                "user_id": user_id,
+                "student_id": row["id"],
+                "description": task["description"],
+            }
+            try:
+                if result is None:
+                    result = await generate_tasks.generate_for_student(student_task, user_ctx.with_student(row))
+                    result["task_id"] = student_task_id
+                    result["batch_id"] = batch_id
+                    result["student_name"] = row["name"]
+                    # Запоминаем до публикации: упадём после неё — повтор не пересчитает ученика
+                    try:
+                        await results.save_completed(student_task_id, result)
+                    except Exception as e:
+                        logging.warning(f"⚠️ Failed to store result of {student_task_id}: {e}")
+                else:
+                    logging.info(f"↩️ Batch {batch_id}: student {row['id']} was already done, replaying the result")
+                await results.publish(result)
+                return True
+            except Exception:
+                logging.exception(f"🔴 Batch {batch_id}: failed for student {row['id']}")
+                return False
+
+    outcomes = await asyncio.gather(*(run_one(row) for row in rows))
+    found = {row["id"] for row in rows}
+    succeeded = sum(1 for ok in outcomes if ok)
+    return {
+        "type": "batch_summary",
+        "user_id": user_id,
+        "batch_id": batch_id,
+        "total": len(student_ids),
+        "succeeded": succeeded,
+        "failed": [row["id"] for row, ok in zip(rows, outcomes) if not ok],
+        "missing": [sid for sid in student_ids if sid not in found],
+    }
@@ -1,6 +1,7 @@
 from Crypto.Cipher import AES
 import base64
 from worker import config
+from common import envelope
 
 KEY = config.ENCRYPTION_KEY
 
@@ -18,3 +19,18 @@ def decrypt_str(encrypted_base64: str) -> str:
         return plaintext_bytes.decode('utf-8')
     except Exception:
         return ""
+
+def encrypt_profile(profile: dict) -> bytes:
+    return envelope.seal_profile(KEY, profile)
+
+def decrypt_profile(row) -> dict:
+    """Decrypt a student row: profile_enc envelope, or legacy *_enc columns if not migrated yet."""
+    if row["profile_enc"]:
+        try:
+            return envelope.open_profile(KEY, row["profile_enc"])
+        except envelope.EnvelopeError:
+            return {field: "" for field in envelope.PROFILE_FIELDS}
+    return {
+        field: decrypt_str(row[f"{field}_enc"]) if row[f"{field}_enc"] else ""
+        for field in envelope.PROFILE_FIELDS
+    }